@@ -117,6 +117,24 @@ DATABASES = {
     )
 }
 
+# Caché: memoria local en desarrollo y Redis compartido entre procesos si se define REDIS_URL
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'aquasmart',
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -313,3 +331,79 @@ AUTHENTICATION_BACKENDS = [
 
 AUDITLOG_INCLUDE_ADMIN = True
 AUDITLOG_EXCLUDE_TRACKING = []
+
+# Auditoría de las mediciones de caudal: 'row' (por fila), 'batch' (resumen por envío, escrito en segundo plano) o 'exclude'
+CAUDAL_AUDIT_MODE = os.environ.get('CAUDAL_AUDIT_MODE', 'batch')
+CAUDAL_AUDIT_FLUSH_INTERVAL = 5.0  # Segundos entre escrituras de los resúmenes de auditoría
+CAUDAL_AUDIT_MAX_KEYS = 100  # Máximo de predios, lotes o dispositivos listados por resumen
+
+# Ingesta masiva de mediciones de caudal
+CAUDAL_BULK_MAX_READINGS = 10000  # Máximo de lecturas por envío
+CAUDAL_BULK_BATCH_SIZE = 1000  # Tamaño de lote para bulk_create
+CAUDAL_COPY_THRESHOLD = 5000  # En PostgreSQL, los envíos desde este tamaño se insertan con COPY
+CAUDAL_SEQUENCE_MAX_RANGES = 100  # Rangos de secuencias faltantes listados por dispositivo
+CAUDAL_BALANCE_TOLERANCE = 0.05  # Margen permitido entre la suma de los lotes y el caudal del predio
+CAUDAL_BALANCE_ALLOWED_LATENESS = 3600  # Segundos que una ventana de balance cerrada acepta lecturas tardías antes de finalizarse
+CAUDAL_ROLLUP_MAX_POINTS = 1000  # Máximo de intervalos por consulta de agregados con intervalo automático
+CAUDAL_DOWNSAMPLE_MAX_POINTS = 5000  # Máximo de puntos con `points=N` en el historial de mediciones
+CAUDAL_EXPORT_CHUNK_SIZE = 2000  # Filas leídas del cursor y emitidas por bloque en las exportaciones
+CAUDAL_LATEST_CACHE_TIMEOUT = None  # Segundos que se conserva la última lectura en caché (None = sin vencimiento)
+CAUDAL_LATEST_MAX_IDS = 500  # Máximo de ids por consulta de últimas lecturas
+CAUDAL_STREAM_QUEUE_SIZE = 1000  # Eventos en espera por visor en vivo antes de descartar
+CAUDAL_STREAM_KEEPALIVE_SECONDS = 15  # Comentario SSE periódico para mantener abierta la conexión
+
+# Ingesta con búfer: 'sync' escribe en la petición, 'buffered' encola y escribe por lotes en segundo plano
+CAUDAL_INGEST_MODE = os.environ.get('CAUDAL_INGEST_MODE', 'sync')
+CAUDAL_BUFFER_CAPACITY = 50000  # Lecturas en espera antes de responder 429
+CAUDAL_BUFFER_BATCH_SIZE = 2000  # Lecturas por escritura
+CAUDAL_BUFFER_FLUSH_INTERVAL = 1.0  # Segundos máximos que una lectura espera en el búfer
+CAUDAL_BUFFER_DRAIN_TIMEOUT = 30.0  # Segundos para vaciar el búfer al cerrar el proceso
+CAUDAL_BUFFER_MAX_RETRIES = 5  # Reintentos de un lote cuya escritura falla
+CAUDAL_BUFFER_RETRY_BASE_SECONDS = 1.0  # Espera antes del primer reintento; se duplica en cada intento
+CAUDAL_BUFFER_DEAD_LETTER_PATH = os.environ.get('CAUDAL_BUFFER_DEAD_LETTER_PATH', os.path.join(BASE_DIR, 'caudal_dead_letter.ndjson'))  # Lotes no escritos tras agotar los reintentos
+
+# Detección de anomalías: sobrescribe los umbrales por defecto de caudal/analytics.py (p. ej. {'z_threshold': 3.5})
+CAUDAL_ANOMALY_PARAMS = {}
+
+# Integración de volumen por lote: tratamiento de intervalos sin lecturas más largos que el máximo
+CAUDAL_VOLUME_GAP_POLICY = 'hold'  # 'interpolate', 'hold' (último caudal) o 'zero' (sin flujo)
+CAUDAL_VOLUME_MAX_GAP_SECONDS = 900
+
+# Mapa en memoria de dispositivos IoT (iot/device_map.py)
+IOT_DEVICE_MAP_CHECK_SECONDS = 1.0  # Cada cuánto se compara la versión del mapa en la caché compartida
+IOT_DEVICE_MAP_MAX_AGE = 60  # Segundos tras los cuales el mapa se recarga aunque la versión no cambie
+
+# Envío de consignas a las válvulas (iot/valves.py, run_valve_dispatcher)
+IOT_ESP32_HOST = os.environ.get('IOT_ESP32_HOST', '172.20.10.2')  # Controlador de las válvulas sin DeviceEndpoint registrado
+IOT_ESP32_PORT = int(os.environ.get('IOT_ESP32_PORT', 80))
+IOT_ESP32_MAX_CONCURRENCY = 1  # Peticiones simultáneas al controlador por defecto
+IOT_VALVE_TIMEOUT = 3.0  # Segundos de espera por respuesta del ESP32
+IOT_VALVE_WORKERS = 8  # Hilos de envío del despachador
+IOT_VALVE_MAX_ATTEMPTS = 8  # Intentos antes de marcar la consigna como fallida
+IOT_VALVE_RETRY_BASE_SECONDS = 2.0  # Espera tras el primer fallo; se duplica en cada intento
+IOT_VALVE_RETRY_MAX_SECONDS = 300.0
+IOT_VALVE_SENDING_TIMEOUT = 60.0  # Segundos tras los cuales una consigna "enviando" se considera interrumpida
+IOT_VALVE_BATCH_MAX = 1000  # Máximo de consignas por envío en update-flow/batch
+
+# Actividad de los dispositivos y detección de dispositivos caídos (iot/heartbeat.py, scan_offline_devices)
+IOT_HEARTBEAT_FLUSH_INTERVAL = 5.0  # Segundos entre escrituras de `last_seen`
+IOT_HEARTBEAT_INTERVAL = 300  # Segundos esperados entre reportes si el dispositivo no define el suyo
+IOT_OFFLINE_MISSED_INTERVALS = 3  # Intervalos sin reportar para marcar un dispositivo fuera de línea
+IOT_OFFLINE_FULL_SYNC_SECONDS = 3600  # Cada cuánto el detector recorre la flota completa
+
+# Telemetría genérica de dispositivos que no son de caudal (iot/telemetry.py)
+IOT_TELEMETRY_MAX_READINGS = 10000  # Máximo de lecturas por envío
+IOT_TELEMETRY_BATCH_SIZE = 1000  # Tamaño de lote para bulk_create
+
+# Pasarela UDP de telemetría (run_telemetry_gateway)
+CAUDAL_GATEWAY_HOST = os.environ.get('CAUDAL_GATEWAY_HOST', '0.0.0.0')
+CAUDAL_GATEWAY_PORT = int(os.environ.get('CAUDAL_GATEWAY_PORT', 5683))
+CAUDAL_GATEWAY_RECEIVE_BUFFER_BYTES = 4 * 1024 * 1024  # Búfer del socket UDP para ráfagas de datagramas
+# Datagramas firmados con HMAC-SHA256 (IoTDevice.telemetry_key); desactivar solo en una red aislada de confianza
+CAUDAL_GATEWAY_REQUIRE_SIGNATURE = os.environ.get('CAUDAL_GATEWAY_REQUIRE_SIGNATURE', 'True') == 'True'
+
+# Particiones mensuales (PostgreSQL) y retención de mediciones de caudal
+CAUDAL_PARTITION_MONTHS_AHEAD = 3  # Meses futuros con partición creada por adelantado
+CAUDAL_RETENTION_MONTHS = None  # Meses anteriores al actual que se conservan (None = sin retención)
+CAUDAL_RETENTION_MODE = 'archive'  # 'drop' elimina las particiones vencidas, 'archive' las mueve de esquema
+CAUDAL_RETENTION_ARCHIVE_SCHEMA = 'caudal_archive'
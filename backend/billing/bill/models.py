@@ -1,4 +1,5 @@
 from django.db import models
+from auditlog.registry import auditlog
 from django.utils import timezone
 from datetime import timedelta
 from billing.company.models import Company
@@ -154,4 +155,7 @@ class Bill(models.Model):
             if self.status == 'pagada':
                 self.payment_date = timezone.now().date()
 
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+
+auditlog.register(Bill)
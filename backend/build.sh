@@ -11,6 +11,10 @@ python manage.py collectstatic --no-input
 # Apply any outstanding database migrations
 python manage.py migrate
 
+# Pre-create monthly measurement partitions only; the retention policy runs as a
+# separately scheduled `python manage.py manage_flow_partitions` job
+python manage.py manage_flow_partitions --create-only
+
 if [[ $CREATE_SUPERUSER ]]; then
   python createsuperuser.py
 fi
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import FlowMeasurementPredio, FlowMeasurementLote, FlowInconsistency
+from .models import FlowMeasurementPredio, FlowMeasurementLote, FlowInconsistency, FlowAnomaly
 
 @admin.register(FlowMeasurementPredio)
 class FlowMeasurementPredioAdmin(admin.ModelAdmin):
@@ -17,4 +17,10 @@ class FlowMeasurementLoteAdmin(admin.ModelAdmin):
 class FlowInconsistencyAdmin(admin.ModelAdmin):
     list_display = ('id', 'plot', 'recorded_flow', 'total_lots_flow', 'difference', 'timestamp')
     search_fields = ('plot__plot_name',)
-    list_filter = ('timestamp',)
\ No newline at end of file
+    list_filter = ('timestamp',)
+
+@admin.register(FlowAnomaly)
+class FlowAnomalyAdmin(admin.ModelAdmin):
+    list_display = ('id', 'device', 'kind', 'flow_rate', 'baseline', 'score', 'timestamp')
+    search_fields = ('device__iot_id',)
+    list_filter = ('kind', 'timestamp')
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CaudalConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'caudal'
+
+    def ready(self):
+        import caudal.signals  # Registrar las señales
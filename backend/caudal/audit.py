@@ -0,0 +1,153 @@
+"""
+Auditoría de las tablas de mediciones de caudal.
+
+Las mediciones son datos de telemetría de solo inserción y de alto volumen: con una
+entrada de auditlog por fila cada lectura escribe además un `LogEntry` en la misma
+transacción. `CAUDAL_AUDIT_MODE` define cómo se auditan `FlowMeasurement`,
+`FlowMeasurementPredio` y `FlowMeasurementLote`:
+
+- `row`: una entrada de auditlog por fila, como el resto de modelos registrados.
+- `batch`: las inserciones confirmadas se acumulan en memoria y un hilo en segundo
+  plano escribe cada `flush_interval` segundos una entrada compacta por modelo y
+  petición de origen (`cid` y dirección remota de auditlog), con la cantidad de
+  lecturas, el rango de fechas y los predios, lotes o dispositivos involucrados.
+- `exclude`: las mediciones no se auditan.
+
+Las ediciones y eliminaciones de mediciones solo quedan auditadas en modo `row`. Los
+modelos administrativos (dispositivos, facturas, inconsistencias) conservan siempre
+la auditoría por fila.
+"""
+import atexit
+import logging
+import threading
+from auditlog.cid import get_cid
+from auditlog.context import auditlog_value
+from auditlog.models import LogEntry
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+AUDIT_MODES = ('row', 'batch', 'exclude')
+DEFAULT_AUDIT_MODE = 'batch'
+DEFAULT_AUDIT_FLUSH_INTERVAL = 5.0
+DEFAULT_AUDIT_MAX_KEYS = 100
+
+
+def get_audit_mode():
+    mode = getattr(settings, 'CAUDAL_AUDIT_MODE', DEFAULT_AUDIT_MODE)
+    if mode not in AUDIT_MODES:
+        raise ValueError(f"Modo de auditoría inválido: {mode}.")
+    return mode
+
+
+def _clave(medicion):
+    return getattr(medicion, 'lot_id', None) or getattr(medicion, 'plot_id', None) or medicion.device_id
+
+
+class AuditBatcher:
+    """Resúmenes de inserciones por `(modelo, cid, dirección remota)` pendientes de escribir."""
+
+    def __init__(self, flush_interval=None, max_keys=None):
+        self.flush_interval = flush_interval or getattr(settings, 'CAUDAL_AUDIT_FLUSH_INTERVAL', DEFAULT_AUDIT_FLUSH_INTERVAL)
+        self.max_keys = max_keys or getattr(settings, 'CAUDAL_AUDIT_MAX_KEYS', DEFAULT_AUDIT_MAX_KEYS)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def record(self, mediciones, cid=None, remote_addr=None):
+        with self._lock:
+            for medicion in mediciones:
+                group = (type(medicion), cid, remote_addr)
+                summary = self._pending.get(group)
+                if summary is None:
+                    summary = self._pending[group] = {'count': 0, 'from': medicion.timestamp, 'to': medicion.timestamp, 'keys': set(), 'truncated': False}
+                summary['count'] += 1
+                summary['from'] = min(summary['from'], medicion.timestamp)
+                summary['to'] = max(summary['to'], medicion.timestamp)
+                key = _clave(medicion)
+                if key not in summary['keys']:
+                    if len(summary['keys']) < self.max_keys:
+                        summary['keys'].add(key)
+                    else:
+                        summary['truncated'] = True
+
+    def flush(self):
+        """Escribe una entrada de auditoría por grupo pendiente. Retorna cuántas se escribieron."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        entries = [
+            LogEntry(
+                content_type=ContentType.objects.get_for_model(model),
+                object_pk='',
+                object_repr=f"{summary['count']} {model._meta.verbose_name_plural}",
+                action=LogEntry.Action.CREATE,
+                cid=cid,
+                remote_addr=remote_addr,
+                additional_data={
+                    'batch': True,
+                    'count': summary['count'],
+                    'from': summary['from'].isoformat(),
+                    'to': summary['to'].isoformat(),
+                    'keys': sorted(str(key) for key in summary['keys']),
+                    'keys_truncated': summary['truncated'],
+                },
+            )
+            for (model, cid, remote_addr), summary in pending.items()
+        ]
+        try:
+            LogEntry.objects.bulk_create(entries)
+        except Exception:
+            logger.exception("No se pudieron escribir %s entradas de auditoría de mediciones", len(entries))
+            return 0
+        return len(entries)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='caudal-audit-writer', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            self.flush()
+            close_old_connections()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher():
+    """Escritor de auditoría del proceso, creado y arrancado en el primer uso."""
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = AuditBatcher().start()
+            atexit.register(_batcher.stop)
+        return _batcher
+
+
+def auditar_mediciones(mediciones):
+    """En modo `batch`, registra las mediciones insertadas al confirmarse la transacción."""
+    if get_audit_mode() != 'batch':
+        return
+    mediciones = list(mediciones)
+    if not mediciones:
+        return
+    # El origen se toma ahora: el contexto de auditlog pertenece a la petición en curso
+    context = auditlog_value.get({})
+    cid, remote_addr = get_cid(), context.get('remote_addr')
+    transaction.on_commit(lambda: get_batcher().record(mediciones, cid, remote_addr))
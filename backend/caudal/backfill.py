@@ -0,0 +1,192 @@
+"""
+Recalculo histórico de las inconsistencias de balance predio/lote.
+
+Al cambiar la tolerancia hay que volver a evaluar años de historia. El historial se
+divide por predio (las ventanas de balance no cruzan predios) y cada predio se
+recalcula por separado, de modo que los predios se reparten entre procesos de un
+`ProcessPoolExecutor`:
+
+- Las mediciones del predio y de sus lotes se recorren en orden cronológico con dos
+  cursores por bloques mezclados, sin cargar el historial en memoria; solo se
+  mantiene la ventana en curso.
+- Cada ventana cerrada (de una medición de predio a la siguiente) se guarda en
+  `PlotBalanceWindow` y, si está finalizada y la suma de los lotes supera el caudal
+  del predio más la tolerancia, genera una `FlowInconsistency` con su rango. La
+  ventana vigente se evalúa como en la verificación en vivo.
+- Ventanas e inconsistencias se escriben con `bulk_create` por bloques, en una
+  transacción por predio que reemplaza las anteriores del predio. Al no pasar por
+  `save()`, no generan entradas de auditlog ni eventos en vivo.
+
+El comando `backfill_flow_inconsistencies` guarda tras cada predio un punto de
+control con los predios terminados para poder retomarse.
+"""
+import heapq
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from django.db import transaction
+from django.db.models import Max
+from .models import FlowMeasurementPredio, FlowMeasurementLote, FlowInconsistency, PlotFlowBalance, PlotBalanceWindow
+from .balance import get_tolerance, get_allowed_lateness, reconstruir_ventana
+
+DEFAULT_CHUNK_SIZE = 5000
+PREDIO, LOTE = 0, 1  # Con la misma fecha, la medición de predio abre la ventana antes de sumar lotes
+
+
+def _lecturas(plot_id, chunk_size):
+    """`(fecha, tipo, caudal)` del predio y sus lotes en orden cronológico."""
+    predio = (
+        (timestamp, PREDIO, flow_rate) for timestamp, flow_rate in
+        FlowMeasurementPredio.objects.filter(plot_id=plot_id).order_by('timestamp', 'id')
+        .values_list('timestamp', 'flow_rate').iterator(chunk_size=chunk_size)
+    )
+    lotes = (
+        (timestamp, LOTE, flow_rate) for timestamp, flow_rate in
+        FlowMeasurementLote.objects.filter(lot__plot_id=plot_id).order_by('timestamp', 'id')
+        .values_list('timestamp', 'flow_rate').iterator(chunk_size=chunk_size)
+    )
+    return heapq.merge(predio, lotes, key=lambda lectura: lectura[:2])
+
+
+def _fecha_maxima(plot_id):
+    fechas = [
+        FlowMeasurementPredio.objects.filter(plot_id=plot_id).aggregate(Max('timestamp'))['timestamp__max'],
+        FlowMeasurementLote.objects.filter(lot__plot_id=plot_id).aggregate(Max('timestamp'))['timestamp__max'],
+    ]
+    fechas = [fecha for fecha in fechas if fecha]
+    return max(fechas) if fechas else None
+
+
+def _inconsistencia(plot_id, window_start, window_end, recorded_flow, total):
+    return FlowInconsistency(
+        plot_id=plot_id,
+        recorded_flow=recorded_flow,
+        total_lots_flow=total,
+        difference=total - recorded_flow,
+        window_start=window_start,
+        window_end=window_end,
+    )
+
+
+def recalcular_predio(plot_id, tolerance=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Recalcula las ventanas e inconsistencias de un predio. Retorna el resumen del predio."""
+    tolerance = get_tolerance() if tolerance is None else tolerance
+    resumen = {'plot': plot_id, 'readings': 0, 'windows': 0, 'inconsistencies': 0}
+    with transaction.atomic():
+        # Bloquea el balance del predio: la ingesta en vivo espera a que termine el recálculo
+        PlotFlowBalance.objects.select_for_update().filter(plot_id=plot_id).first()
+        PlotBalanceWindow.objects.filter(plot_id=plot_id).delete()
+        FlowInconsistency.objects.filter(plot_id=plot_id).delete()
+
+        fecha_maxima = _fecha_maxima(plot_id)
+        if fecha_maxima is None:
+            reconstruir_ventana(plot_id)
+            return resumen
+        marca_de_agua = fecha_maxima - get_allowed_lateness()
+
+        ventanas, inconsistencias = [], []
+
+        def escribir():
+            PlotBalanceWindow.objects.bulk_create(ventanas, batch_size=chunk_size)
+            FlowInconsistency.objects.bulk_create(inconsistencias, batch_size=chunk_size)
+            resumen['windows'] += len(ventanas)
+            resumen['inconsistencies'] += len(inconsistencias)
+            ventanas.clear()
+            inconsistencias.clear()
+
+        inicio = caudal_predio = None
+        total = 0.0
+        for timestamp, tipo, flow_rate in _lecturas(plot_id, chunk_size):
+            resumen['readings'] += 1
+            if tipo == LOTE:
+                # Las lecturas anteriores a la primera medición del predio no tienen ventana
+                if inicio is not None:
+                    total += flow_rate
+                continue
+            if inicio is not None and timestamp > inicio:
+                finalizada = timestamp <= marca_de_agua
+                excede = total > caudal_predio * (1 + tolerance)
+                ventanas.append(PlotBalanceWindow(
+                    plot_id=plot_id, window_start=inicio, window_end=timestamp, recorded_flow=caudal_predio,
+                    lots_flow_total=total, finalized=finalizada, inconsistent=excede and finalizada,
+                ))
+                if excede and finalizada:
+                    inconsistencias.append(_inconsistencia(plot_id, inicio, timestamp, caudal_predio, total))
+                if len(ventanas) >= chunk_size:
+                    escribir()
+                total = 0.0
+            inicio, caudal_predio = timestamp, flow_rate
+
+        if inicio is not None and total > caudal_predio * (1 + tolerance):
+            inconsistencias.append(_inconsistencia(plot_id, inicio, None, caudal_predio, total))
+        escribir()
+
+        reconstruir_ventana(plot_id)
+        PlotFlowBalance.objects.filter(plot_id=plot_id).update(max_event_time=fecha_maxima)
+    return resumen
+
+
+def _iniciar_worker(settings_module):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+
+def recalcular_predios(plot_ids, workers=1, tolerance=None, chunk_size=DEFAULT_CHUNK_SIZE, max_tasks_per_child=None):
+    """
+    Recalcula varios predios y genera el resumen de cada uno a medida que terminan.
+
+    Con `workers > 1` los predios se reparten entre procesos nuevos (`spawn`), cada uno
+    con su propia conexión a la base de datos; `max_tasks_per_child` recicla los
+    procesos para acotar su memoria.
+    """
+    if workers <= 1:
+        for plot_id in plot_ids:
+            yield recalcular_predio(plot_id, tolerance, chunk_size)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=get_context('spawn'),
+        initializer=_iniciar_worker,
+        initargs=(os.environ['DJANGO_SETTINGS_MODULE'],),
+        max_tasks_per_child=max_tasks_per_child,
+    ) as executor:
+        futures = [executor.submit(recalcular_predio, plot_id, tolerance, chunk_size) for plot_id in plot_ids]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+class Checkpoint:
+    """Predios ya recalculados con una tolerancia, guardados en un archivo JSON tras cada predio."""
+
+    def __init__(self, path, tolerance):
+        self.path = path
+        self.tolerance = tolerance
+        self.done = set()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return self
+        with open(self.path, encoding='utf-8') as file:
+            data = json.load(file)
+        if data.get('tolerance') != self.tolerance:
+            raise ValueError(
+                f"El punto de control {self.path} es de la tolerancia {data.get('tolerance')}, no de {self.tolerance}."
+            )
+        self.done = set(data.get('done', []))
+        return self
+
+    def mark(self, plot_id):
+        self.done.add(plot_id)
+        # Escritura atómica: un corte a mitad de escritura no corrompe el punto de control
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump({'tolerance': self.tolerance, 'done': sorted(self.done)}, file)
+        os.replace(temporary, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.done = set()
@@ -0,0 +1,307 @@
+"""
+Motor incremental de balance de caudal predio/lote.
+
+Mantiene en `PlotFlowBalance` la ventana vigente de cada predio (desde su última
+medición) junto con la suma de caudales de los lotes medidos en ella. Cada lectura
+de lote suma su caudal al total en O(1) y la ventana solo se recalcula con un
+agregado cuando llega una nueva medición de predio o cuando se editan o eliminan
+mediciones existentes.
+
+Produce las mismas `FlowInconsistency` que la verificación original, que sumaba
+todas las lecturas de la ventana en cada inserción.
+
+Las fechas las asigna el dispositivo, así que las lecturas pueden llegar fuera de
+orden. Al llegar una medición de predio más reciente, la ventana vigente se cierra en
+`PlotBalanceWindow` y las lecturas con fecha anterior se asignan a la ventana cerrada
+que les corresponde:
+
+- Una lectura de lote tardía se suma a su ventana; una medición de predio tardía
+  divide la ventana que la contiene en dos, recalculando solo esas dos.
+- La marca de agua de cada predio es la fecha más reciente recibida menos
+  `CAUDAL_BALANCE_ALLOWED_LATENESS` segundos. Una ventana cuyo fin queda detrás de la
+  marca de agua se finaliza: se evalúa con sus totales definitivos y se guarda una
+  inconsistencia si la suma de los lotes supera el caudal del predio.
+- Lo que llega para una ventana ya finalizada la recalcula con un agregado sobre su
+  rango (sin recorrer el resto del historial) y la evalúa de nuevo.
+"""
+import logging
+from bisect import bisect_right
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from .models import FlowMeasurementPredio, FlowMeasurementLote, FlowInconsistency, PlotFlowBalance, PlotBalanceWindow
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOLERANCE = 0.05  # 5% de margen
+DEFAULT_ALLOWED_LATENESS = 3600  # Segundos que se esperan lecturas tardías antes de finalizar una ventana
+
+
+def get_tolerance():
+    return getattr(settings, 'CAUDAL_BALANCE_TOLERANCE', DEFAULT_TOLERANCE)
+
+
+def get_allowed_lateness():
+    return timedelta(seconds=getattr(settings, 'CAUDAL_BALANCE_ALLOWED_LATENESS', DEFAULT_ALLOWED_LATENESS))
+
+
+def _total_lotes_desde(plot_id, inicio, fin=None):
+    queryset = FlowMeasurementLote.objects.filter(lot__plot_id=plot_id, timestamp__gte=inicio)
+    if fin is not None:
+        queryset = queryset.filter(timestamp__lt=fin)
+    return queryset.aggregate(Sum('flow_rate'))['flow_rate__sum'] or 0
+
+
+def _excede(ventana):
+    return ventana.lots_flow_total > ventana.recorded_flow * (1 + get_tolerance())
+
+
+def _avanzar_marca_de_agua(balance, timestamp):
+    if balance.max_event_time is None or timestamp > balance.max_event_time:
+        balance.max_event_time = timestamp
+
+
+def finalizar_ventanas(predio, balance):
+    """Finaliza y evalúa las ventanas cerradas que quedaron detrás de la marca de agua del predio."""
+    if balance.max_event_time is None:
+        return []
+    marca_de_agua = balance.max_event_time - get_allowed_lateness()
+    ventanas = list(
+        PlotBalanceWindow.objects.select_for_update()
+        .filter(plot_id=predio.pk, finalized=False, window_end__lte=marca_de_agua)
+    )
+    for ventana in ventanas:
+        ventana.finalized = True
+        evaluar_ventana(predio, ventana)
+    return ventanas
+
+
+def evaluar_ventana(predio, ventana):
+    """Evalúa una ventana cerrada; solo guarda una inconsistencia si la ventana pasa a exceder el margen."""
+    excede = _excede(ventana)
+    inconsistencia = None
+    if excede and not ventana.inconsistent and ventana.finalized:
+        inconsistencia = evaluar_balance(predio, ventana, window_end=ventana.window_end)
+    if ventana.finalized:
+        ventana.inconsistent = excede
+    ventana.save()
+    return inconsistencia
+
+
+def _cerrar_ventana(balance, fin, total_restante):
+    """Guarda la ventana vigente como cerrada en `fin`; `total_restante` es lo que pasa a la nueva ventana."""
+    PlotBalanceWindow.objects.update_or_create(
+        plot_id=balance.plot_id, window_start=balance.window_start,
+        defaults={
+            'window_end': fin,
+            'recorded_flow': balance.recorded_flow,
+            'lots_flow_total': balance.lots_flow_total - total_restante,
+            # La ventana vigente ya se evaluó con cada lectura de lote
+            'inconsistent': balance.lots_flow_total - total_restante > balance.recorded_flow * (1 + get_tolerance()),
+            'finalized': False,
+        }
+    )
+
+
+def _medicion_predio_tardia(balance, medicion_predio):
+    """Una medición de predio anterior a la ventana vigente divide la ventana cerrada que la contiene."""
+    plot_id, inicio = medicion_predio.plot_id, medicion_predio.timestamp
+    contenedora = (
+        PlotBalanceWindow.objects.select_for_update()
+        .filter(plot_id=plot_id, window_start__lte=inicio, window_end__gt=inicio).first()
+    )
+    if contenedora is not None and contenedora.window_start == inicio:
+        contenedora.recorded_flow = medicion_predio.flow_rate
+        return [contenedora]
+
+    if contenedora is not None:
+        fin = contenedora.window_end
+    else:
+        # Anterior a todas las ventanas: llega hasta la primera ventana cerrada o la vigente
+        siguiente = PlotBalanceWindow.objects.filter(plot_id=plot_id, window_start__gt=inicio).order_by('window_start').first()
+        fin = siguiente.window_start if siguiente else balance.window_start
+
+    nueva = PlotBalanceWindow(
+        plot_id=plot_id, window_start=inicio, window_end=fin, recorded_flow=medicion_predio.flow_rate,
+        lots_flow_total=_total_lotes_desde(plot_id, inicio, fin),
+        finalized=contenedora.finalized if contenedora else False,
+    )
+    if contenedora is None:
+        return [nueva]
+    contenedora.window_end = inicio
+    contenedora.lots_flow_total -= nueva.lots_flow_total
+    return [contenedora, nueva]
+
+
+def abrir_ventana(medicion_predio, forzar=False):
+    """
+    Abre la ventana de balance a partir de una medición de predio.
+
+    Solo la medición más reciente del predio abre ventana y cierra la anterior. Una
+    medición con fecha anterior a la ventana vigente se asigna a las ventanas cerradas,
+    salvo que `forzar` sea verdadero (reconstrucción de la ventana vigente).
+    """
+    with transaction.atomic():
+        balance = PlotFlowBalance.objects.select_for_update().filter(plot_id=medicion_predio.plot_id).first()
+        if balance and not forzar and medicion_predio.timestamp < balance.window_start:
+            _avanzar_marca_de_agua(balance, medicion_predio.timestamp)
+            balance.save(update_fields=['max_event_time', 'updated_at'])
+            predio = medicion_predio.plot
+            for ventana in _medicion_predio_tardia(balance, medicion_predio):
+                evaluar_ventana(predio, ventana)
+            return balance
+
+        # Las lecturas de lote ya guardadas con fecha posterior pertenecen a la nueva ventana
+        total = _total_lotes_desde(medicion_predio.plot_id, medicion_predio.timestamp)
+        if balance is None:
+            balance = PlotFlowBalance(plot_id=medicion_predio.plot_id)
+        elif not forzar and medicion_predio.timestamp > balance.window_start:
+            _cerrar_ventana(balance, medicion_predio.timestamp, total)
+        balance.window_start = medicion_predio.timestamp
+        balance.recorded_flow = medicion_predio.flow_rate
+        balance.lots_flow_total = total
+        _avanzar_marca_de_agua(balance, medicion_predio.timestamp)
+        balance.save()
+        if not forzar:
+            finalizar_ventanas(medicion_predio.plot, balance)
+        return balance
+
+
+def reconstruir_ventana(plot_id):
+    """Recalcula la ventana de un predio desde la base de datos (tras ediciones o borrados)."""
+    ultima_medicion_predio = FlowMeasurementPredio.objects.filter(plot_id=plot_id).order_by('-timestamp').first()
+    if not ultima_medicion_predio:
+        PlotFlowBalance.objects.filter(plot_id=plot_id).delete()
+        PlotBalanceWindow.objects.filter(plot_id=plot_id).delete()
+        return None
+    # La ventana cerrada que empezaba en esa medición vuelve a ser la vigente
+    PlotBalanceWindow.objects.filter(plot_id=plot_id, window_start__gte=ultima_medicion_predio.timestamp).delete()
+    return abrir_ventana(ultima_medicion_predio, forzar=True)
+
+
+def unir_ventana(plot_id, timestamp):
+    """Al eliminar la medición de predio que abría una ventana cerrada, la ventana se une a la anterior."""
+    with transaction.atomic():
+        eliminada = PlotBalanceWindow.objects.select_for_update().filter(plot_id=plot_id, window_start=timestamp).first()
+        if eliminada is None:
+            return None
+        anterior = (
+            PlotBalanceWindow.objects.select_for_update()
+            .filter(plot_id=plot_id, window_end=timestamp).first()
+        )
+        eliminada.delete()
+        if anterior is not None:
+            anterior.window_end = eliminada.window_end
+            anterior.lots_flow_total += eliminada.lots_flow_total
+            anterior.save()
+        return anterior
+
+
+def descontar_lectura_lote(plot_id, timestamp, flow_rate):
+    """Resta una lectura de lote eliminada de la ventana (vigente o cerrada) a la que pertenecía."""
+    with transaction.atomic():
+        balance = PlotFlowBalance.objects.select_for_update().filter(plot_id=plot_id).first()
+        if balance and timestamp >= balance.window_start:
+            balance.lots_flow_total -= flow_rate
+            balance.save(update_fields=['lots_flow_total', 'updated_at'])
+        elif balance:
+            PlotBalanceWindow.objects.filter(plot_id=plot_id, window_start__lte=timestamp, window_end__gt=timestamp).update(
+                lots_flow_total=F('lots_flow_total') - flow_rate
+            )
+
+
+def evaluar_balance(predio, balance, window_end=None):
+    """Guarda una inconsistencia si la suma de los lotes supera el caudal del predio más el margen."""
+    max_allowed_flow = balance.recorded_flow * (1 + get_tolerance())
+    diferencia = balance.lots_flow_total - balance.recorded_flow
+
+    if balance.lots_flow_total > max_allowed_flow:
+        # 📌 Guardar inconsistencia sin validar tiempo
+        logger.info("Inconsistencia de caudal en el predio %s: diferencia %s", predio.id_plot, diferencia)
+        return FlowInconsistency.objects.create(
+            plot=predio,
+            recorded_flow=balance.recorded_flow,
+            total_lots_flow=balance.lots_flow_total,
+            difference=diferencia,
+            window_start=balance.window_start,
+            window_end=window_end,
+        )
+    return None
+
+
+def _lecturas_tardias(predio, lecturas):
+    """
+    Asigna lecturas de lote anteriores a la ventana vigente a sus ventanas cerradas.
+
+    Las ventanas aún abiertas a lecturas tardías suman el caudal en O(1); las ya
+    finalizadas se recalculan con un agregado sobre su propio rango.
+    """
+    fechas = [timestamp for timestamp, _ in lecturas]
+    ventanas = list(
+        PlotBalanceWindow.objects.select_for_update()
+        .filter(plot_id=predio.pk, window_start__lte=max(fechas), window_end__gt=min(fechas))
+        .order_by('window_start')
+    )
+    inicios = [ventana.window_start for ventana in ventanas]
+    deltas = {}
+    for timestamp, flow_rate in lecturas:
+        index = bisect_right(inicios, timestamp) - 1
+        # Sin ventana: la lectura es anterior a la primera medición del predio
+        if index >= 0 and timestamp < ventanas[index].window_end:
+            deltas[index] = deltas.get(index, 0) + flow_rate
+
+    for index, delta in deltas.items():
+        ventana = ventanas[index]
+        if ventana.finalized:
+            ventana.lots_flow_total = _total_lotes_desde(predio.pk, ventana.window_start, ventana.window_end)
+        else:
+            ventana.lots_flow_total += delta
+        evaluar_ventana(predio, ventana)
+
+
+def registrar_lecturas_lote(predio, lecturas, medicion_referencia):
+    """
+    Suma al balance del predio lecturas de lote ya guardadas y lo evalúa una vez.
+
+    `lecturas` es un iterable de `(timestamp, flow_rate)`. `medicion_referencia` es la
+    medición de lote que disparó la verificación: si el predio aún no tiene mediciones,
+    su caudal y dispositivo se usan para crear la primera. Las lecturas anteriores a la
+    ventana vigente se asignan a su ventana cerrada.
+    """
+    lecturas = list(lecturas)
+    with transaction.atomic():
+        balance = PlotFlowBalance.objects.select_for_update().filter(plot_id=predio.pk).first()
+
+        if balance is None:
+            ultima_medicion_predio = FlowMeasurementPredio.objects.filter(plot=predio).order_by('-timestamp').first()
+
+            # 🆕 Si no hay medición previa del predio, crear una nueva
+            if not ultima_medicion_predio:
+                logger.debug("Primera medición del predio %s creada con %s m³/s", predio.id_plot, medicion_referencia.flow_rate)
+                FlowMeasurementPredio.objects.create(
+                    plot=predio,
+                    flow_rate=medicion_referencia.flow_rate,  # Se toma el caudal del lote como base
+                    timestamp=timezone.now(),
+                    device=medicion_referencia.device  # Asignamos el mismo dispositivo que midió el lote
+                )
+                return None  # No validamos inconsistencia porque es la referencia inicial
+
+            # Predio con historial previo al motor: el agregado ya incluye las lecturas recién guardadas
+            balance = abrir_ventana(ultima_medicion_predio, forzar=True)
+        else:
+            delta = sum(flow_rate for timestamp, flow_rate in lecturas if timestamp >= balance.window_start)
+            tardias = [(timestamp, flow_rate) for timestamp, flow_rate in lecturas if timestamp < balance.window_start]
+            fields = ['lots_flow_total', 'updated_at']
+            if lecturas:
+                _avanzar_marca_de_agua(balance, max(timestamp for timestamp, _ in lecturas))
+                fields.append('max_event_time')
+            if delta or lecturas:
+                balance.lots_flow_total += delta
+                balance.save(update_fields=fields)
+            if tardias:
+                _lecturas_tardias(predio, tardias)
+            finalizar_ventanas(predio, balance)
+
+        return evaluar_balance(predio, balance)
@@ -0,0 +1,200 @@
+"""
+Escritura asíncrona de mediciones mediante un búfer acotado en memoria.
+
+En modo `buffered` el endpoint de ingesta masiva valida la forma de las lecturas,
+las coloca en el búfer y responde de inmediato (202). Un hilo en segundo plano
+las escribe por lotes con `ingest_readings` cuando se acumulan `batch_size`
+lecturas o pasan `flush_interval` segundos, lo que ocurra primero.
+
+El búfer tiene capacidad fija: si un envío no cabe se rechaza completo para que el
+dispositivo lo reintente (HTTP 429), y si el escritor no está disponible se
+responde HTTP 503. Al terminar el proceso se escriben las lecturas pendientes.
+
+Las lecturas ya se respondieron con 202, por lo que un lote cuya escritura falla no
+se descarta: se reintenta hasta `CAUDAL_BUFFER_MAX_RETRIES` veces con espera
+exponencial (`CAUDAL_BUFFER_RETRY_BASE_SECONDS`, duplicada por intento), sin dejar
+de ocupar capacidad mientras espera. Si se agotan los reintentos (o el proceso se
+cierra) se agrega como NDJSON a `CAUDAL_BUFFER_DEAD_LETTER_PATH`, que puede
+reenviarse tal cual al endpoint de ingesta masiva.
+
+El búfer es por proceso: con varios workers cada uno mantiene el suyo.
+"""
+import atexit
+import heapq
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from django.conf import settings
+from django.db import close_old_connections
+from .ingestion import ingest_readings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUFFER_CAPACITY = 50000
+DEFAULT_BUFFER_BATCH_SIZE = 2000
+DEFAULT_BUFFER_FLUSH_INTERVAL = 1.0
+DEFAULT_BUFFER_DRAIN_TIMEOUT = 30.0
+DEFAULT_BUFFER_MAX_RETRIES = 5
+DEFAULT_BUFFER_RETRY_BASE_SECONDS = 1.0
+
+
+class BufferFull(Exception):
+    """El búfer no tiene espacio para el envío completo."""
+
+
+class BufferUnavailable(Exception):
+    """El búfer se está cerrando o su escritor se detuvo."""
+
+
+def get_ingest_mode():
+    return getattr(settings, 'CAUDAL_INGEST_MODE', 'sync')
+
+
+def _serializable(reading):
+    return {
+        key: value.isoformat() if isinstance(value, datetime) else value
+        for key, value in reading.items() if key != 'index'
+    }
+
+
+class MeasurementBuffer:
+    def __init__(self, capacity=None, batch_size=None, flush_interval=None, writer=ingest_readings,
+                 max_retries=None, retry_base=None, dead_letter_path=None):
+        self.capacity = capacity or getattr(settings, 'CAUDAL_BUFFER_CAPACITY', DEFAULT_BUFFER_CAPACITY)
+        self.batch_size = batch_size or getattr(settings, 'CAUDAL_BUFFER_BATCH_SIZE', DEFAULT_BUFFER_BATCH_SIZE)
+        self.flush_interval = flush_interval or getattr(settings, 'CAUDAL_BUFFER_FLUSH_INTERVAL', DEFAULT_BUFFER_FLUSH_INTERVAL)
+        self.max_retries = max_retries if max_retries is not None else getattr(settings, 'CAUDAL_BUFFER_MAX_RETRIES', DEFAULT_BUFFER_MAX_RETRIES)
+        self.retry_base = retry_base or getattr(settings, 'CAUDAL_BUFFER_RETRY_BASE_SECONDS', DEFAULT_BUFFER_RETRY_BASE_SECONDS)
+        self.dead_letter_path = dead_letter_path or getattr(settings, 'CAUDAL_BUFFER_DEAD_LETTER_PATH', None)
+        self.writer = writer
+        self._pending = deque()
+        # Lotes fallidos `(hora de reintento, orden, intentos, lote)`, el más próximo primero
+        self._retries = []
+        self._retry_order = itertools.count()
+        self._condition = threading.Condition()
+        self._closing = False
+        self._thread = None
+        self.written = 0
+        self.rejected = 0
+        self.retried = 0
+        self.failed = 0
+
+    def __len__(self):
+        return len(self._pending) + sum(len(entry[3]) for entry in self._retries)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='caudal-buffer-flusher', daemon=True)
+        self._thread.start()
+        return self
+
+    def put(self, readings):
+        """Encola un envío completo o lo rechaza completo; nunca lo divide."""
+        with self._condition:
+            if self._closing or not self.running:
+                raise BufferUnavailable()
+            if len(self) + len(readings) > self.capacity:
+                raise BufferFull()
+            self._pending.extend(readings)
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify()
+
+    def _take_batch(self, force=False):
+        """Toma el reintento vencido más próximo (o cualquiera con `force`) o, si no hay, lecturas nuevas."""
+        with self._condition:
+            if self._retries and (force or self._retries[0][0] <= time.monotonic()):
+                _, _, attempts, batch = heapq.heappop(self._retries)
+                return attempts, batch
+            return 0, [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+
+    def flush(self, force=False):
+        """Escribe un lote de lecturas pendientes. Retorna cuántas se tomaron del búfer."""
+        attempts, batch = self._take_batch(force)
+        if not batch:
+            return 0
+        try:
+            result = self.writer(batch)
+            self.written += result['created']['predio'] + result['created']['lote']
+            self.rejected += len(result['rejected'])
+            for error in result['rejected']:
+                logger.warning("Lectura en búfer rechazada: %s", error['error'])
+        except Exception:
+            logger.exception("No se pudo escribir un lote de %s lecturas del búfer (intento %s)", len(batch), attempts + 1)
+            self._retry(attempts + 1, batch)
+        finally:
+            close_old_connections()
+        return len(batch)
+
+    def _retry(self, attempts, batch):
+        with self._condition:
+            if attempts <= self.max_retries and not self._closing:
+                delay = self.retry_base * 2 ** (attempts - 1)
+                heapq.heappush(self._retries, (time.monotonic() + delay, next(self._retry_order), attempts, batch))
+                self.retried += len(batch)
+                return
+        self.failed += len(batch)
+        self._dead_letter(batch)
+
+    def _dead_letter(self, batch):
+        """Agrega el lote al archivo de lecturas no escritas, en el formato NDJSON de la ingesta masiva."""
+        if not self.dead_letter_path:
+            logger.error("Se perdieron %s lecturas del búfer: CAUDAL_BUFFER_DEAD_LETTER_PATH no está configurado", len(batch))
+            return
+        try:
+            with open(self.dead_letter_path, 'a', encoding='utf-8') as dead_letter:
+                dead_letter.writelines(json.dumps(_serializable(reading)) + '\n' for reading in batch)
+        except OSError:
+            logger.exception("No se pudieron guardar %s lecturas en %s", len(batch), self.dead_letter_path)
+        else:
+            logger.error("%s lecturas del búfer guardadas en %s para reenviarlas", len(batch), self.dead_letter_path)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                deadline = time.monotonic() + self.flush_interval
+                while not self._closing and len(self._pending) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                closing = self._closing
+            while self.flush() >= self.batch_size:
+                pass
+            if closing and not self._pending:
+                # Al cerrar no se espera la pausa de los reintentos: un último intento y luego al archivo
+                while self._retries:
+                    self.flush(force=True)
+                return
+
+    def stop(self, timeout=None):
+        """Deja de aceptar lecturas y espera a que se escriban las pendientes."""
+        timeout = timeout if timeout is not None else getattr(settings, 'CAUDAL_BUFFER_DRAIN_TIMEOUT', DEFAULT_BUFFER_DRAIN_TIMEOUT)
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        # Si el hilo no alcanzó (o nunca arrancó), se vacía desde el hilo actual
+        while (self._pending or self._retries) and not self.running:
+            self.flush(force=True)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """Búfer del proceso, creado y arrancado en el primer uso."""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = MeasurementBuffer().start()
+            atexit.register(_buffer.stop)
+        return _buffer
@@ -0,0 +1,104 @@
+"""
+Reducción de series de caudal para gráficas (`points=N` en el historial de mediciones).
+
+Graficar un año de un lote no necesita cada lectura: la serie se lee en orden
+cronológico como arreglos NumPy y se reduce en el servidor a como máximo `N`
+puntos antes de serializarla.
+
+- `lttb` (Largest-Triangle-Three-Buckets): divide la serie en `N - 2` grupos y de
+  cada uno conserva el punto que forma el triángulo de mayor área con el punto
+  elegido en el grupo anterior y el promedio del siguiente. Conserva la forma de
+  la curva y sus picos; la primera y la última lectura siempre se incluyen.
+- `minmax`: divide la serie en `N / 2` grupos y conserva el mínimo y el máximo de
+  cada uno, de modo que ningún pico ni valle desaparece de la gráfica.
+"""
+import numpy as np
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
+
+DOWNSAMPLE_METHODS = ('lttb', 'minmax')
+DEFAULT_MAX_POINTS = 5000
+MIN_POINTS = 3
+
+
+def get_max_points():
+    return getattr(settings, 'CAUDAL_DOWNSAMPLE_MAX_POINTS', DEFAULT_MAX_POINTS)
+
+
+def parse_downsample(params):
+    """Lee `points` y `method` de la consulta. Retorna `(puntos, método)`."""
+    max_points = get_max_points()
+    try:
+        points = int(params.get('points'))
+    except (TypeError, ValueError):
+        raise ValidationError({"points": "Debe ser un número entero."})
+    if not MIN_POINTS <= points <= max_points:
+        raise ValidationError({"points": f"Debe estar entre {MIN_POINTS} y {max_points}."})
+    method = params.get('method') or 'lttb'
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValidationError({"method": "El método debe ser lttb o minmax."})
+    return points, method
+
+
+def lttb(x, y, threshold):
+    """Índices (ascendentes) de los `threshold` puntos elegidos por LTTB."""
+    n = len(x)
+    if threshold >= n:
+        return np.arange(n)
+
+    # Límites de los grupos intermedios; el último "grupo siguiente" es la lectura final
+    bounds = np.append(np.arange(threshold - 1) * (n - 2) // (threshold - 2) + 1, n)
+    counts = np.diff(bounds[1:])
+    next_x = np.add.reduceat(x, bounds[1:-1]) / counts
+    next_y = np.add.reduceat(y, bounds[1:-1]) / counts
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for bucket in range(threshold - 2):
+        start, end = bounds[bucket], bounds[bucket + 1]
+        # Doble del área del triángulo (a, candidato, promedio del grupo siguiente)
+        area = np.abs(
+            (x[a] - next_x[bucket]) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (next_y[bucket] - y[a])
+        )
+        a = start + int(np.argmax(area))
+        selected[bucket + 1] = a
+    return selected
+
+
+def minmax(y, threshold):
+    """Índices (ascendentes) del mínimo y el máximo de cada uno de `threshold // 2` grupos."""
+    n = len(y)
+    if threshold >= n:
+        return np.arange(n)
+    groups = np.arange(n) * (threshold // 2) // n
+    # Dentro de cada grupo ordenado por caudal, el primero es el mínimo y el último el máximo
+    order = np.lexsort((y, groups))
+    first = np.flatnonzero(np.r_[True, groups[order][1:] != groups[order][:-1]])
+    last = np.r_[first[1:] - 1, n - 1]
+    return np.unique(np.concatenate([order[first], order[last]]))
+
+
+def downsample(queryset, points, method='lttb'):
+    """Lee la serie `(timestamp, flow_rate)` del queryset en orden cronológico y la reduce a `points`."""
+    rows = list(queryset.order_by('timestamp', 'id').values_list('timestamp', 'flow_rate'))
+    if not rows:
+        return {"count": 0, "method": method, "results": []}
+    timestamps, flow_rates = zip(*rows)
+    timestamps = np.array(timestamps, dtype='datetime64[us]')
+    flow_rates = np.array(flow_rates, dtype=np.float64)
+
+    if method == 'lttb':
+        seconds = (timestamps - timestamps[0]) / np.timedelta64(1, 's')
+        selected = lttb(seconds, flow_rates, points)
+    else:
+        selected = minmax(flow_rates, points)
+    return {
+        "count": len(rows),
+        "method": method,
+        "results": [
+            {"timestamp": timestamp, "flow_rate": flow_rate}
+            for timestamp, flow_rate in zip(timestamps[selected].tolist(), flow_rates[selected].tolist())
+        ],
+    }
@@ -0,0 +1,99 @@
+"""
+Exportación en streaming del historial de mediciones de caudal (CSV o NDJSON).
+
+Las filas se leen con `QuerySet.iterator(chunk_size=...)` (cursor del lado del servidor
+en PostgreSQL) como tuplas de `values_list`, sin instanciar modelos, y se emiten en
+bloques de texto a medida que se generan. La memoria usada es la de un bloque,
+sin importar cuántas filas tenga la exportación.
+"""
+import csv
+import io
+import json
+from django.conf import settings
+from .models import FlowMeasurement, FlowMeasurementPredio, FlowMeasurementLote
+
+DEFAULT_EXPORT_CHUNK_SIZE = 2000
+
+# tipo de medición -> (modelo, campo de la entidad medida)
+EXPORT_SOURCES = {
+    'bocatoma': (FlowMeasurement, 'device'),
+    'predio': (FlowMeasurementPredio, 'plot'),
+    'lote': (FlowMeasurementLote, 'lot'),
+}
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def get_export_chunk_size():
+    return getattr(settings, 'CAUDAL_EXPORT_CHUNK_SIZE', DEFAULT_EXPORT_CHUNK_SIZE)
+
+
+def export_columns(tipo):
+    _, entity = EXPORT_SOURCES[tipo]
+    columns = ['id', entity, 'flow_rate', 'timestamp']
+    if entity != 'device':
+        columns.insert(2, 'device')
+    return columns
+
+
+def export_queryset(tipo, entity_id=None, device_id=None, inicio=None, fin=None):
+    """Filas `(columnas...)` de la exportación en orden cronológico."""
+    model, entity = EXPORT_SOURCES[tipo]
+    queryset = model.objects.all()
+    if entity_id:
+        queryset = queryset.filter(**{f"{entity}_id": entity_id})
+    if device_id:
+        queryset = queryset.filter(device_id=device_id)
+    if inicio:
+        queryset = queryset.filter(timestamp__gte=inicio)
+    if fin:
+        queryset = queryset.filter(timestamp__lte=fin)
+    fields = [f"{name}_id" if name in ('device', 'plot', 'lot') else name for name in export_columns(tipo)]
+    return queryset.order_by('timestamp', 'id').values_list(*fields)
+
+
+def _chunks(rows, chunk_size):
+    chunk = []
+    for row in rows.iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def stream_csv(columns, rows, chunk_size=None):
+    """Genera el CSV por bloques: primero el encabezado y luego un bloque por cada `chunk_size` filas."""
+    chunk_size = chunk_size or get_export_chunk_size()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+
+    for chunk in _chunks(rows, chunk_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(
+            row[:-1] + (row[-1].isoformat(),) for row in chunk
+        )
+        yield buffer.getvalue()
+
+
+def stream_ndjson(columns, rows, chunk_size=None):
+    """Genera un objeto JSON por línea, emitidos en bloques de `chunk_size` filas."""
+    chunk_size = chunk_size or get_export_chunk_size()
+    for chunk in _chunks(rows, chunk_size):
+        yield ''.join(
+            json.dumps(dict(zip(columns, row[:-1] + (row[-1].isoformat(),)))) + '\n'
+            for row in chunk
+        )
+
+
+def stream_export(output, columns, rows, chunk_size=None):
+    if output == 'csv':
+        return stream_csv(columns, rows, chunk_size)
+    return stream_ndjson(columns, rows, chunk_size)
@@ -0,0 +1,41 @@
+from datetime import datetime
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
+from rest_framework.exceptions import ValidationError
+
+
+def parse_query_datetime(value, param):
+    """Convierte un parámetro `YYYY-MM-DD` o ISO 8601 en datetime ingenuo (USE_TZ=False)."""
+    parsed = parse_datetime(value)
+    if parsed is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValidationError({param: "Fecha inválida. Usa YYYY-MM-DD o ISO 8601."})
+        parsed = datetime.combine(date, datetime.min.time())
+    if timezone.is_aware(parsed) and not settings.USE_TZ:
+        parsed = timezone.make_naive(parsed)
+    return parsed
+
+
+def parse_time_range(params, required=False):
+    """Lee los filtros `from`/`to` de la consulta. Retorna `(inicio, fin)`; cada uno puede ser None."""
+    inicio = params.get('from')
+    fin = params.get('to')
+    if required and not (inicio and fin):
+        raise ValidationError({"detail": "Los parámetros 'from' y 'to' son obligatorios."})
+    inicio = parse_query_datetime(inicio, 'from') if inicio else None
+    fin = parse_query_datetime(fin, 'to') if fin else None
+    if inicio and fin and inicio > fin:
+        raise ValidationError({"from": "La fecha inicial debe ser anterior a la final."})
+    return inicio, fin
+
+
+def filter_time_range(queryset, params, field='timestamp'):
+    """Aplica los filtros `from`/`to` (ambos inclusivos) sobre el campo de fecha indicado."""
+    inicio, fin = parse_time_range(params)
+    if inicio:
+        queryset = queryset.filter(**{f"{field}__gte": inicio})
+    if fin:
+        queryset = queryset.filter(**{f"{field}__lte": fin})
+    return queryset
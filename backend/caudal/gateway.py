@@ -0,0 +1,230 @@
+"""
+Pasarela de telemetría para los dispositivos ESP32.
+
+Los dispositivos envían cada lectura como un datagrama UDP, sin token ni serializador
+de DRF, a un proceso independiente (`run_telemetry_gateway`) en lugar de a los
+workers de gunicorn. El listener UDP publica cada datagrama tal como llega en el
+tema `aquasmart/udp/flow` de un broker con temas al estilo MQTT (los dispositivos
+conectados a un broker externo publican en `aquasmart/<iot_id>/flow`); la pasarela
+está suscrita a esos temas, decodifica el datagrama una sola vez, verifica su firma,
+resuelve el lote o predio del dispositivo registrado en `iot.IoTDevice` y encola la
+lectura en el búfer de ingesta, que la escribe por lotes en las tablas de caudal.
+
+`LocalBroker` es un broker en memoria dentro del proceso: lo usan las pruebas y el
+comando cuando no hay un broker externo. Cualquier broker con `publish`/`subscribe`
+sobre los mismos temas puede reemplazarlo.
+
+Formatos de datagrama aceptados (UTF-8):
+
+- JSON: `{"device": "04-1234", "flow_rate": 1.25, "timestamp": "2026-01-01T10:00:00"}`
+  (`timestamp` opcional: ISO 8601 o segundos desde epoch).
+- Texto compacto: `04-1234,1.25[,timestamp]`.
+- Lote binario de `caudal.codec` con lecturas de uno o varios dispositivos.
+
+Autenticación: UDP no identifica al remitente, así que cada datagrama termina con
+32 bytes de HMAC-SHA256 del cuerpo, calculado con la `telemetry_key` del dispositivo
+(`sign_payload`). La firma se verifica con la clave del primer dispositivo del
+datagrama; en un lote binario solo se aceptan las lecturas de dispositivos con esa
+misma clave (los medidores que reenvía un mismo concentrador comparten clave). Con
+`CAUDAL_GATEWAY_REQUIRE_SIGNATURE = False` los datagramas van sin firma: solo es
+aceptable si `CAUDAL_GATEWAY_HOST` escucha en una red aislada de confianza.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import socket
+import socketserver
+import threading
+from datetime import datetime
+from django.conf import settings
+from iot.device_map import get_device_map
+from .buffer import MeasurementBuffer, BufferFull, BufferUnavailable
+from .codec import is_frame, decode_batch, iter_readings
+
+logger = logging.getLogger(__name__)
+
+FLOW_TOPIC = 'aquasmart/{device}/flow'
+DEFAULT_GATEWAY_HOST = '0.0.0.0'
+DEFAULT_GATEWAY_PORT = 5683
+DEFAULT_RECEIVE_BUFFER_BYTES = 4 * 1024 * 1024
+SIGNATURE_SIZE = hashlib.sha256().digest_size
+
+
+def sign_payload(body, key):
+    """Agrega al cuerpo del datagrama su firma HMAC-SHA256 con la clave del dispositivo."""
+    return body + hmac.new(key.encode(), body, hashlib.sha256).digest()
+
+
+class LocalBroker:
+    """Broker de publicación/suscripción en memoria con comodines `+` y `#` como en MQTT."""
+
+    def __init__(self):
+        self._subscriptions = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def matches(topic_filter, topic):
+        filter_levels, levels = topic_filter.split('/'), topic.split('/')
+        for index, level in enumerate(filter_levels):
+            if level == '#':
+                return True
+            if index >= len(levels) or (level != '+' and level != levels[index]):
+                return False
+        return len(filter_levels) == len(levels)
+
+    def subscribe(self, topic_filter, callback):
+        with self._lock:
+            self._subscriptions.append((topic_filter, callback))
+
+    def publish(self, topic, payload):
+        with self._lock:
+            callbacks = [callback for topic_filter, callback in self._subscriptions if self.matches(topic_filter, topic)]
+        for callback in callbacks:
+            callback(topic, payload)
+        return len(callbacks)
+
+
+def parse_payload(payload):
+    """Convierte un datagrama en `(iot_id, caudal, fecha | None)`. Lanza ValueError si es inválido."""
+    if isinstance(payload, bytes):
+        payload = payload.decode('utf-8')
+    payload = payload.strip()
+    if payload.startswith('{'):
+        data = json.loads(payload)
+        device, flow_rate, timestamp = data.get('device'), data.get('flow_rate'), data.get('timestamp')
+    else:
+        parts = payload.split(',')
+        if len(parts) not in (2, 3):
+            raise ValueError("Se esperaba 'dispositivo,caudal[,fecha]'.")
+        device, flow_rate = parts[0], parts[1]
+        timestamp = parts[2] if len(parts) == 3 else None
+    if not device or flow_rate in (None, ''):
+        raise ValueError("El datagrama debe indicar dispositivo y caudal.")
+
+    if isinstance(timestamp, (int, float)) or (isinstance(timestamp, str) and timestamp.replace('.', '', 1).isdigit()):
+        timestamp = datetime.fromtimestamp(float(timestamp))
+    return str(device).strip(), float(flow_rate), timestamp
+
+
+class DeviceDirectory:
+    """Lote o predio de cada dispositivo activo, según el mapa de dispositivos de `iot`."""
+
+    def __init__(self, device_map=None):
+        self.device_map = device_map or get_device_map()
+
+    def load(self):
+        self.device_map.load()
+
+    def resolve(self, iot_id):
+        info = self.device_map.get(iot_id)
+        if info is None or not info.is_active:
+            return None
+        return info.lot, info.plot
+
+    def key(self, iot_id):
+        """Clave de telemetría de un dispositivo activo, o None."""
+        info = self.device_map.get(iot_id)
+        if info is None or not info.is_active:
+            return None
+        return info.telemetry_key or None
+
+
+class TelemetryGateway:
+    """Suscriptor de los temas de caudal: valida el dispositivo y encola la lectura."""
+
+    def __init__(self, broker, buffer=None, directory=None, require_signature=None):
+        self.broker = broker
+        self.buffer = buffer if buffer is not None else MeasurementBuffer()
+        self.directory = directory or DeviceDirectory()
+        self.require_signature = require_signature if require_signature is not None else getattr(
+            settings, 'CAUDAL_GATEWAY_REQUIRE_SIGNATURE', True
+        )
+        self.accepted = 0
+        self.dropped = 0
+        broker.subscribe(FLOW_TOPIC.format(device='+'), self.handle)
+
+    def _reading(self, device, flow_rate, timestamp):
+        target = self.directory.resolve(device)
+        if target is None or not any(target):
+            logger.warning("Lectura descartada: el dispositivo %s no está registrado, activo y asignado.", device)
+            return None
+        lot_id, plot_id = target
+        return {
+            'lot': lot_id,
+            'plot': None if lot_id else plot_id,
+            'device': device,
+            'flow_rate': flow_rate,
+            'timestamp': timestamp or datetime.now(),
+        }
+
+    def _authenticate(self, body, signature, decoded):
+        """Dispositivos del datagrama cuya clave es la que firmó el cuerpo; vacío si la firma no es válida."""
+        devices = {device for device, _, _ in decoded}
+        if not self.require_signature:
+            return devices
+        key = self.directory.key(decoded[0][0])
+        expected = hmac.new(key.encode(), body, hashlib.sha256).digest() if key else None
+        if expected is None or not hmac.compare_digest(expected, signature):
+            return set()
+        return {device for device in devices if self.directory.key(device) == key}
+
+    def handle(self, topic, payload):
+        payload = bytes(payload)
+        body, signature = payload, b''
+        if self.require_signature:
+            body, signature = payload[:-SIGNATURE_SIZE], payload[-SIGNATURE_SIZE:]
+        try:
+            if is_frame(body):
+                decoded = list(iter_readings(decode_batch(body)))
+            else:
+                decoded = [parse_payload(body)]
+            if not decoded:
+                raise ValueError("Lote binario sin lecturas.")
+        except (ValueError, UnicodeDecodeError) as exc:
+            self.dropped += 1
+            logger.warning("Datagrama inválido en %s: %s", topic, exc)
+            return False
+
+        authenticated = self._authenticate(body, signature, decoded)
+        if len(authenticated) < len({device for device, _, _ in decoded}):
+            logger.warning("Lecturas descartadas en %s: firma ausente o inválida.", topic)
+        readings = [self._reading(*reading) if reading[0] in authenticated else None for reading in decoded]
+        valid = [reading for reading in readings if reading]
+        self.dropped += len(readings) - len(valid)
+        if not valid:
+            return False
+        try:
+            self.buffer.put(valid)
+        except (BufferFull, BufferUnavailable):
+            self.dropped += len(valid)
+            logger.warning("Búfer de ingesta lleno o detenido: se descartan %s lecturas.", len(valid))
+            return False
+        self.accepted += len(valid)
+        return True
+
+
+class _DatagramHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        # El remitente no se conoce hasta verificar la firma: la pasarela decodifica y autentica
+        self.server.broker.publish(FLOW_TOPIC.format(device='udp'), self.request[0])
+
+
+class UDPListener(socketserver.UDPServer):
+    """Recibe datagramas de los dispositivos y los publica en el broker."""
+
+    allow_reuse_address = True
+
+    def __init__(self, broker, host=None, port=None):
+        self.broker = broker
+        host = host or getattr(settings, 'CAUDAL_GATEWAY_HOST', DEFAULT_GATEWAY_HOST)
+        port = port if port is not None else getattr(settings, 'CAUDAL_GATEWAY_PORT', DEFAULT_GATEWAY_PORT)
+        super().__init__((host, port), _DatagramHandler)
+
+    def server_bind(self):
+        # Búfer de recepción amplio para absorber ráfagas de datagramas sin que el kernel los descarte
+        self.socket.setsockopt(
+            socket.SOL_SOCKET, socket.SO_RCVBUF,
+            getattr(settings, 'CAUDAL_GATEWAY_RECEIVE_BUFFER_BYTES', DEFAULT_RECEIVE_BUFFER_BYTES)
+        )
+        super().server_bind()
@@ -0,0 +1,434 @@
+"""
+Ingesta masiva de mediciones de caudal de predios y lotes.
+
+Cada lote de lecturas se procesa con un número constante de consultas, sin importar
+cuántas lecturas traiga:
+
+- Los dispositivos se validan contra el mapa en memoria de `iot.device_map`, sin
+  consultas; una consulta por conjunto valida lotes y predios.
+- `bulk_create` (o COPY en PostgreSQL para lotes grandes) para insertar.
+- Una sola verificación de inconsistencias por predio afectado.
+- Un UPSERT de agregados por minuto, hora y día para todo el envío.
+- Una escritura en caché de la última lectura por dispositivo, predio y lote.
+- La actividad de los dispositivos se acumula en memoria y se escribe en segundo
+  plano (ver `iot.heartbeat`).
+
+Una lectura puede indicar solo `device`: se asigna al lote (o, si no tiene, al
+predio) del dispositivo según el mapa.
+
+Las lecturas pueden traer el número de secuencia (`sequence`) que el dispositivo
+asigna a cada medición. Un reintento repite dispositivo, secuencia y fecha: esas
+lecturas se descartan antes de insertar (una consulta por tabla) y el índice único
+`(device, sequence, timestamp)` junto con `ignore_conflicts` cubre los reintentos
+concurrentes, de modo que no se sumen dos veces al balance del predio.
+
+Al no pasar por `Model.save()`, estas inserciones no generan una entrada de
+auditlog por fila; en modo de auditoría `batch` se resumen en una entrada por envío
+(ver `caudal.audit`).
+"""
+import csv
+import io
+import math
+from datetime import datetime
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from iot.device_map import get_device_map
+from iot.heartbeat import marcar_actividad
+from plots_lots.models import Plot, Lot
+from .models import FlowMeasurementPredio, FlowMeasurementLote
+from .balance import abrir_ventana, registrar_lecturas_lote
+from .rollups import actualizar_rollups
+from .latest import registrar_ultimas
+from .live import publicar_lecturas
+from .audit import auditar_mediciones
+
+DEFAULT_BULK_MAX_READINGS = 10000
+DEFAULT_BULK_BATCH_SIZE = 1000
+DEFAULT_COPY_THRESHOLD = 5000
+
+
+def get_bulk_max_readings():
+    return getattr(settings, 'CAUDAL_BULK_MAX_READINGS', DEFAULT_BULK_MAX_READINGS)
+
+
+def _parse_timestamp(value):
+    """Convierte un ISO 8601 en datetime ingenuo en la zona del proyecto (USE_TZ=False)."""
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, str):
+        parsed = parse_datetime(value)
+    else:
+        parsed = None
+    if parsed is None:
+        raise ValueError("La fecha debe estar en formato ISO 8601.")
+    if timezone.is_aware(parsed) and not settings.USE_TZ:
+        parsed = timezone.make_naive(parsed)
+    return parsed
+
+
+def _parse_flow_rate(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError("El caudal debe ser numérico.")
+    flow_rate = float(value)
+    if not math.isfinite(flow_rate):
+        raise ValueError("El caudal debe ser un número finito.")
+    return flow_rate
+
+
+def _parse_sequence(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError("El número de secuencia debe ser un entero no negativo.")
+    try:
+        sequence = int(value)
+    except ValueError:
+        raise ValueError("El número de secuencia debe ser un entero no negativo.")
+    if sequence < 0:
+        raise ValueError("El número de secuencia debe ser un entero no negativo.")
+    return sequence
+
+
+def _clean_reading(raw):
+    """Valida la forma de una lectura; las referencias se validan luego por conjunto."""
+    if not isinstance(raw, dict):
+        raise ValueError("Cada lectura debe ser un objeto JSON.")
+
+    lot_id = raw.get('lot')
+    plot_id = raw.get('plot')
+    if lot_id and plot_id:
+        raise ValueError("Cada lectura debe indicar exactamente uno de 'lot' o 'plot'.")
+    if not (lot_id or plot_id or raw.get('device')):
+        raise ValueError("Cada lectura debe indicar 'lot', 'plot' o 'device'.")
+    if 'flow_rate' not in raw or raw['flow_rate'] is None:
+        raise ValueError("El campo 'flow_rate' es obligatorio.")
+    if not raw.get('timestamp'):
+        raise ValueError("El campo 'timestamp' es obligatorio.")
+    sequence = _parse_sequence(raw.get('sequence'))
+    if sequence is not None and not raw.get('device'):
+        raise ValueError("El campo 'sequence' requiere 'device'.")
+
+    return {
+        'lot': str(lot_id) if lot_id else None,
+        'plot': str(plot_id) if plot_id else None,
+        'device': str(raw['device']) if raw.get('device') else None,
+        'flow_rate': _parse_flow_rate(raw['flow_rate']),
+        'timestamp': _parse_timestamp(raw['timestamp']),
+        'sequence': sequence,
+    }
+
+
+def clean_readings(raw_readings):
+    """Valida solo la forma de las lecturas, sin consultar la base de datos. Retorna `(lecturas, errores)`."""
+    cleaned, errors = [], []
+    for index, raw in enumerate(raw_readings):
+        try:
+            reading = _clean_reading(raw)
+        except ValueError as exc:
+            errors.append({'index': index, 'error': str(exc)})
+            continue
+        reading['index'] = index
+        cleaned.append(reading)
+    return cleaned, errors
+
+
+def validate_readings(raw_readings):
+    """
+    Valida un lote de lecturas crudas.
+
+    Retorna `(lecturas, errores)`: las lecturas válidas ya normalizadas (con el predio
+    de cada lote resuelto) y la lista de errores `{'index', 'error'}` de las rechazadas.
+    """
+    cleaned, errors = clean_readings(raw_readings)
+
+    # Dispositivos desde el mapa en memoria; las lecturas sin lote ni predio toman los del dispositivo
+    device_map = get_device_map()
+    resolved = []
+    for reading in cleaned:
+        info = device_map.get(reading['device']) if reading['device'] else None
+        if reading['device'] and info is None:
+            errors.append({'index': reading['index'], 'error': f"El dispositivo {reading['device']} no existe en la base de datos."})
+            continue
+        if not (reading['lot'] or reading['plot']):
+            if not info.is_active or not (info.lot or info.plot):
+                errors.append({'index': reading['index'], 'error': f"El dispositivo {reading['device']} no está activo y asignado a un lote o predio."})
+                continue
+            reading['lot'], reading['plot'] = info.lot, None if info.lot else info.plot
+        resolved.append(reading)
+
+    # 🔍 Una consulta por conjunto en lugar de una por lectura
+    lot_ids = {r['lot'] for r in resolved if r['lot']}
+    plot_ids = {r['plot'] for r in resolved if r['plot']}
+
+    lot_plots = dict(
+        Lot.objects.filter(id_lot__in=lot_ids).values_list('id_lot', 'plot_id')
+    ) if lot_ids else {}
+    known_plots = set(
+        Plot.objects.filter(id_plot__in=plot_ids).values_list('id_plot', flat=True)
+    ) if plot_ids else set()
+
+    readings = []
+    for reading in resolved:
+        if reading['lot'] and reading['lot'] not in lot_plots:
+            errors.append({'index': reading['index'], 'error': f"El lote {reading['lot']} no existe."})
+        elif reading['plot'] and reading['plot'] not in known_plots:
+            errors.append({'index': reading['index'], 'error': f"El predio {reading['plot']} no existe."})
+        else:
+            if reading['lot']:
+                reading['plot'] = lot_plots[reading['lot']]
+            readings.append(reading)
+
+    errors.sort(key=lambda error: error['index'])
+    return readings, errors
+
+
+def readings_from_devices(device_readings):
+    """
+    Convierte `(iot_id, caudal, fecha)` en lecturas crudas identificadas solo por su
+    dispositivo; `validate_readings` les asigna el lote o predio del dispositivo y
+    rechaza las de dispositivos desconocidos, inactivos o sin asignar.
+    """
+    return [
+        {'device': iot_id, 'flow_rate': flow_rate, 'timestamp': timestamp}
+        for iot_id, flow_rate, timestamp in device_readings
+    ]
+
+
+def _sequence_key(reading):
+    return (reading['device'], reading['sequence'], reading['timestamp'])
+
+
+def discard_duplicates(readings):
+    """
+    Quita las lecturas con número de secuencia repetidas dentro del envío o ya guardadas.
+
+    Retorna `(lecturas, duplicadas)`. Las lecturas sin secuencia no se comparan.
+    """
+    sequenced = [r for r in readings if r.get('sequence') is not None]
+    if not sequenced:
+        return readings, 0
+
+    stored = set()
+    for model, is_lot in ((FlowMeasurementLote, True), (FlowMeasurementPredio, False)):
+        subset = [r for r in sequenced if bool(r['lot']) == is_lot]
+        if not subset:
+            continue
+        stored.update(
+            model.objects.filter(
+                device_id__in={r['device'] for r in subset},
+                sequence__in={r['sequence'] for r in subset},
+                timestamp__gte=min(r['timestamp'] for r in subset),
+                timestamp__lte=max(r['timestamp'] for r in subset),
+            ).values_list('device_id', 'sequence', 'timestamp')
+        )
+
+    kept, seen = [], set()
+    for reading in readings:
+        if reading.get('sequence') is not None:
+            key = _sequence_key(reading)
+            if key in stored or key in seen:
+                continue
+            seen.add(key)
+        kept.append(reading)
+    return kept, len(readings) - len(kept)
+
+
+INSERT_COLUMNS = ('device', 'flow_rate', 'timestamp', 'sequence')
+KEY_COLUMNS = ('device', 'sequence', 'timestamp')
+
+
+def _columns(model, names):
+    quote = connection.ops.quote_name
+    return ', '.join(quote(model._meta.get_field(name).column) for name in names)
+
+
+def _row(obj, fk_field):
+    return [getattr(obj, f"{fk_field}_id"), obj.device_id, obj.flow_rate, obj.timestamp, obj.sequence]
+
+
+def _keys(model, rows):
+    """Normaliza las claves `(dispositivo, secuencia, fecha)` que retorna la base de datos."""
+    timestamp = model._meta.get_field('timestamp')
+    return [(device, sequence, timestamp.to_python(value)) for device, sequence, value in rows]
+
+
+def _copy_insert(model, objs, fk_field, ignore_conflicts=False):
+    """
+    Inserta filas con COPY ... FROM STDIN (solo PostgreSQL).
+
+    Con `ignore_conflicts` se copia a una tabla temporal y se inserta desde ella con
+    `ON CONFLICT DO NOTHING`, ya que COPY no admite conflictos; en ese caso retorna
+    las claves de las filas realmente insertadas.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for obj in objs:
+        writer.writerow([
+            getattr(obj, f"{fk_field}_id"),
+            obj.device_id if obj.device_id is not None else '',
+            repr(obj.flow_rate),
+            obj.timestamp.isoformat(),
+            obj.sequence if obj.sequence is not None else '',
+        ])
+    buffer.seek(0)
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    column_list = _columns(model, (fk_field,) + INSERT_COLUMNS)
+    with connection.cursor() as cursor:
+        if not ignore_conflicts:
+            cursor.copy_expert(f"COPY {table} ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+            return None
+        staging = quote(f"{model._meta.db_table}_staging")
+        cursor.execute(f"CREATE TEMP TABLE {staging} AS SELECT {column_list} FROM {table} WITH NO DATA")
+        try:
+            cursor.copy_expert(f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+            cursor.execute(
+                f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {staging} "
+                f"ON CONFLICT DO NOTHING RETURNING {_columns(model, KEY_COLUMNS)}"
+            )
+            return _keys(model, cursor.fetchall())
+        finally:
+            cursor.execute(f"DROP TABLE {staging}")
+
+
+def _insert_returning(model, objs, fk_field, batch_size):
+    """`INSERT ... ON CONFLICT DO NOTHING RETURNING` (PostgreSQL y SQLite): retorna las claves insertadas."""
+    table = connection.ops.quote_name(model._meta.db_table)
+    column_list = _columns(model, (fk_field,) + INSERT_COLUMNS)
+    returning = _columns(model, KEY_COLUMNS)
+    fields = [model._meta.get_field(name) for name in (fk_field,) + INSERT_COLUMNS]
+    inserted = []
+    with connection.cursor() as cursor:
+        for start in range(0, len(objs), batch_size):
+            batch = objs[start:start + batch_size]
+            placeholders = ', '.join(['(' + ', '.join(['%s'] * len(fields)) + ')'] * len(batch))
+            params = [
+                field.get_db_prep_save(value, connection)
+                for obj in batch for field, value in zip(fields, _row(obj, fk_field))
+            ]
+            cursor.execute(
+                f"INSERT INTO {table} ({column_list}) VALUES {placeholders} ON CONFLICT DO NOTHING RETURNING {returning}",
+                params
+            )
+            inserted.extend(cursor.fetchall())
+    return _keys(model, inserted)
+
+
+def _insert(model, objs, fk_field):
+    """
+    Inserta las mediciones y retorna las que realmente se guardaron.
+
+    Las mediciones con secuencia se insertan ignorando conflictos con el índice único,
+    como red de seguridad ante reintentos concurrentes que ya pasaron por
+    `discard_duplicates`; las descartadas así no deben contar en el balance, los
+    rollups ni el resumen, por eso se identifican las filas insertadas con RETURNING.
+    """
+    copy_threshold = getattr(settings, 'CAUDAL_COPY_THRESHOLD', DEFAULT_COPY_THRESHOLD)
+    batch_size = getattr(settings, 'CAUDAL_BULK_BATCH_SIZE', DEFAULT_BULK_BATCH_SIZE)
+    ignore_conflicts = any(obj.sequence is not None for obj in objs)
+    if connection.vendor == 'postgresql' and copy_threshold and len(objs) >= copy_threshold:
+        keys = _copy_insert(model, objs, fk_field, ignore_conflicts=ignore_conflicts)
+    elif not ignore_conflicts:
+        model.objects.bulk_create(objs, batch_size=batch_size)
+        keys = None
+    elif connection.vendor in ('postgresql', 'sqlite'):
+        keys = _insert_returning(model, objs, fk_field, batch_size)
+    else:
+        # Sin RETURNING en ON CONFLICT: las claves que no existían antes de insertar
+        stored = set(model.objects.filter(
+            device_id__in={obj.device_id for obj in objs}, sequence__in={obj.sequence for obj in objs}
+        ).values_list(*KEY_COLUMNS))
+        model.objects.bulk_create(objs, batch_size=batch_size, ignore_conflicts=True)
+        keys = [(obj.device_id, obj.sequence, obj.timestamp) for obj in objs if obj.sequence is not None]
+        keys = [key for key in keys if key not in stored]
+    if keys is None:
+        return objs
+
+    pending = {}
+    for key in keys:
+        pending[key] = pending.get(key, 0) + 1
+    inserted = []
+    for obj in objs:
+        key = (obj.device_id, obj.sequence, obj.timestamp)
+        if obj.sequence is None:
+            inserted.append(obj)
+        elif pending.get(key):
+            # Cada clave insertada corresponde a una sola de las mediciones repetidas del envío
+            pending[key] -= 1
+            inserted.append(obj)
+    return inserted
+
+
+def write_readings(readings):
+    """
+    Escribe lecturas ya validadas y verifica inconsistencias una vez por predio.
+
+    Las mediciones de predio se insertan primero y abren su ventana de balance antes
+    de insertar las mediciones de lote del mismo envío, que luego se suman al balance
+    de su predio en una sola actualización. Los efectos (ventanas, balance, rollups,
+    últimas lecturas, eventos, auditoría y resumen) se aplican solo a las mediciones
+    realmente insertadas: un reintento que descarta el índice único no cuenta dos veces.
+    """
+    plot_objs = [
+        FlowMeasurementPredio(
+            plot_id=r['plot'], device_id=r['device'], flow_rate=r['flow_rate'], timestamp=r['timestamp'],
+            sequence=r.get('sequence')
+        )
+        for r in readings if not r['lot']
+    ]
+    lot_objs = [
+        FlowMeasurementLote(
+            lot_id=r['lot'], device_id=r['device'], flow_rate=r['flow_rate'], timestamp=r['timestamp'],
+            sequence=r.get('sequence')
+        )
+        for r in readings if r['lot']
+    ]
+    lot_plots = {id(obj): reading['plot'] for reading, obj in zip((r for r in readings if r['lot']), lot_objs)}
+
+    with transaction.atomic():
+        if plot_objs:
+            plot_objs = _insert(FlowMeasurementPredio, plot_objs, 'plot')
+            # En orden de fecha: cada medición cierra la ventana anterior de su predio
+            # y las tardías se asignan a la ventana cerrada que les corresponde
+            for obj in sorted(plot_objs, key=lambda obj: obj.timestamp):
+                abrir_ventana(obj)
+        if lot_objs:
+            lot_objs = _insert(FlowMeasurementLote, lot_objs, 'lot')
+        actualizar_rollups(plot_objs + lot_objs)
+        registrar_ultimas(plot_objs + lot_objs)
+        publicar_lecturas(plot_objs + lot_objs)
+        auditar_mediciones(plot_objs + lot_objs)
+        marcar_actividad(obj.device_id for obj in plot_objs + lot_objs)
+
+        # Lecturas de lote agrupadas por predio; la más reciente sirve de referencia
+        # si el predio aún no tiene mediciones
+        lot_readings, references = {}, {}
+        for obj in lot_objs:
+            plot_id = lot_plots[id(obj)]
+            lot_readings.setdefault(plot_id, []).append((obj.timestamp, obj.flow_rate))
+            current = references.get(plot_id)
+            if current is None or obj.timestamp >= current.timestamp:
+                references[plot_id] = obj
+
+        plots = Plot.objects.in_bulk(list(references))
+        for plot_id, reference in references.items():
+            registrar_lecturas_lote(plots[plot_id], lot_readings[plot_id], reference)
+
+    return {'predio': len(plot_objs), 'lote': len(lot_objs)}
+
+
+def ingest_readings(raw_readings):
+    """
+    Valida y escribe un lote de lecturas crudas. Retorna el resumen de la operación;
+    `duplicates` cuenta los reintentos descartados por número de secuencia.
+    """
+    readings, errors = validate_readings(raw_readings)
+    readings, duplicates = discard_duplicates(readings)
+    created = write_readings(readings) if readings else {'predio': 0, 'lote': 0}
+    return {
+        'created': created,
+        'rejected': errors,
+        'duplicates': duplicates,
+    }
@@ -0,0 +1,109 @@
+"""
+Caché de la última lectura de caudal por dispositivo, predio y lote.
+
+Cada ingesta (individual o masiva) actualiza la caché con la lectura más reciente de
+cada clave al confirmarse la transacción, de modo que los widgets de "caudal actual"
+leen de la caché en lugar de consultar `order_by('-timestamp').first()` en cada
+petición. Usa el framework de caché de Django: memoria local en desarrollo y un
+backend compartido (Redis) en producción. Si una clave no está en caché se consulta
+la base de datos una vez y se guarda.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from .models import FlowMeasurement, FlowMeasurementPredio, FlowMeasurementLote
+from .rollups import claves_medicion
+
+CACHE_PREFIX = 'caudal:latest'
+DEFAULT_MAX_IDS = 500
+
+# ámbito -> [(modelo, campo de la clave)] donde puede estar su última lectura
+LATEST_SOURCES = {
+    'plot': [(FlowMeasurementPredio, 'plot_id')],
+    'lot': [(FlowMeasurementLote, 'lot_id')],
+    'device': [
+        (FlowMeasurement, 'device_id'),
+        (FlowMeasurementPredio, 'device_id'),
+        (FlowMeasurementLote, 'device_id'),
+    ],
+}
+
+
+def get_max_ids():
+    return getattr(settings, 'CAUDAL_LATEST_MAX_IDS', DEFAULT_MAX_IDS)
+
+
+def _timeout():
+    return getattr(settings, 'CAUDAL_LATEST_CACHE_TIMEOUT', None)
+
+
+def cache_key(scope, key):
+    return f"{CACHE_PREFIX}:{scope}:{key}"
+
+
+def _valor(medicion):
+    return {
+        'flow_rate': medicion.flow_rate,
+        'timestamp': medicion.timestamp,
+        'device': medicion.device_id,
+    }
+
+
+def _escribir_ultimas(mediciones):
+    ultimas = {}
+    for medicion in mediciones:
+        for scope, key in claves_medicion(medicion):
+            actual = ultimas.get((scope, key))
+            if actual is None or medicion.timestamp >= actual.timestamp:
+                ultimas[(scope, key)] = medicion
+    if not ultimas:
+        return
+
+    claves = {cache_key(scope, key): medicion for (scope, key), medicion in ultimas.items()}
+    en_cache = cache.get_many(list(claves))
+    # Solo se reemplaza lo que está en caché si la lectura nueva es más reciente (llegadas fuera de orden)
+    nuevas = {
+        clave: _valor(medicion)
+        for clave, medicion in claves.items()
+        if en_cache.get(clave) is None or medicion.timestamp >= en_cache[clave]['timestamp']
+    }
+    cache.set_many(nuevas, timeout=_timeout())
+
+
+def registrar_ultimas(mediciones):
+    """Actualiza la caché con las lecturas más recientes del conjunto al confirmar la transacción."""
+    mediciones = list(mediciones)
+    transaction.on_commit(lambda: _escribir_ultimas(mediciones))
+
+
+def invalidar_ultimas(medicion):
+    """Descarta las claves de una medición editada o eliminada; se recargan de la base de datos al consultarlas."""
+    claves = [cache_key(scope, key) for scope, key in claves_medicion(medicion)]
+    transaction.on_commit(lambda: cache.delete_many(claves))
+
+
+def _ultima_en_bd(scope, key):
+    candidatas = [
+        model.objects.filter(**{field: key}).order_by('-timestamp').first()
+        for model, field in LATEST_SOURCES[scope]
+    ]
+    candidatas = [medicion for medicion in candidatas if medicion is not None]
+    return max(candidatas, key=lambda medicion: medicion.timestamp) if candidatas else None
+
+
+def consultar_ultimas(scope, keys):
+    """Retorna `{clave: {'flow_rate', 'timestamp', 'device'} | None}` para varias claves de un ámbito."""
+    claves = {key: cache_key(scope, key) for key in keys}
+    en_cache = cache.get_many(list(claves.values()))
+
+    resultado = {}
+    for key, clave in claves.items():
+        if clave in en_cache:
+            resultado[key] = en_cache[clave]
+            continue
+        medicion = _ultima_en_bd(scope, key)
+        # Las claves sin lecturas también se guardan (como None) para no consultarlas de nuevo;
+        # `add` no pisa una lectura más reciente escrita por una ingesta concurrente
+        resultado[key] = _valor(medicion) if medicion else None
+        cache.add(clave, resultado[key], timeout=_timeout())
+    return resultado
@@ -0,0 +1,170 @@
+"""
+Transmisión en vivo de lecturas e inconsistencias de caudal (Server-Sent Events).
+
+La ingesta publica cada lectura de predio o lote y cada `FlowInconsistency` nueva en
+un único hub en memoria al confirmarse la transacción. Cada conexión SSE abierta es
+un suscriptor con los predios y lotes de su usuario: el hub le entrega solo los
+eventos que le corresponden en su cola, sin consultas a la base de datos por
+visor, de modo que muchos visores no multiplican la carga.
+
+El hub es por proceso: un visor recibe los eventos ingeridos por el mismo proceso
+(la API bajo uvicorn). Las lecturas que escribe otro proceso, como
+`run_telemetry_gateway`, no se transmiten.
+"""
+import asyncio
+import json
+import logging
+import threading
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from .models import FlowMeasurementPredio, FlowMeasurementLote
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_KEEPALIVE_SECONDS = 15
+
+
+def get_keepalive():
+    return getattr(settings, 'CAUDAL_STREAM_KEEPALIVE_SECONDS', DEFAULT_KEEPALIVE_SECONDS)
+
+
+class Subscription:
+    """Cola de eventos de un visor, atada al bucle de eventos donde se consume."""
+
+    def __init__(self, plots, lots, loop, queue_size):
+        self.plots = frozenset(plots)
+        self.lots = frozenset(lots)
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def wants(self, event):
+        if 'lot' in event:
+            return event['lot'] in self.lots
+        return event.get('plot') in self.plots
+
+    def deliver(self, events):
+        # Se ejecuta en el bucle del visor; si su cola está llena los eventos se descartan
+        for event in events:
+            try:
+                self.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.dropped += 1
+
+
+class FlowEventHub:
+    """Publicación/suscripción en memoria entre la ingesta (síncrona) y los visores (asíncronos)."""
+
+    def __init__(self, queue_size=None):
+        self.queue_size = queue_size or getattr(settings, 'CAUDAL_STREAM_QUEUE_SIZE', DEFAULT_QUEUE_SIZE)
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def subscribe(self, plots, lots):
+        """Registra un visor; debe llamarse desde el bucle de eventos que consumirá la cola."""
+        subscription = Subscription(plots, lots, asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, events):
+        """Entrega a cada visor los eventos de sus predios y lotes. Es seguro desde cualquier hilo."""
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            matching = [event for event in events if subscription.wants(event)]
+            if not matching:
+                continue
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, matching)
+            except RuntimeError:
+                # El bucle del visor ya se cerró
+                self.unsubscribe(subscription)
+
+
+_hub = FlowEventHub()
+
+
+def get_hub():
+    return _hub
+
+
+def evento_lectura(medicion):
+    event = {
+        'type': 'reading',
+        'device': medicion.device_id,
+        'flow_rate': medicion.flow_rate,
+        'timestamp': medicion.timestamp,
+    }
+    if isinstance(medicion, FlowMeasurementLote):
+        event['lot'] = medicion.lot_id
+    else:
+        event['plot'] = medicion.plot_id
+    return event
+
+
+def evento_inconsistencia(inconsistencia):
+    return {
+        'type': 'inconsistency',
+        'id': inconsistencia.pk,
+        'plot': inconsistencia.plot_id,
+        'recorded_flow': inconsistencia.recorded_flow,
+        'total_lots_flow': inconsistencia.total_lots_flow,
+        'difference': inconsistencia.difference,
+        'timestamp': inconsistencia.timestamp,
+        'window_start': inconsistencia.window_start,
+        'window_end': inconsistencia.window_end,
+    }
+
+
+def publicar_lecturas(mediciones):
+    """Publica las lecturas de predio y lote del conjunto al confirmarse la transacción."""
+    if not len(_hub):
+        return
+    events = [
+        evento_lectura(medicion) for medicion in mediciones
+        if isinstance(medicion, (FlowMeasurementPredio, FlowMeasurementLote))
+    ]
+    if events:
+        transaction.on_commit(lambda: _hub.publish(events))
+
+
+def publicar_inconsistencia(inconsistencia):
+    if len(_hub):
+        event = evento_inconsistencia(inconsistencia)
+        transaction.on_commit(lambda: _hub.publish([event]))
+
+
+def formato_sse(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event, cls=DjangoJSONEncoder)}\n\n"
+
+
+async def transmitir(subscription, hub=None):
+    """Genera el flujo SSE de un visor hasta que se desconecta."""
+    hub = hub or _hub
+    keepalive = get_keepalive()
+    dropped = 0
+    try:
+        yield f"retry: {keepalive * 1000}\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if subscription.dropped != dropped:
+                # El visor no alcanzó a consumir: se le avisa para que recargue el estado actual
+                yield formato_sse({'type': 'lagged', 'dropped': subscription.dropped - dropped})
+                dropped = subscription.dropped
+            yield formato_sse(event)
+    finally:
+        hub.unsubscribe(subscription)
@@ -0,0 +1,66 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from plots_lots.models import Plot
+from caudal.backfill import Checkpoint, DEFAULT_CHUNK_SIZE, recalcular_predios
+from caudal.balance import get_tolerance
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula las ventanas de balance y las inconsistencias de caudal de todo el histórico, "
+        "en paralelo por predio. Se puede retomar desde el punto de control."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--plot', action='append', dest='plots', help="Predio a recalcular (repetible). Por defecto, todos.")
+        parser.add_argument('--workers', type=int, default=1, help="Procesos en paralelo (1 = en este proceso).")
+        parser.add_argument('--tolerance', type=float, help="Tolerancia a aplicar. Por defecto, CAUDAL_BALANCE_TOLERANCE.")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Mediciones leídas y filas escritas por bloque.")
+        parser.add_argument('--max-tasks-per-child', type=int, default=50, help="Predios por proceso antes de reemplazarlo.")
+        parser.add_argument(
+            '--checkpoint', default='flow_inconsistency_backfill.json',
+            help="Archivo con los predios ya recalculados, para retomar una ejecución interrumpida."
+        )
+        parser.add_argument('--restart', action='store_true', help="Ignora el punto de control y recalcula todos los predios.")
+
+    def handle(self, *args, **options):
+        tolerance = options['tolerance'] if options['tolerance'] is not None else get_tolerance()
+        checkpoint = Checkpoint(options['checkpoint'], tolerance)
+        if options['restart']:
+            checkpoint.clear()
+        try:
+            checkpoint.load()
+        except ValueError as exc:
+            raise CommandError(f"{exc} Usa --restart para empezar de nuevo.")
+
+        plots = Plot.objects.order_by('id_plot')
+        if options['plots']:
+            plots = plots.filter(id_plot__in=options['plots'])
+        plot_ids = [plot_id for plot_id in plots.values_list('id_plot', flat=True) if plot_id not in checkpoint.done]
+        if checkpoint.done:
+            self.stdout.write(f"Retomando: {len(checkpoint.done)} predios ya recalculados.")
+
+        started = time.monotonic()
+        totals = {'readings': 0, 'windows': 0, 'inconsistencies': 0}
+        resultados = recalcular_predios(
+            plot_ids,
+            workers=options['workers'],
+            tolerance=tolerance,
+            chunk_size=options['chunk_size'],
+            max_tasks_per_child=options['max_tasks_per_child'],
+        )
+        for count, resumen in enumerate(resultados, start=1):
+            checkpoint.mark(resumen['plot'])
+            for key in totals:
+                totals[key] += resumen[key]
+            self.stdout.write(
+                f"[{count}/{len(plot_ids)}] Predio {resumen['plot']}: {resumen['readings']} mediciones, "
+                f"{resumen['windows']} ventanas, {resumen['inconsistencies']} inconsistencias "
+                f"({time.monotonic() - started:.1f} s)"
+            )
+
+        checkpoint.clear()
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(plot_ids)} predios recalculados con tolerancia {tolerance}: {totals['readings']} mediciones, "
+            f"{totals['windows']} ventanas, {totals['inconsistencies']} inconsistencias."
+        ))
@@ -0,0 +1,216 @@
+import json
+import platform
+import random
+import subprocess
+import time
+from datetime import timedelta
+import django
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from users.models import CustomUser
+from plots_lots.models import Plot, Lot, CropType, SoilType
+from iot.models import IoTDevice
+from caudal.models import FlowMeasurementPredio, FlowMeasurementLote
+from caudal.ingestion import ingest_readings
+from caudal.buffer import MeasurementBuffer
+
+PATHS = ('single', 'bulk', 'buffered')
+FLOW_METER_TYPE = '04'
+
+
+def seed_district(plots, lots_per_plot):
+    """Crea un usuario, `plots` predios con `lots_per_plot` lotes y un medidor por predio y por lote."""
+    owner = CustomUser.objects.create_user(
+        document='900000001', first_name='Benchmark', last_name='Caudal',
+        email='benchmark@aquasmart.local', phone='3000000001', password='benchmark',
+    )
+    crop_type, soil_type = CropType.objects.first(), SoilType.objects.first()
+    plot_devices, lot_devices = [], []
+    for number in range(plots):
+        plot = Plot.objects.create(owner=owner, plot_name=f'Predio {number}', latitud=1, longitud=1, plot_extension=10)
+        plot_devices.append(IoTDevice.objects.create(name=f'Medidor predio {number}', device_type_id=FLOW_METER_TYPE, id_plot=plot))
+        for _ in range(lots_per_plot):
+            lot = Lot.objects.create(plot=plot, crop_type=crop_type, soil_type=soil_type)
+            lot_devices.append(IoTDevice.objects.create(name=f'Medidor lote {lot.id_lot}', device_type_id=FLOW_METER_TYPE, id_plot=plot, id_lot=lot))
+    return plot_devices, lot_devices
+
+
+def synthetic_readings(plot_devices, lot_devices, readings, start, seed=0):
+    """
+    Lecturas sintéticas `{'device', 'lot', 'plot', 'flow_rate', 'timestamp'}` en orden cronológico.
+
+    Las primeras lecturas son una por medidor de predio, de modo que ningún lote reporte
+    antes que su predio: en el camino individual `FlowMeasurementLote.save()` crearía
+    una medición de predio adicional y los caminos no escribirían las mismas filas.
+    Después, una de cada diez lecturas es de un medidor de predio y el resto, de
+    medidores de lote.
+    """
+    rng = random.Random(seed)
+    result = []
+    for index in range(readings):
+        timestamp = start + timedelta(seconds=index)
+        if index < len(plot_devices) or index % 10 == 0:
+            device = plot_devices[index] if index < len(plot_devices) else rng.choice(plot_devices)
+            result.append({'device': device.iot_id, 'lot': None, 'plot': device.id_plot_id,
+                           'flow_rate': round(rng.uniform(5, 20), 3), 'timestamp': timestamp})
+        else:
+            device = rng.choice(lot_devices)
+            result.append({'device': device.iot_id, 'lot': device.id_lot_id, 'plot': None,
+                           'flow_rate': round(rng.uniform(0.1, 2), 3), 'timestamp': timestamp})
+    return result
+
+
+def _payload(reading):
+    return {**reading, 'timestamp': reading['timestamp'].isoformat()}
+
+
+def _batches(readings, batch_size):
+    return [readings[start:start + batch_size] for start in range(0, len(readings), batch_size)]
+
+
+def run_single(readings, batch_size):
+    """Una lectura por `save()`, como el endpoint de creación individual."""
+    latencies = []
+    with CaptureQueriesContext(connection) as queries:
+        for reading in readings:
+            started = time.perf_counter()
+            if reading['lot']:
+                FlowMeasurementLote.objects.create(lot_id=reading['lot'], device_id=reading['device'],
+                                                   flow_rate=reading['flow_rate'], timestamp=reading['timestamp'])
+            else:
+                FlowMeasurementPredio.objects.create(plot_id=reading['plot'], device_id=reading['device'],
+                                                     flow_rate=reading['flow_rate'], timestamp=reading['timestamp'])
+            latencies.append(time.perf_counter() - started)
+    return latencies, len(queries)
+
+
+def run_bulk(readings, batch_size):
+    """Envíos de `batch_size` lecturas por `ingest_readings`, como el endpoint de ingesta masiva."""
+    latencies = []
+    with CaptureQueriesContext(connection) as queries:
+        for batch in _batches([_payload(r) for r in readings], batch_size):
+            started = time.perf_counter()
+            ingest_readings(batch)
+            latencies.append(time.perf_counter() - started)
+    return latencies, len(queries)
+
+
+def run_buffered(readings, batch_size):
+    """Envíos de `batch_size` lecturas encolados en el búfer; la latencia es la del encolado."""
+    query_counts = []
+
+    def writer(batch):
+        # El escritor corre en su propio hilo, con su propia conexión
+        with CaptureQueriesContext(connections['default']) as queries:
+            result = ingest_readings(batch)
+        query_counts.append(len(queries))
+        return result
+
+    buffer = MeasurementBuffer(capacity=len(readings), writer=writer).start()
+    latencies = []
+    for batch in _batches([_payload(r) for r in readings], batch_size):
+        started = time.perf_counter()
+        buffer.put(batch)
+        latencies.append(time.perf_counter() - started)
+    buffer.stop()
+    if buffer.failed:
+        raise CommandError(f"El búfer no pudo escribir {buffer.failed} lecturas.")
+    return latencies, sum(query_counts)
+
+
+RUNNERS = {'single': run_single, 'bulk': run_bulk, 'buffered': run_buffered}
+
+
+def run_path(path, readings, batch_size):
+    """Ejecuta un camino de ingesta y retorna sus métricas."""
+    started = time.perf_counter()
+    latencies, queries = RUNNERS[path](readings, batch_size)
+    elapsed = time.perf_counter() - started
+    latencies_ms = np.array(latencies) * 1e3
+    return {
+        'path': path,
+        'readings': len(readings),
+        'requests': len(latencies),
+        'seconds': round(elapsed, 4),
+        'rows_per_second': round(len(readings) / elapsed, 1),
+        'latency_ms': {
+            'p50': round(float(np.percentile(latencies_ms, 50)), 3),
+            'p99': round(float(np.percentile(latencies_ms, 99)), 3),
+        },
+        'queries': queries,
+        'queries_per_reading': round(queries / len(readings), 3),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide la ingesta de mediciones de caudal (individual, masiva y con búfer) sobre una base de datos "
+        "de prueba sembrada con predios, lotes y medidores: lecturas/s, latencia p50/p99 y consultas por lectura. "
+        "Usa el motor de DATABASE_URL (SQLite o PostgreSQL); la base de prueba se elimina al terminar."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--plots', type=int, default=20)
+        parser.add_argument('--lots-per-plot', type=int, default=5)
+        parser.add_argument('--readings', type=int, default=5000, help="Lecturas por camino de ingesta.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Lecturas por envío en la ingesta masiva y con búfer.")
+        parser.add_argument('--path', action='append', dest='paths', choices=PATHS, help="Camino a medir (repetible). Por defecto, todos.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', dest='json_path', help="Archivo donde guardar los resultados en JSON ('-' para la salida estándar).")
+
+    def handle(self, *args, **options):
+        if options['plots'] < 1 or options['lots_per_plot'] < 1 or options['readings'] < 1 or options['batch_size'] < 1:
+            raise CommandError("--plots, --lots-per-plot, --readings y --batch-size deben ser positivos.")
+        paths = options['paths'] or list(PATHS)
+
+        # Base de prueba aparte: las mediciones sintéticas no llegan a la base real
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            plot_devices, lot_devices = seed_district(options['plots'], options['lots_per_plot'])
+            start = timezone.now().replace(microsecond=0)
+            results = []
+            for number, path in enumerate(paths):
+                # Cada camino escribe en su propio rango de fechas
+                readings = synthetic_readings(
+                    plot_devices, lot_devices, options['readings'],
+                    start + timedelta(seconds=number * options['readings']), options['seed'],
+                )
+                result = run_path(path, readings, options['batch_size'])
+                results.append(result)
+                self.stdout.write(
+                    f"{path:9} {result['rows_per_second']:10.1f} lecturas/s  "
+                    f"p50 {result['latency_ms']['p50']:8.3f} ms  p99 {result['latency_ms']['p99']:8.3f} ms  "
+                    f"{result['queries_per_reading']:7.3f} consultas/lectura"
+                )
+            vendor = connection.vendor
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = {
+            'commit': _git_commit(),
+            'database': vendor,
+            'django': django.get_version(),
+            'python': platform.python_version(),
+            'plots': options['plots'],
+            'lots_per_plot': options['lots_per_plot'],
+            'batch_size': options['batch_size'],
+            'seed': options['seed'],
+            'results': results,
+        }
+        if options['json_path'] == '-':
+            self.stdout.write(json.dumps(report, indent=2))
+        elif options['json_path']:
+            with open(options['json_path'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Resultados guardados en {options['json_path']}."))
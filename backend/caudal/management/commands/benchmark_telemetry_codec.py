@@ -0,0 +1,61 @@
+import json
+import time
+from datetime import datetime
+import numpy as np
+from django.core.management.base import BaseCommand
+from caudal.codec import encode_batch, decode_batch, iter_readings
+
+
+def synthetic_batch(readings, devices, seed=0):
+    """Lecturas sintéticas `(iot_id, epoch, caudal)` repartidas entre `devices` medidores."""
+    rng = np.random.default_rng(seed)
+    start = int(datetime(2026, 1, 1).timestamp())
+    suffixes = rng.integers(0, min(devices, 10000), size=readings)
+    flows = rng.uniform(0.0, 5.0, size=readings).astype(np.float32)
+    return [(f"04-{suffix:04d}", start + index, float(flow)) for index, (suffix, flow) in enumerate(zip(suffixes.tolist(), flows.tolist()))]
+
+
+def decode_json(payload):
+    return [
+        (item['device'], float(item['flow_rate']), datetime.fromisoformat(item['timestamp']))
+        for item in json.loads(payload)
+    ]
+
+
+def decode_binary(payload):
+    return list(iter_readings(decode_batch(payload)))
+
+
+class Command(BaseCommand):
+    help = "Compara tamaño y tiempo de decodificación de lotes de lecturas en JSON y en el formato binario."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readings', type=int, default=100000)
+        parser.add_argument('--devices', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def best_of(self, function, payload, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function(payload)
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    def handle(self, *args, **options):
+        batch = synthetic_batch(options['readings'], options['devices'])
+        json_payload = json.dumps([
+            {'device': iot_id, 'flow_rate': flow, 'timestamp': datetime.fromtimestamp(epoch).isoformat()}
+            for iot_id, epoch, flow in batch
+        ]).encode()
+        binary_payload = encode_batch(batch)
+
+        json_time = self.best_of(decode_json, json_payload, options['repeat'])
+        binary_time = self.best_of(decode_binary, binary_payload, options['repeat'])
+        count = len(batch)
+        self.stdout.write(f"JSON:    {len(json_payload) / count:6.1f} bytes/lectura, {json_time:.3f} s, {count / json_time / 1e3:8.0f} k lecturas/s")
+        self.stdout.write(f"Binario: {len(binary_payload) / count:6.1f} bytes/lectura, {binary_time:.3f} s, {count / binary_time / 1e3:8.0f} k lecturas/s")
+        self.stdout.write(self.style.SUCCESS(
+            f"El formato binario ocupa {len(json_payload) / len(binary_payload):.1f}× menos y decodifica "
+            f"{json_time / binary_time:.1f}× más rápido (mejor de {options['repeat']})."
+        ))
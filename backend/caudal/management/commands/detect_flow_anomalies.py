@@ -0,0 +1,28 @@
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from caudal.analytics import scan
+
+
+class Command(BaseCommand):
+    help = "Analiza las series horarias de todos los dispositivos y guarda las anomalías y posibles fugas detectadas."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=14, help="Días analizados hasta hoy (incluye la historia de referencia).")
+        parser.add_argument('--until', help="Último día analizado (YYYY-MM-DD). Por defecto, hoy.")
+        parser.add_argument('--dry-run', action='store_true', help="Muestra las anomalías sin guardarlas.")
+
+    def handle(self, *args, **options):
+        until = datetime.now().date()
+        if options['until']:
+            until = parse_date(options['until'])
+            if until is None:
+                raise CommandError("La fecha --until no es válida.")
+        fin = datetime.combine(until + timedelta(days=1), datetime.min.time())
+        inicio = fin - timedelta(days=options['days'])
+
+        anomalies = scan(inicio, fin, save=not options['dry_run'])
+        for anomaly in anomalies:
+            self.stdout.write(f"{anomaly.timestamp:%Y-%m-%d %H:%M} {anomaly.device_id} {anomaly.kind} "
+                              f"caudal={anomaly.flow_rate:.4f} referencia={anomaly.baseline:.4f} puntaje={anomaly.score:.2f}")
+        self.stdout.write(self.style.SUCCESS(f"{len(anomalies)} anomalías detectadas entre {inicio:%Y-%m-%d} y {fin:%Y-%m-%d}."))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from caudal.partitions import ensure_partitions, apply_retention
+
+
+class Command(BaseCommand):
+    help = (
+        "Crea por adelantado las particiones mensuales de las mediciones de caudal (PostgreSQL) "
+        "y aplica la política de retención configurada. Con --create-only solo crea particiones, "
+        "para los despliegues; la retención se programa aparte."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, help="Meses futuros a preparar (CAUDAL_PARTITION_MONTHS_AHEAD).")
+        parser.add_argument('--create-only', action='store_true', help="Solo crea particiones, sin aplicar la retención.")
+        parser.add_argument('--retention-months', type=int, help="Meses anteriores al actual que se conservan (CAUDAL_RETENTION_MONTHS).")
+        parser.add_argument('--mode', choices=['drop', 'archive'], help="Eliminar o archivar las particiones vencidas (CAUDAL_RETENTION_MODE).")
+        parser.add_argument('--dry-run', action='store_true', help="Muestra la retención que se aplicaría sin ejecutarla.")
+
+    def handle(self, *args, **options):
+        if options['create_only'] and (options['dry_run'] or options['retention_months'] is not None or options['mode']):
+            raise CommandError("--create-only no admite --retention-months, --mode ni --dry-run.")
+
+        if not options['dry_run']:
+            for name in ensure_partitions(months_ahead=options['months_ahead']):
+                self.stdout.write(f"Partición creada: {name}")
+        if options['create_only']:
+            self.stdout.write(self.style.SUCCESS("Particiones de mediciones al día; retención no aplicada."))
+            return
+
+        try:
+            actions = apply_retention(
+                retention_months=options['retention_months'],
+                mode=options['mode'],
+                dry_run=options['dry_run'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for action in actions:
+            self.stdout.write(action)
+        self.stdout.write(self.style.SUCCESS("Particiones y retención de mediciones al día."))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime, parse_date
+from datetime import datetime
+from caudal.rollups import reconstruir_rollups
+
+
+class Command(BaseCommand):
+    help = "Reconstruye los agregados por minuto, hora y día a partir de las mediciones de caudal."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            help="Fecha (YYYY-MM-DD o ISO 8601) desde la cual reconstruir. Por defecto se reconstruye todo el histórico."
+        )
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Mediciones leídas por bloque.")
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                date = parse_date(options['since'])
+                if date is None:
+                    raise CommandError("La fecha --since no es válida.")
+                since = datetime.combine(date, datetime.min.time())
+
+        procesadas = reconstruir_rollups(desde=since, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Agregados reconstruidos a partir de {procesadas} mediciones."))
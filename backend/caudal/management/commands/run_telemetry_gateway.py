@@ -0,0 +1,36 @@
+import signal
+from django.core.management.base import BaseCommand
+from caudal.buffer import MeasurementBuffer
+from caudal.gateway import LocalBroker, TelemetryGateway, UDPListener
+
+
+class Command(BaseCommand):
+    help = "Inicia la pasarela UDP de telemetría: recibe lecturas de los dispositivos y las escribe por lotes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', help="Dirección en la que escucha (por defecto CAUDAL_GATEWAY_HOST).")
+        parser.add_argument('--port', type=int, help="Puerto UDP (por defecto CAUDAL_GATEWAY_PORT).")
+
+    def handle(self, *args, **options):
+        broker = LocalBroker()
+        buffer = MeasurementBuffer().start()
+        gateway = TelemetryGateway(broker, buffer=buffer)
+        listener = UDPListener(broker, host=options['host'], port=options['port'])
+
+        def terminate(signum, frame):
+            raise KeyboardInterrupt
+
+        signal.signal(signal.SIGTERM, terminate)
+        host, port = listener.server_address[:2]
+        self.stdout.write(self.style.SUCCESS(f"Pasarela de telemetría escuchando en udp://{host}:{port}"))
+        try:
+            listener.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            listener.server_close()
+            buffer.stop()
+            self.stdout.write(
+                f"Pasarela detenida: {gateway.accepted} lecturas aceptadas, {gateway.dropped} descartadas, "
+                f"{buffer.written} escritas."
+            )
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.6 on 2026-10-16 15:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caudal', '0006_flowmeasurementlote_device_and_more'),
+        ('plots_lots', '0008_croptype_lot_crop_name_alter_lot_crop_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlotFlowBalance',
+            fields=[
+                ('plot', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='flow_balance', serialize=False, to='plots_lots.plot', verbose_name='Predio')),
+                ('window_start', models.DateTimeField(verbose_name='Inicio de la ventana')),
+                ('recorded_flow', models.FloatField(verbose_name='Caudal registrado en el predio (m³/s)')),
+                ('lots_flow_total', models.FloatField(default=0, verbose_name='Suma de caudales de los lotes (m³/s)')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Última actualización')),
+            ],
+            options={
+                'verbose_name': 'Balance de caudal de predio',
+                'verbose_name_plural': 'Balances de caudal de predios',
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.6 on 2026-10-16 15:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caudal', '0007_plotflowbalance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FlowRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('device', 'Dispositivo'), ('plot', 'Predio'), ('lot', 'Lote')], max_length=6, verbose_name='Ámbito')),
+                ('key', models.CharField(max_length=15, verbose_name='ID del dispositivo, predio o lote')),
+                ('bucket', models.CharField(choices=[('minute', 'Minuto'), ('hour', 'Hora'), ('day', 'Día')], max_length=6, verbose_name='Intervalo')),
+                ('bucket_start', models.DateTimeField(verbose_name='Inicio del intervalo')),
+                ('count', models.PositiveIntegerField(verbose_name='Cantidad de lecturas')),
+                ('min_flow', models.FloatField(verbose_name='Caudal mínimo (m³/s)')),
+                ('max_flow', models.FloatField(verbose_name='Caudal máximo (m³/s)')),
+                ('sum_flow', models.FloatField(verbose_name='Suma de caudales (m³/s)')),
+                ('last_flow', models.FloatField(verbose_name='Último caudal (m³/s)')),
+                ('last_timestamp', models.DateTimeField(verbose_name='Fecha de la última lectura')),
+            ],
+            options={
+                'verbose_name': 'Agregado de caudal',
+                'verbose_name_plural': 'Agregados de caudal',
+                'constraints': [models.UniqueConstraint(fields=('scope', 'key', 'bucket', 'bucket_start'), name='unique_flow_rollup_bucket')],
+            },
+        ),
+    ]
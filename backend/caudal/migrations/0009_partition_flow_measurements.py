@@ -0,0 +1,115 @@
+"""
+Convierte las tablas de mediciones de caudal en tablas particionadas por mes (PostgreSQL).
+
+En PostgreSQL cada tabla se recrea con `PARTITION BY RANGE (timestamp)`, una partición
+por mes con datos más los próximos meses y una partición por defecto; la llave
+primaria pasa a ser `(id, timestamp)` porque debe incluir la llave de partición.
+En otros motores (SQLite) las tablas quedan como tablas simples.
+"""
+from datetime import date
+from django.db import migrations
+
+MODELS = ['FlowMeasurement', 'FlowMeasurementPredio', 'FlowMeasurementLote']
+MONTHS_AHEAD = 3
+
+
+def _add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _partition(schema_editor, table, month):
+    q = schema_editor.quote_name
+    name = f"{table}_p{month:%Y%m}"
+    schema_editor.execute(
+        f"CREATE TABLE IF NOT EXISTS {q(name)} PARTITION OF {q(table)} "
+        f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{_add_months(month, 1):%Y-%m-%d}')"
+    )
+
+
+def partition_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    q = schema_editor.quote_name
+
+    for model_name in MODELS:
+        model = apps.get_model('caudal', model_name)
+        table = model._meta.db_table
+        legacy = f"{table}_legacy"
+        timestamp = model._meta.get_field('timestamp').column
+
+        schema_editor.execute(f"ALTER TABLE {q(table)} RENAME TO {q(legacy)}")
+        schema_editor.execute(
+            f"CREATE TABLE {q(table)} (LIKE {q(legacy)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+            f"PARTITION BY RANGE ({q(timestamp)})"
+        )
+        # Nombre propio: `<tabla>_pkey` sigue en uso por la tabla renombrada
+        schema_editor.execute(
+            f"ALTER TABLE {q(table)} ADD CONSTRAINT {q(f'{table}_id_timestamp_pkey')} PRIMARY KEY ({q('id')}, {q(timestamp)})"
+        )
+
+        # Una partición por cada mes con datos y por los próximos meses; el resto cae en la de defecto
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(f"SELECT MIN({q(timestamp)}) FROM {q(legacy)}")
+            oldest = cursor.fetchone()[0]
+        current = date.today().replace(day=1)
+        month = oldest.date().replace(day=1) if oldest else current
+        while month <= _add_months(current, MONTHS_AHEAD):
+            _partition(schema_editor, table, month)
+            month = _add_months(month, 1)
+        schema_editor.execute(f"CREATE TABLE {q(f'{table}_default')} PARTITION OF {q(table)} DEFAULT")
+
+        schema_editor.execute(f"INSERT INTO {q(table)} SELECT * FROM {q(legacy)}")
+        schema_editor.execute(f"DROP TABLE {q(legacy)}")
+
+        # Llaves foráneas después de copiar: se validan en una sola pasada y sin eventos de trigger pendientes
+        for field in model._meta.concrete_fields:
+            if not field.remote_field:
+                continue
+            target = field.target_field
+            schema_editor.execute(
+                f"ALTER TABLE {q(table)} ADD CONSTRAINT {q(f'{table}_{field.column}_fk')} "
+                f"FOREIGN KEY ({q(field.column)}) REFERENCES {q(target.model._meta.db_table)} ({q(target.column)}) "
+                f"DEFERRABLE INITIALLY DEFERRED"
+            )
+            schema_editor.execute(f"CREATE INDEX {q(f'{table}_{field.column}_idx')} ON {q(table)} ({q(field.column)})")
+
+        # Las columnas identidad no se admiten en tablas particionadas: se usa una secuencia propia
+        sequence = f"{table}_id_seq"
+        schema_editor.execute(f"CREATE SEQUENCE {q(sequence)} OWNED BY {q(table)}.{q('id')}")
+        schema_editor.execute(f"ALTER TABLE {q(table)} ALTER COLUMN {q('id')} SET DEFAULT nextval('{sequence}')")
+        schema_editor.execute(
+            f"SELECT setval('{sequence}', COALESCE((SELECT MAX({q('id')}) FROM {q(table)}), 0) + 1, false)"
+        )
+
+
+def unpartition_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    q = schema_editor.quote_name
+
+    for model_name in MODELS:
+        model = apps.get_model('caudal', model_name)
+        table = model._meta.db_table
+        partitioned = f"{table}_partitioned"
+
+        schema_editor.execute(f"ALTER TABLE {q(table)} RENAME TO {q(partitioned)}")
+        schema_editor.execute(f"ALTER SEQUENCE {q(f'{table}_id_seq')} RENAME TO {q(f'{partitioned}_id_seq')}")
+        schema_editor.create_model(model)
+        schema_editor.execute(f"INSERT INTO {q(table)} SELECT * FROM {q(partitioned)}")
+        schema_editor.execute(f"DROP TABLE {q(partitioned)} CASCADE")
+        schema_editor.execute(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f"COALESCE((SELECT MAX({q('id')}) FROM {q(table)}), 0) + 1, false)"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caudal', '0008_flowrollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_tables, unpartition_tables),
+    ]
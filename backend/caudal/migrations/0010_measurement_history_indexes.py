@@ -0,0 +1,35 @@
+# Generated by Django 5.1.6 on 2026-10-16 15:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caudal', '0009_partition_flow_measurements'),
+        ('iot', '0013_alter_iotdevice_registration_date'),
+        ('plots_lots', '0008_croptype_lot_crop_name_alter_lot_crop_type'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='flowmeasurement',
+            index=models.Index(fields=['device', '-timestamp'], name='flowmeas_device_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flowmeasurementlote',
+            index=models.Index(fields=['lot', '-timestamp'], name='flowmeas_lote_lot_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flowmeasurementlote',
+            index=models.Index(fields=['device', '-timestamp'], name='flowmeas_lote_device_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flowmeasurementpredio',
+            index=models.Index(fields=['plot', '-timestamp'], name='flowmeas_predio_plot_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flowmeasurementpredio',
+            index=models.Index(fields=['device', '-timestamp'], name='flowmeas_predio_device_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.6 on 2026-10-16 15:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caudal', '0010_measurement_history_indexes'),
+        ('iot', '0013_alter_iotdevice_registration_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FlowAnomaly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('zscore', 'Desviación respecto a la media reciente'), ('night_flow', 'Caudal mínimo nocturno elevado (posible fuga)'), ('step', 'Cambio brusco de caudal')], max_length=10, verbose_name='Tipo de anomalía')),
+                ('timestamp', models.DateTimeField(verbose_name='Inicio del intervalo anómalo')),
+                ('flow_rate', models.FloatField(verbose_name='Caudal observado (m³/s)')),
+                ('baseline', models.FloatField(verbose_name='Caudal de referencia (m³/s)')),
+                ('score', models.FloatField(verbose_name='Puntaje de la anomalía')),
+                ('detected_at', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de detección')),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='flow_anomalies', to='iot.iotdevice', verbose_name='Dispositivo IoT')),
+            ],
+            options={
+                'verbose_name': 'Anomalía de caudal',
+                'verbose_name_plural': 'Anomalías de caudal',
+                'ordering': ['-timestamp'],
+                'constraints': [models.UniqueConstraint(fields=('device', 'kind', 'timestamp'), name='unique_flow_anomaly')],
+            },
+        ),
+    ]
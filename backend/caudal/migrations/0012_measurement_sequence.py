@@ -0,0 +1,33 @@
+# Generated by Django 5.1.6 on 2026-10-16 16:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caudal', '0011_flowanomaly'),
+        ('iot', '0013_alter_iotdevice_registration_date'),
+        ('plots_lots', '0008_croptype_lot_crop_name_alter_lot_crop_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flowmeasurementlote',
+            name='sequence',
+            field=models.PositiveBigIntegerField(blank=True, help_text='Consecutivo que asigna el dispositivo a cada lectura; identifica los reintentos.', null=True, verbose_name='Número de secuencia'),
+        ),
+        migrations.AddField(
+            model_name='flowmeasurementpredio',
+            name='sequence',
+            field=models.PositiveBigIntegerField(blank=True, help_text='Consecutivo que asigna el dispositivo a cada lectura; identifica los reintentos.', null=True, verbose_name='Número de secuencia'),
+        ),
+        migrations.AddConstraint(
+            model_name='flowmeasurementlote',
+            constraint=models.UniqueConstraint(fields=('device', 'sequence', 'timestamp'), name='unique_flowmeas_lote_sequence'),
+        ),
+        migrations.AddConstraint(
+            model_name='flowmeasurementpredio',
+            constraint=models.UniqueConstraint(fields=('device', 'sequence', 'timestamp'), name='unique_flowmeas_predio_sequence'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.6 on 2026-10-16 16:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caudal', '0012_measurement_sequence'),
+        ('plots_lots', '0008_croptype_lot_crop_name_alter_lot_crop_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flowinconsistency',
+            name='window_end',
+            field=models.DateTimeField(blank=True, help_text='Vacío si se detectó con la ventana vigente; con valor si se detectó al cerrar o recalcular una ventana.', null=True, verbose_name='Fin de la ventana evaluada'),
+        ),
+        migrations.AddField(
+            model_name='flowinconsistency',
+            name='window_start',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Inicio de la ventana evaluada'),
+        ),
+        migrations.AddField(
+            model_name='plotflowbalance',
+            name='max_event_time',
+            field=models.DateTimeField(blank=True, help_text='Menos el retraso permitido, define la marca de agua que cierra las ventanas anteriores.', null=True, verbose_name='Fecha más reciente recibida'),
+        ),
+        migrations.CreateModel(
+            name='PlotBalanceWindow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window_start', models.DateTimeField(verbose_name='Inicio de la ventana')),
+                ('window_end', models.DateTimeField(verbose_name='Fin de la ventana')),
+                ('recorded_flow', models.FloatField(verbose_name='Caudal registrado en el predio (m³/s)')),
+                ('lots_flow_total', models.FloatField(default=0, verbose_name='Suma de caudales de los lotes (m³/s)')),
+                ('inconsistent', models.BooleanField(default=False, verbose_name='Inconsistente')),
+                ('finalized', models.BooleanField(default=False, verbose_name='Finalizada')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Última actualización')),
+                ('plot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='flow_balance_windows', to='plots_lots.plot', verbose_name='Predio')),
+            ],
+            options={
+                'verbose_name': 'Ventana de balance de predio',
+                'verbose_name_plural': 'Ventanas de balance de predios',
+                'ordering': ['plot', 'window_start'],
+                'constraints': [models.UniqueConstraint(fields=('plot', 'window_start'), name='unique_plot_balance_window')],
+            },
+        ),
+    ]
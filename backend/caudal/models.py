@@ -1,9 +1,10 @@
 from django.db import models
 from iot.models import IoTDevice
+from iot.device_map import get_device_map
 from plots_lots.models import Plot,Lot
 from django.core.exceptions import ValidationError
-from django.db.models import Sum
 from auditlog.registry import auditlog
+from .audit import get_audit_mode
 from django.utils import timezone
 from datetime import timedelta
 
@@ -20,6 +21,9 @@ class FlowMeasurement(models.Model):
         verbose_name = "Medición de Caudal"
         verbose_name_plural = "Mediciones de Caudal"
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['device', '-timestamp'], name='flowmeas_device_ts_idx'),
+        ]
 
     def __str__(self):
         return f"{self.device.name} - {self.flow_rate} m³/s - {self.timestamp}"
@@ -35,22 +39,42 @@ class FlowMeasurementPredio(models.Model):
     )
     flow_rate = models.FloatField(verbose_name="Caudal (m³/s)")
     timestamp = models.DateTimeField(verbose_name="Fecha y Hora")
+    sequence = models.PositiveBigIntegerField(
+        null=True, blank=True, verbose_name="Número de secuencia",
+        help_text="Consecutivo que asigna el dispositivo a cada lectura; identifica los reintentos."
+    )
 
     class Meta:
         verbose_name = "Medición de Caudal de Predio"
         verbose_name_plural = "Mediciones de Caudal de Predios"
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['plot', '-timestamp'], name='flowmeas_predio_plot_ts_idx'),
+            models.Index(fields=['device', '-timestamp'], name='flowmeas_predio_device_ts_idx'),
+        ]
+        constraints = [
+            # Incluye la fecha: en PostgreSQL la tabla está particionada por `timestamp`
+            models.UniqueConstraint(fields=['device', 'sequence', 'timestamp'], name='unique_flowmeas_predio_sequence'),
+        ]
 
     def __str__(self):
         return f"Caudal Predio {self.plot.plot_name}: {self.flow_rate} m³/s ({self.timestamp})"
 
     def save(self, *args, **kwargs):
         """ Validación antes de guardar """
-        if self.device and not IoTDevice.objects.filter(iot_id=self.device.iot_id).exists():
-            raise ValidationError(f"El dispositivo {self.device.iot_id} no existe en la base de datos.")
+        if self.device_id and self.device_id not in get_device_map():
+            raise ValidationError(f"El dispositivo {self.device_id} no existe en la base de datos.")
 
+        is_new = self._state.adding
         super().save(*args, **kwargs)
 
+        # La medición más reciente del predio abre una nueva ventana de balance
+        from .balance import abrir_ventana, reconstruir_ventana
+        if is_new:
+            abrir_ventana(self)
+        else:
+            reconstruir_ventana(self.plot_id)
+
 
 
 class FlowMeasurementLote(models.Model):
@@ -64,57 +88,47 @@ class FlowMeasurementLote(models.Model):
     )
     flow_rate = models.FloatField(verbose_name="Caudal (m³/s)")
     timestamp = models.DateTimeField(verbose_name="Fecha y Hora")
+    sequence = models.PositiveBigIntegerField(
+        null=True, blank=True, verbose_name="Número de secuencia",
+        help_text="Consecutivo que asigna el dispositivo a cada lectura; identifica los reintentos."
+    )
 
     class Meta:
         verbose_name = "Medición de Caudal de Lote"
         verbose_name_plural = "Mediciones de Caudal de Lotes"
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['lot', '-timestamp'], name='flowmeas_lote_lot_ts_idx'),
+            models.Index(fields=['device', '-timestamp'], name='flowmeas_lote_device_ts_idx'),
+        ]
+        constraints = [
+            # Incluye la fecha: en PostgreSQL la tabla está particionada por `timestamp`
+            models.UniqueConstraint(fields=['device', 'sequence', 'timestamp'], name='unique_flowmeas_lote_sequence'),
+        ]
 
     def __str__(self):
         return f"Caudal Lote {self.lot.id_lot}: {self.flow_rate} m³/s ({self.timestamp})"
 
     def verificar_inconsistencia(self):
         """ Valida y guarda inconsistencias si hay diferencias significativas, sin validar tiempo. """
-        predio = self.lot.plot
-        ultima_medicion_predio = FlowMeasurementPredio.objects.filter(plot=predio).order_by('-timestamp').first()
-
-        # 🆕 Si no hay medición previa del predio, crear una nueva
-        if not ultima_medicion_predio:
-            print(f"📌 Creando primera medición de predio para {predio.plot_name} con {self.flow_rate} m³/s")
-            ultima_medicion_predio = FlowMeasurementPredio.objects.create(
-                plot=predio,
-                flow_rate=self.flow_rate,  # Se toma el caudal del lote como base
-                timestamp=timezone.now(),
-                device=self.device  # Asignamos el mismo dispositivo que midió el lote
-            )
-            return  # No validamos inconsistencia porque es la referencia inicial
-
-        # 🔍 Calcular el flujo total de los lotes
-        total_flow_lotes = FlowMeasurementLote.objects.filter(
-            lot__plot=predio,
-            timestamp__gte=ultima_medicion_predio.timestamp
-        ).aggregate(Sum('flow_rate'))['flow_rate__sum'] or 0
-
-        max_allowed_flow = ultima_medicion_predio.flow_rate * 1.05  # 5% de margen
-        diferencia = total_flow_lotes - ultima_medicion_predio.flow_rate
-
-        if total_flow_lotes > max_allowed_flow:
-            # 📌 Guardar inconsistencia sin validar tiempo
-            print(f"✅ Guardando inconsistencia: Predio {predio.plot_name}, Diferencia: {diferencia}")
-            FlowInconsistency.objects.create(
-                plot=predio,
-                recorded_flow=ultima_medicion_predio.flow_rate,
-                total_lots_flow=total_flow_lotes,
-                difference=diferencia
-            )
+        from .balance import registrar_lecturas_lote
+        registrar_lecturas_lote(self.lot.plot, [(self.timestamp, self.flow_rate)], self)
 
     def save(self, *args, **kwargs):
         """ Guarda la medición del lote y verifica inconsistencias después de guardar. """
-        if self.device and not IoTDevice.objects.filter(iot_id=self.device.iot_id).exists():
-            raise ValidationError(f"El dispositivo {self.device.iot_id} no existe en la base de datos.")
+        if self.device_id and self.device_id not in get_device_map():
+            raise ValidationError(f"El dispositivo {self.device_id} no existe en la base de datos.")
         
+        is_new = self._state.adding
         super().save(*args, **kwargs)  # Guarda el objeto en la base de datos
 
+        if not is_new:
+            # Una edición puede cambiar caudal o fecha: se recalcula solo la ventana del predio
+            from .balance import reconstruir_ventana, registrar_lecturas_lote
+            reconstruir_ventana(self.lot.plot_id)
+            registrar_lecturas_lote(self.lot.plot, [], self)
+            return
+
         # Verifica inconsistencias después del guardado
         self.verificar_inconsistencia()
 
@@ -128,6 +142,11 @@ class FlowInconsistency(models.Model):
     total_lots_flow = models.FloatField(verbose_name="Suma de caudales de los lotes (m³/s)")
     difference = models.FloatField(verbose_name="Diferencia de caudales (m³/s)")
     timestamp = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de detección")
+    window_start = models.DateTimeField(null=True, blank=True, verbose_name="Inicio de la ventana evaluada")
+    window_end = models.DateTimeField(
+        null=True, blank=True, verbose_name="Fin de la ventana evaluada",
+        help_text="Vacío si se detectó con la ventana vigente; con valor si se detectó al cerrar o recalcular una ventana."
+    )
 
     class Meta:
         verbose_name = "Inconsistencia de caudal"
@@ -139,7 +158,153 @@ class FlowInconsistency(models.Model):
         return (
             f"Inconsistencia en {self.plot.plot_name}: Diferencia de {self.difference:.3f} m³/s"
         )
+
+
+class PlotFlowBalance(models.Model):
+    """
+    Balance incremental de la ventana vigente de cada predio.
+
+    La ventana inicia en la última medición del predio y acumula el caudal de los lotes
+    medidos desde entonces, de modo que cada lectura de lote se verifica en O(1)
+    en lugar de volver a sumar todas las lecturas de la ventana.
+    """
+    plot = models.OneToOneField(
+        Plot, on_delete=models.CASCADE, primary_key=True, related_name="flow_balance", verbose_name="Predio"
+    )
+    window_start = models.DateTimeField(verbose_name="Inicio de la ventana")
+    recorded_flow = models.FloatField(verbose_name="Caudal registrado en el predio (m³/s)")
+    lots_flow_total = models.FloatField(default=0, verbose_name="Suma de caudales de los lotes (m³/s)")
+    max_event_time = models.DateTimeField(
+        null=True, blank=True, verbose_name="Fecha más reciente recibida",
+        help_text="Menos el retraso permitido, define la marca de agua que cierra las ventanas anteriores."
+    )
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Última actualización")
+
+    class Meta:
+        verbose_name = "Balance de caudal de predio"
+        verbose_name_plural = "Balances de caudal de predios"
+
+    def __str__(self):
+        return f"Balance {self.plot_id}: {self.lots_flow_total} / {self.recorded_flow} m³/s desde {self.window_start}"
+
+
+class PlotBalanceWindow(models.Model):
+    """
+    Ventana de balance ya cerrada de un predio: de una medición del predio a la siguiente.
+
+    Las lecturas que llegan tarde se suman a la ventana de su fecha. La ventana se
+    finaliza cuando la marca de agua del predio (fecha más reciente recibida menos el
+    retraso permitido) supera su fin; las lecturas que llegan después recalculan solo
+    esa ventana. Las ediciones de mediciones antiguas no recalculan las ventanas cerradas.
+    """
+    plot = models.ForeignKey(
+        Plot, on_delete=models.CASCADE, related_name="flow_balance_windows", verbose_name="Predio"
+    )
+    window_start = models.DateTimeField(verbose_name="Inicio de la ventana")
+    window_end = models.DateTimeField(verbose_name="Fin de la ventana")
+    recorded_flow = models.FloatField(verbose_name="Caudal registrado en el predio (m³/s)")
+    lots_flow_total = models.FloatField(default=0, verbose_name="Suma de caudales de los lotes (m³/s)")
+    inconsistent = models.BooleanField(default=False, verbose_name="Inconsistente")
+    finalized = models.BooleanField(default=False, verbose_name="Finalizada")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Última actualización")
+
+    class Meta:
+        verbose_name = "Ventana de balance de predio"
+        verbose_name_plural = "Ventanas de balance de predios"
+        ordering = ['plot', 'window_start']
+        constraints = [
+            models.UniqueConstraint(fields=['plot', 'window_start'], name='unique_plot_balance_window'),
+        ]
+
+    def __str__(self):
+        return f"Ventana {self.plot_id}: {self.window_start} - {self.window_end}"
+
+
+ROLLUP_SCOPE_CHOICES = [
+    ('device', 'Dispositivo'),
+    ('plot', 'Predio'),
+    ('lot', 'Lote'),
+]
+
+ROLLUP_BUCKET_CHOICES = [
+    ('minute', 'Minuto'),
+    ('hour', 'Hora'),
+    ('day', 'Día'),
+]
+
+
+class FlowRollup(models.Model):
+    """
+    Agregado materializado de las mediciones de caudal por intervalo de tiempo.
+
+    Cada fila resume las lecturas de un dispositivo, predio o lote (`scope` + `key`)
+    dentro de un intervalo de minuto, hora o día que inicia en `bucket_start`.
+    """
+    scope = models.CharField(max_length=6, choices=ROLLUP_SCOPE_CHOICES, verbose_name="Ámbito")
+    key = models.CharField(max_length=15, verbose_name="ID del dispositivo, predio o lote")
+    bucket = models.CharField(max_length=6, choices=ROLLUP_BUCKET_CHOICES, verbose_name="Intervalo")
+    bucket_start = models.DateTimeField(verbose_name="Inicio del intervalo")
+    count = models.PositiveIntegerField(verbose_name="Cantidad de lecturas")
+    min_flow = models.FloatField(verbose_name="Caudal mínimo (m³/s)")
+    max_flow = models.FloatField(verbose_name="Caudal máximo (m³/s)")
+    sum_flow = models.FloatField(verbose_name="Suma de caudales (m³/s)")
+    last_flow = models.FloatField(verbose_name="Último caudal (m³/s)")
+    last_timestamp = models.DateTimeField(verbose_name="Fecha de la última lectura")
+
+    class Meta:
+        verbose_name = "Agregado de caudal"
+        verbose_name_plural = "Agregados de caudal"
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key', 'bucket', 'bucket_start'], name='unique_flow_rollup_bucket'),
+        ]
+
+    @property
+    def mean_flow(self):
+        return self.sum_flow / self.count if self.count else None
+
+    def __str__(self):
+        return f"{self.get_scope_display()} {self.key} - {self.bucket} {self.bucket_start}"
+
+
+
+ANOMALY_KIND_CHOICES = [
+    ('zscore', 'Desviación respecto a la media reciente'),
+    ('night_flow', 'Caudal mínimo nocturno elevado (posible fuga)'),
+    ('step', 'Cambio brusco de caudal'),
+]
+
+
+class FlowAnomaly(models.Model):
+    """
+    Anomalía detectada por el análisis vectorizado de las series de caudal por dispositivo.
+
+    Complementa a `FlowInconsistency` (balance predio/lotes) con detecciones sobre la
+    serie de cada dispositivo: desviaciones, caudal nocturno elevado y cambios bruscos.
+    """
+    device = models.ForeignKey(
+        IoTDevice, on_delete=models.CASCADE, related_name="flow_anomalies", verbose_name="Dispositivo IoT"
+    )
+    kind = models.CharField(max_length=10, choices=ANOMALY_KIND_CHOICES, verbose_name="Tipo de anomalía")
+    timestamp = models.DateTimeField(verbose_name="Inicio del intervalo anómalo")
+    flow_rate = models.FloatField(verbose_name="Caudal observado (m³/s)")
+    baseline = models.FloatField(verbose_name="Caudal de referencia (m³/s)")
+    score = models.FloatField(verbose_name="Puntaje de la anomalía")
+    detected_at = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de detección")
+
+    class Meta:
+        verbose_name = "Anomalía de caudal"
+        verbose_name_plural = "Anomalías de caudal"
+        ordering = ['-timestamp']
+        constraints = [
+            models.UniqueConstraint(fields=['device', 'kind', 'timestamp'], name='unique_flow_anomaly'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} en {self.device_id}: {self.flow_rate} m³/s ({self.timestamp})"
+
 auditlog.register(FlowInconsistency)
-auditlog.register(FlowMeasurementLote)      
-auditlog.register(FlowMeasurementPredio)     
-auditlog.register(FlowMeasurement)
\ No newline at end of file
+# Las mediciones solo se auditan por fila en modo 'row' (ver caudal.audit)
+if get_audit_mode() == 'row':
+    auditlog.register(FlowMeasurementLote)
+    auditlog.register(FlowMeasurementPredio)
+    auditlog.register(FlowMeasurement)
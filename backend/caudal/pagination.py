@@ -0,0 +1,18 @@
+from rest_framework.pagination import CursorPagination
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class MeasurementCursorPagination(CursorPagination):
+    """
+    Paginación por cursor (keyset) para el historial de mediciones.
+
+    Cada página continúa desde la fecha de la última medición entregada en lugar de
+    usar OFFSET, de modo que con los índices `(predio|lote|dispositivo, -timestamp)`
+    el costo de una página no depende de la profundidad del historial.
+    """
+    ordering = ('-timestamp', '-id')
+    page_size = DEFAULT_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = MAX_PAGE_SIZE
@@ -0,0 +1,69 @@
+import json
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError
+from rest_framework.parsers import BaseParser
+from .codec import MEDIA_TYPE, HEADER, RECORD_DTYPE, batch_count, decode_batch, iter_readings
+from .ingestion import readings_from_devices, get_bulk_max_readings
+
+
+class PayloadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = "El envío supera el máximo de lecturas permitido."
+    default_code = 'payload_too_large'
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parser para cuerpos NDJSON (una lectura JSON por línea).
+
+    Retorna la lista de objetos en el mismo formato que un arreglo JSON, de modo que
+    las vistas de ingesta masiva puedan aceptar ambos formatos sin distinción. El
+    máximo de `CAUDAL_BULK_MAX_READINGS` se aplica mientras se leen las líneas, sin
+    cargar en memoria el resto de un envío demasiado grande.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        max_readings = get_bulk_max_readings()
+        readings = []
+        for line_number, line in enumerate(stream, start=1):
+            line = line.decode(encoding).strip()
+            if not line:
+                continue
+            if len(readings) >= max_readings:
+                raise PayloadTooLarge(f"El envío supera el máximo de {max_readings} lecturas.")
+            try:
+                readings.append(json.loads(line))
+            except ValueError as exc:
+                raise ParseError(f"Línea {line_number} con JSON inválido: {exc}")
+        return readings
+
+
+class BinaryFlowParser(BaseParser):
+    """
+    Parser para lotes binarios de lecturas (ver `caudal.codec`).
+
+    Lee primero la cabecera: si declara más de `CAUDAL_BULK_MAX_READINGS` lecturas
+    responde 413 sin leer el cuerpo. Cada lectura sale solo con su dispositivo, y la
+    validación de la vista le asigna su lote o predio como a cualquier lectura JSON.
+    """
+    media_type = MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        header = stream.read(HEADER.size)
+        try:
+            count = batch_count(header)
+        except ValueError as exc:
+            raise ParseError(str(exc))
+        max_readings = get_bulk_max_readings()
+        if count > max_readings:
+            raise PayloadTooLarge(f"El envío supera el máximo de {max_readings} lecturas.")
+        try:
+            # Un byte de más para detectar cuerpos más largos de lo que declara la cabecera
+            records = decode_batch(header + stream.read(count * RECORD_DTYPE.itemsize + 1))
+        except ValueError as exc:
+            raise ParseError(str(exc))
+        return readings_from_devices(iter_readings(records))
@@ -0,0 +1,188 @@
+"""
+Gestión de particiones mensuales y retención de las mediciones de caudal.
+
+En PostgreSQL las tablas de mediciones están particionadas por mes (migración 0009):
+este módulo crea por adelantado las particiones de los próximos meses y aplica la
+retención separando (`DETACH`) las particiones antiguas para eliminarlas o moverlas a
+un esquema de archivo, sin borrar fila por fila. En SQLite las tablas son simples y la
+retención se reduce a un único `DELETE` por rango de fechas.
+
+Los agregados de `FlowRollup` no se tocan, de modo que los reportes históricos
+siguen disponibles después de aplicar la retención.
+"""
+import re
+from datetime import date
+from django.conf import settings
+from django.db import connection, transaction
+from .models import FlowMeasurement, FlowMeasurementPredio, FlowMeasurementLote
+
+PARTITIONED_MODELS = [FlowMeasurement, FlowMeasurementPredio, FlowMeasurementLote]
+
+DEFAULT_MONTHS_AHEAD = 3
+DEFAULT_RETENTION_MODE = 'archive'
+DEFAULT_ARCHIVE_SCHEMA = 'caudal_archive'
+
+PARTITION_NAME_RE = re.compile(r'_p(\d{4})(\d{2})$')
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(model, month):
+    """Nombre de la partición mensual de un modelo, p. ej. `caudal_flowmeasurementlote_p202501`."""
+    return f"{model._meta.db_table}_p{month:%Y%m}"
+
+
+def partition_bounds(month):
+    """Rango `[inicio, fin)` de fechas de la partición de un mes, como texto ISO."""
+    return f"{month:%Y-%m-%d}", f"{add_months(month, 1):%Y-%m-%d}"
+
+
+def partition_month(name):
+    """Mes de una partición a partir de su nombre, o None si no es una partición mensual."""
+    match = PARTITION_NAME_RE.search(name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def is_partitioned(model):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)",
+            [model._meta.db_table]
+        )
+        return cursor.fetchone() is not None
+
+
+def list_partitions(model):
+    """Retorna `{mes: nombre_de_tabla}` de las particiones mensuales de un modelo."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(%s)",
+            [model._meta.db_table]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    return {partition_month(name): name for name in names if partition_month(name)}
+
+
+def create_partition(model, month):
+    """
+    Crea la partición de un mes.
+
+    Si la partición por defecto ya tiene filas de ese mes, se mueven a la nueva
+    partición antes de adjuntarla (PostgreSQL no permite crearla directamente).
+    """
+    q = connection.ops.quote_name
+    table = model._meta.db_table
+    name = partition_name(model, month)
+    timestamp = q(model._meta.get_field('timestamp').column)
+    start, end = partition_bounds(month)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE {q(name)} (LIKE {q(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {q(f'{table}_default')} "
+            f"WHERE {timestamp} >= %s AND {timestamp} < %s RETURNING *) "
+            f"INSERT INTO {q(name)} SELECT * FROM moved",
+            [start, end]
+        )
+        cursor.execute(f"ALTER TABLE {q(table)} ATTACH PARTITION {q(name)} FOR VALUES FROM ('{start}') TO ('{end}')")
+    return name
+
+
+def default_partition_months(model):
+    """Meses con filas en la partición por defecto (lecturas que llegaron sin partición propia)."""
+    q = connection.ops.quote_name
+    timestamp = q(model._meta.get_field('timestamp').column)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT DISTINCT date_trunc('month', {timestamp})::date FROM {q(f'{model._meta.db_table}_default')}"
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+def ensure_partitions(months_ahead=None, today=None):
+    """
+    Crea las particiones faltantes desde el mes actual hasta `months_ahead` meses adelante,
+    además de las de cualquier mes cuyas filas hayan caído en la partición por defecto.
+    """
+    if months_ahead is None:
+        months_ahead = getattr(settings, 'CAUDAL_PARTITION_MONTHS_AHEAD', DEFAULT_MONTHS_AHEAD)
+    current = (today or date.today()).replace(day=1)
+    upcoming = {add_months(current, offset) for offset in range(months_ahead + 1)}
+
+    created = []
+    for model in PARTITIONED_MODELS:
+        if not is_partitioned(model):
+            continue
+        existing = list_partitions(model)
+        for month in sorted((upcoming | default_partition_months(model)) - set(existing)):
+            created.append(create_partition(model, month))
+    return created
+
+
+def retention_cutoff(retention_months, today=None):
+    """Primer mes que se conserva: se retienen el mes actual y los `retention_months` anteriores."""
+    return add_months((today or date.today()).replace(day=1), -retention_months)
+
+
+def expired_partitions(partitions, cutoff):
+    """Particiones `{mes: nombre}` anteriores al corte, en orden cronológico."""
+    return [(month, name) for month, name in sorted(partitions.items()) if month < cutoff]
+
+
+def apply_retention(retention_months=None, mode=None, today=None, dry_run=False):
+    """
+    Aplica la retención a las mediciones anteriores al corte.
+
+    `mode='drop'` elimina las particiones vencidas y `mode='archive'` las mueve al esquema
+    `CAUDAL_RETENTION_ARCHIVE_SCHEMA`. Retorna la lista de acciones realizadas.
+    """
+    if retention_months is None:
+        retention_months = getattr(settings, 'CAUDAL_RETENTION_MONTHS', None)
+    if retention_months is None:
+        return []
+    mode = mode or getattr(settings, 'CAUDAL_RETENTION_MODE', DEFAULT_RETENTION_MODE)
+    if mode not in ('drop', 'archive'):
+        raise ValueError("El modo de retención debe ser 'drop' o 'archive'.")
+
+    cutoff = retention_cutoff(retention_months, today)
+    q = connection.ops.quote_name
+    actions = []
+
+    for model in PARTITIONED_MODELS:
+        table = model._meta.db_table
+
+        if not is_partitioned(model):
+            # Tabla simple: un único DELETE por rango, sin señales ni borrado fila por fila
+            timestamp = q(model._meta.get_field('timestamp').column)
+            if mode == 'archive':
+                actions.append(f"{table}: el archivo de particiones requiere PostgreSQL, se omite")
+                continue
+            if dry_run:
+                actions.append(f"{table}: borraría mediciones anteriores a {cutoff}")
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute(f"DELETE FROM {q(table)} WHERE {timestamp} < %s", [f"{cutoff:%Y-%m-%d}"])
+                actions.append(f"{table}: {cursor.rowcount} mediciones anteriores a {cutoff} eliminadas")
+            continue
+
+        archive_schema = getattr(settings, 'CAUDAL_RETENTION_ARCHIVE_SCHEMA', DEFAULT_ARCHIVE_SCHEMA)
+        for month, name in expired_partitions(list_partitions(model), cutoff):
+            action = f"{name}: {'eliminada' if mode == 'drop' else f'archivada en {archive_schema}'}"
+            if dry_run:
+                actions.append(f"{action} (simulación)")
+                continue
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f"ALTER TABLE {q(table)} DETACH PARTITION {q(name)}")
+                if mode == 'drop':
+                    cursor.execute(f"DROP TABLE {q(name)}")
+                else:
+                    cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {q(archive_schema)}")
+                    cursor.execute(f"ALTER TABLE {q(name)} SET SCHEMA {q(archive_schema)}")
+            actions.append(action)
+    return actions
@@ -0,0 +1,262 @@
+"""
+Agregados por intervalo (minuto, hora y día) de las mediciones de caudal.
+
+Los agregados se actualizan de forma incremental en cada ingesta con un único
+UPSERT por lote de lecturas (`INSERT ... ON CONFLICT DO UPDATE`), de modo que
+conteo, mínimo, máximo, suma y último valor se combinan en la base de datos sin
+leer las filas existentes. Ediciones o borrados de mediciones no se descuentan:
+para esos casos se usa el comando `rebuild_flow_rollups`.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from .models import FlowMeasurement, FlowMeasurementPredio, FlowMeasurementLote, FlowRollup
+
+BUCKET_SECONDS = {
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400,
+}
+
+DEFAULT_MAX_POINTS = 1000
+
+
+def truncar(timestamp, bucket):
+    """Retorna el inicio del intervalo que contiene `timestamp`."""
+    if bucket == 'minute':
+        return timestamp.replace(second=0, microsecond=0)
+    if bucket == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def elegir_intervalo(inicio, fin, max_points=None):
+    """
+    Elige el intervalo más fino cuyo número de puntos en el rango no supera `max_points`.
+
+    Con el máximo por defecto (1000), unas horas se grafican por minuto, un mes por
+    hora y rangos más largos por día.
+    """
+    max_points = max_points or getattr(settings, 'CAUDAL_ROLLUP_MAX_POINTS', DEFAULT_MAX_POINTS)
+    span = max((fin - inicio).total_seconds(), 0)
+    for bucket, seconds in BUCKET_SECONDS.items():
+        if span / seconds <= max_points:
+            return bucket
+    return 'day'
+
+
+def claves_medicion(medicion):
+    """Ámbitos a los que aporta una medición: su predio o lote y su dispositivo."""
+    claves = []
+    if isinstance(medicion, FlowMeasurementLote):
+        claves.append(('lot', medicion.lot_id))
+    elif isinstance(medicion, FlowMeasurementPredio):
+        claves.append(('plot', medicion.plot_id))
+    if medicion.device_id:
+        claves.append(('device', medicion.device_id))
+    return claves
+
+
+def agregar_mediciones(mediciones):
+    """Combina mediciones en memoria por (ámbito, clave, intervalo, inicio)."""
+    agregados = {}
+    for medicion in mediciones:
+        flow_rate, timestamp = medicion.flow_rate, medicion.timestamp
+        for scope, key in claves_medicion(medicion):
+            for bucket in BUCKET_SECONDS:
+                bucket_key = (scope, key, bucket, truncar(timestamp, bucket))
+                agregado = agregados.get(bucket_key)
+                if agregado is None:
+                    agregados[bucket_key] = [1, flow_rate, flow_rate, flow_rate, flow_rate, timestamp]
+                    continue
+                agregado[0] += 1
+                agregado[1] = min(agregado[1], flow_rate)
+                agregado[2] = max(agregado[2], flow_rate)
+                agregado[3] += flow_rate
+                if timestamp >= agregado[5]:
+                    agregado[4], agregado[5] = flow_rate, timestamp
+    return agregados
+
+
+def _upsert_sql(model, key_columns, value_columns, rows):
+    q = connection.ops.quote_name
+    table = q(model._meta.db_table)
+    least, greatest = ('LEAST', 'GREATEST') if connection.vendor == 'postgresql' else ('MIN', 'MAX')
+    count, min_value, max_value, sum_value, last_value, last_timestamp = (q(c) for c in value_columns)
+    columns = ', '.join(q(c) for c in key_columns + value_columns)
+    placeholders = ', '.join(['(' + ', '.join(['%s'] * len(key_columns + value_columns)) + ')'] * rows)
+    is_newer = f"excluded.{last_timestamp} >= {table}.{last_timestamp}"
+    return (
+        f"INSERT INTO {table} ({columns}) VALUES {placeholders} "
+        f"ON CONFLICT ({', '.join(q(c) for c in key_columns)}) DO UPDATE SET "
+        f"{count} = {table}.{count} + excluded.{count}, "
+        f"{min_value} = {least}({table}.{min_value}, excluded.{min_value}), "
+        f"{max_value} = {greatest}({table}.{max_value}, excluded.{max_value}), "
+        f"{sum_value} = {table}.{sum_value} + excluded.{sum_value}, "
+        f"{last_value} = CASE WHEN {is_newer} THEN excluded.{last_value} ELSE {table}.{last_value} END, "
+        f"{last_timestamp} = CASE WHEN {is_newer} THEN excluded.{last_timestamp} ELSE {table}.{last_timestamp} END"
+    )
+
+
+def _merge_en_python(model, key_fields, value_fields, agregados):
+    """Alternativa para motores sin ON CONFLICT: lee, combina y escribe por conjunto."""
+    existentes = {
+        tuple(getattr(r, name) for name in key_fields): r
+        for r in model.objects.select_for_update().filter(**{
+            f'{name}__in': {k[index] for k in agregados} for index, name in enumerate(key_fields)
+        })
+    }
+    count, min_value, max_value, sum_value, last_value, last_timestamp = value_fields
+    nuevos, modificados = [], []
+    for clave, valores in agregados.items():
+        rollup = existentes.get(clave)
+        if rollup is None:
+            nuevos.append(model(**dict(zip(key_fields, clave)), **dict(zip(value_fields, valores))))
+            continue
+        setattr(rollup, count, getattr(rollup, count) + valores[0])
+        setattr(rollup, min_value, min(getattr(rollup, min_value), valores[1]))
+        setattr(rollup, max_value, max(getattr(rollup, max_value), valores[2]))
+        setattr(rollup, sum_value, getattr(rollup, sum_value) + valores[3])
+        if valores[5] >= getattr(rollup, last_timestamp):
+            setattr(rollup, last_value, valores[4])
+            setattr(rollup, last_timestamp, valores[5])
+        modificados.append(rollup)
+    model.objects.bulk_create(nuevos)
+    model.objects.bulk_update(modificados, list(value_fields))
+
+
+def guardar_agregados(model, key_fields, value_fields, agregados):
+    """
+    Suma agregados en memoria a una tabla de rollups con un UPSERT por bloque.
+
+    `agregados` es `{clave: [conteo, mínimo, máximo, suma, último valor, fecha del último]}`
+    con la clave en el orden de `key_fields`; `value_fields` nombra esas seis columnas
+    en el mismo orden. Lo usan los agregados de caudal y los de telemetría de `iot`.
+    """
+    if not agregados:
+        return 0
+
+    with transaction.atomic():
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            _merge_en_python(model, key_fields, value_fields, agregados)
+            return len(agregados)
+
+        fields = [model._meta.get_field(name) for name in key_fields + value_fields]
+        key_columns = tuple(field.column for field in fields[:len(key_fields)])
+        value_columns = tuple(field.column for field in fields[len(key_fields):])
+        # Orden fijo para que UPSERTs concurrentes bloqueen las filas en el mismo orden
+        items = sorted(agregados.items())
+        chunk_size = max((connection.features.max_query_params or 10000) // len(fields), 1)
+        with connection.cursor() as cursor:
+            for offset in range(0, len(items), chunk_size):
+                chunk = items[offset:offset + chunk_size]
+                params = []
+                for clave, valores in chunk:
+                    params.extend(
+                        field.get_db_prep_save(value, connection)
+                        for field, value in zip(fields, (*clave, *valores))
+                    )
+                cursor.execute(_upsert_sql(model, key_columns, value_columns, len(chunk)), params)
+    return len(agregados)
+
+
+def actualizar_rollups(mediciones):
+    """Suma un conjunto de mediciones (de cualquiera de los tres modelos) a sus agregados."""
+    return guardar_agregados(
+        FlowRollup,
+        ('scope', 'key', 'bucket', 'bucket_start'),
+        ('count', 'min_flow', 'max_flow', 'sum_flow', 'last_flow', 'last_timestamp'),
+        agregar_mediciones(mediciones),
+    )
+
+
+MEDICIONES = (FlowMeasurement, FlowMeasurementPredio, FlowMeasurementLote)
+
+
+def _dias_a_reconstruir(inicio):
+    """Días entre el primero y el último con mediciones o agregados, desde `inicio` si se indica."""
+    limites = []
+    for model, field in [(FlowRollup, 'bucket_start')] + [(model, 'timestamp') for model in MEDICIONES]:
+        queryset = model.objects.all()
+        if inicio:
+            queryset = queryset.filter(**{f'{field}__gte': inicio})
+        rango = queryset.aggregate(primero=Min(field), ultimo=Max(field))
+        if rango['primero'] is not None:
+            limites.extend([rango['primero'], rango['ultimo']])
+    if not limites:
+        return
+    dia, ultimo = truncar(min(limites), 'day'), truncar(max(limites), 'day')
+    while dia <= ultimo:
+        yield dia
+        dia += timedelta(days=1)
+
+
+def _bloquear_mediciones():
+    """
+    En PostgreSQL impide insertar o modificar mediciones hasta confirmar la transacción.
+
+    Las consultas siguen permitidas; las ingestas concurrentes esperan y suman sus
+    lecturas (señal o UPSERT de la ingesta) sobre el día ya reconstruido, en lugar de
+    quedar contadas dos veces.
+    """
+    if connection.vendor != 'postgresql':
+        return
+    tables = ', '.join(connection.ops.quote_name(model._meta.db_table) for model in MEDICIONES)
+    with connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {tables} IN SHARE MODE")
+
+
+def reconstruir_dia(dia, chunk_size=5000):
+    """
+    Reemplaza los agregados de un día por los calculados desde sus mediciones crudas.
+
+    Borrado y reconstrucción ocurren en una sola transacción: quien consulte los
+    agregados ve los anteriores hasta que se confirma el día completo. Retorna la
+    cantidad de mediciones procesadas.
+    """
+    fin = dia + timedelta(days=1)
+    procesadas = 0
+    with transaction.atomic():
+        _bloquear_mediciones()
+        FlowRollup.objects.filter(bucket_start__gte=dia, bucket_start__lt=fin).delete()
+        for model in MEDICIONES:
+            queryset = model.objects.filter(timestamp__gte=dia, timestamp__lt=fin).order_by()
+            bloque = []
+            for medicion in queryset.iterator(chunk_size=chunk_size):
+                bloque.append(medicion)
+                if len(bloque) >= chunk_size:
+                    actualizar_rollups(bloque)
+                    procesadas += len(bloque)
+                    bloque = []
+            if bloque:
+                actualizar_rollups(bloque)
+                procesadas += len(bloque)
+    return procesadas
+
+
+def reconstruir_rollups(desde=None, chunk_size=5000):
+    """
+    Recalcula los agregados a partir de las mediciones crudas.
+
+    Si se indica `desde`, solo se reconstruyen los días a partir de esa fecha. Cada día
+    se reconstruye en su propia transacción (ver `reconstruir_dia`), de modo que los
+    bloqueos duran lo que tarda un día y no el histórico completo; los intervalos de
+    minuto y hora nunca cruzan el límite de un día. Retorna la cantidad de mediciones
+    procesadas.
+    """
+    inicio = truncar(desde, 'day') if desde else None
+    return sum(reconstruir_dia(dia, chunk_size) for dia in _dias_a_reconstruir(inicio))
+
+
+def consultar_rollups(scope, key, inicio, fin, bucket=None):
+    """Retorna `(intervalo, filas)` para el rango pedido, eligiendo el intervalo si no se indica."""
+    bucket = bucket or elegir_intervalo(inicio, fin)
+    rows = FlowRollup.objects.filter(
+        scope=scope,
+        key=key,
+        bucket=bucket,
+        bucket_start__gte=truncar(inicio, bucket),
+        bucket_start__lte=fin,
+    ).order_by('bucket_start')
+    return bucket, rows
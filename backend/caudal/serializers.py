@@ -1,5 +1,5 @@
 from rest_framework import serializers, viewsets
-from .models import FlowMeasurement, FlowMeasurementPredio, FlowMeasurementLote,FlowInconsistency
+from .models import FlowMeasurement, FlowMeasurementPredio, FlowMeasurementLote,FlowInconsistency,FlowRollup,FlowAnomaly
 
 class FlowMeasurementSerializer(serializers.ModelSerializer):
     device_name = serializers.CharField(source="device.name", read_only=True)  # Nombre del dispositivo
@@ -10,17 +10,55 @@ class FlowMeasurementSerializer(serializers.ModelSerializer):
         fields = ['id', 'device', 'device_name', 'device_type', 'timestamp', 'flow_rate']
         read_only_fields = ['timestamp']
 
-class FlowMeasurementPredioSerializer(serializers.ModelSerializer):
+class SequenceValidationMixin:
+    """
+    Unicidad de `(device, sequence, timestamp)` solo para lecturas con número de secuencia.
+
+    Reemplaza el validador automático de DRF, que volvería obligatorios `device` y `sequence`.
+    """
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        values = {
+            name: attrs.get(name, getattr(self.instance, name, None))
+            for name in ('device', 'sequence', 'timestamp')
+        }
+        if values['sequence'] is None:
+            return attrs
+        if values['device'] is None:
+            raise serializers.ValidationError({"sequence": "El número de secuencia requiere el dispositivo."})
+        duplicates = self.Meta.model.objects.filter(**values)
+        if self.instance is not None:
+            duplicates = duplicates.exclude(pk=self.instance.pk)
+        if duplicates.exists():
+            raise serializers.ValidationError({"sequence": "Ya existe una lectura del dispositivo con este número de secuencia y fecha."})
+        return attrs
+
+class FlowMeasurementPredioSerializer(SequenceValidationMixin, serializers.ModelSerializer):
     class Meta:
         model = FlowMeasurementPredio
         fields = '__all__'
+        validators = []
 
-class FlowMeasurementLoteSerializer(serializers.ModelSerializer):
+class FlowMeasurementLoteSerializer(SequenceValidationMixin, serializers.ModelSerializer):
     class Meta:
         model = FlowMeasurementLote
         fields = '__all__'
+        validators = []
 
 class FlowInconsistencySerializer(serializers.ModelSerializer):
     class Meta:
         model = FlowInconsistency
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+class FlowAnomalySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = FlowAnomaly
+        fields = '__all__'
+
+class FlowRollupSerializer(serializers.ModelSerializer):
+    mean_flow = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = FlowRollup
+        fields = ['bucket_start', 'count', 'min_flow', 'max_flow', 'mean_flow', 'sum_flow', 'last_flow', 'last_timestamp']
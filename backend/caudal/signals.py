@@ -0,0 +1,82 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from plots_lots.models import Lot
+from .models import FlowMeasurement, FlowMeasurementPredio, FlowMeasurementLote, FlowInconsistency, PlotFlowBalance
+from .balance import descontar_lectura_lote, reconstruir_ventana, unir_ventana
+from .rollups import actualizar_rollups
+from .latest import registrar_ultimas, invalidar_ultimas
+from .live import publicar_lecturas, publicar_inconsistencia
+from .audit import auditar_mediciones
+from iot.heartbeat import marcar_actividad
+
+
+@receiver(post_delete, sender=FlowMeasurementLote)
+def descontar_lote_eliminado(sender, instance, **kwargs):
+    """ Mantiene el balance incremental del predio al eliminar una lectura de lote. """
+    plot_id = Lot.objects.filter(pk=instance.lot_id).values_list('plot_id', flat=True).first()
+    if plot_id:
+        descontar_lectura_lote(plot_id, instance.timestamp, instance.flow_rate)
+
+
+@receiver(post_delete, sender=FlowMeasurementPredio)
+def reabrir_ventana_predio(sender, instance, **kwargs):
+    """ Si se elimina la medición que abrió la ventana, se reabre con la anterior; si abría una ventana cerrada, esta se une a la anterior. """
+    balance = PlotFlowBalance.objects.filter(plot_id=instance.plot_id).first()
+    if balance and instance.timestamp >= balance.window_start:
+        reconstruir_ventana(instance.plot_id)
+    elif balance:
+        unir_ventana(instance.plot_id, instance.timestamp)
+
+
+@receiver(post_save, sender=FlowMeasurement)
+@receiver(post_save, sender=FlowMeasurementPredio)
+@receiver(post_save, sender=FlowMeasurementLote)
+def actualizar_rollups_medicion(sender, instance, created, **kwargs):
+    """ Suma cada medición nueva a sus agregados por minuto, hora y día. """
+    if created:
+        actualizar_rollups([instance])
+
+
+@receiver(post_save, sender=FlowMeasurement)
+@receiver(post_save, sender=FlowMeasurementPredio)
+@receiver(post_save, sender=FlowMeasurementLote)
+def actualizar_ultima_lectura(sender, instance, created, **kwargs):
+    """ Mantiene la caché de última lectura por dispositivo, predio y lote y la envía a los visores en vivo. """
+    if created:
+        registrar_ultimas([instance])
+        publicar_lecturas([instance])
+    else:
+        invalidar_ultimas(instance)
+
+
+@receiver(post_save, sender=FlowMeasurement)
+@receiver(post_save, sender=FlowMeasurementPredio)
+@receiver(post_save, sender=FlowMeasurementLote)
+def auditar_medicion(sender, instance, created, **kwargs):
+    """ En modo de auditoría `batch`, suma la medición nueva al resumen de auditoría. """
+    if created:
+        auditar_mediciones([instance])
+
+
+@receiver(post_save, sender=FlowMeasurement)
+@receiver(post_save, sender=FlowMeasurementPredio)
+@receiver(post_save, sender=FlowMeasurementLote)
+def marcar_actividad_dispositivo(sender, instance, created, **kwargs):
+    """ Una medición nueva indica que su dispositivo está reportando. """
+    if created:
+        marcar_actividad([instance.device_id])
+
+
+@receiver(post_delete, sender=FlowMeasurement)
+@receiver(post_delete, sender=FlowMeasurementPredio)
+@receiver(post_delete, sender=FlowMeasurementLote)
+def invalidar_ultima_lectura(sender, instance, **kwargs):
+    """ Una lectura eliminada pudo ser la última: la caché se recarga en la próxima consulta. """
+    invalidar_ultimas(instance)
+
+
+@receiver(post_save, sender=FlowInconsistency)
+def transmitir_inconsistencia(sender, instance, created, **kwargs):
+    """ Envía las inconsistencias nuevas a los visores en vivo de su predio. """
+    if created:
+        publicar_inconsistencia(instance)
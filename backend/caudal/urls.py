@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import FlowMeasurementViewSet, FlowMeasurementPredioViewSet, FlowMeasurementLoteViewSet,FlowInconsistencyViewSet,MedicionesPredioView,MedicionesLoteView
+from .views import FlowMeasurementViewSet, FlowAnomalyViewSet, FlowMeasurementPredioViewSet, FlowMeasurementLoteViewSet,FlowInconsistencyViewSet,MedicionesPredioView,MedicionesLoteView,BulkFlowMeasurementView,FlowRollupView,FlowMeasurementExportView,LatestFlowView,LotVolumeView,FlowStreamView,SequenceGapView
 
 urlpatterns = [
     # Endpoints para FlowMeasurement bocatoma
@@ -16,8 +16,33 @@ urlpatterns = [
     path('flow-measurements/lote/crear', FlowMeasurementLoteViewSet.as_view({'post': 'create'}), name='flowmeasurement-lote-create'),
     path('flow-measurements/lote/<str:lote_id>', MedicionesLoteView.as_view(), name='mediciones_lote'),   
     
+    # Ingesta masiva de mediciones de predio y lote (arreglo JSON o NDJSON)
+    path('flow-measurements/bulk', BulkFlowMeasurementView.as_view(), name='flowmeasurement-bulk-create'),
+
+    # Última lectura de varios dispositivos, predios y lotes (desde caché)
+    path('flow-measurements/latest', LatestFlowView.as_view(), name='flowmeasurement-latest'),
+
+    # Lecturas e inconsistencias en vivo (Server-Sent Events)
+    path('flow-measurements/stream', FlowStreamView.as_view(), name='flowmeasurement-stream'),
+
+    # Secuencias faltantes por dispositivo (pérdida de paquetes)
+    path('flow-measurements/sequence-gaps', SequenceGapView.as_view(), name='flowmeasurement-sequence-gaps'),
+
+    # Exportación en streaming del historial (CSV o NDJSON)
+    path('flow-measurements/export/<str:tipo>', FlowMeasurementExportView.as_view(), name='flowmeasurement-export'),
+
+    # Volumen consumido por lote en un periodo (para facturación)
+    path('lot-volumes', LotVolumeView.as_view(), name='lot-volumes'),
+
+    # Agregados por minuto, hora y día (el intervalo se elige según el rango pedido)
+    path('flow-rollups', FlowRollupView.as_view(), name='flow-rollups'),
+
       # Endpoints para FlowInconsistencies  
     path ('flow-inconsistencies', FlowInconsistencyViewSet.as_view({'get': 'list'}),name='flow-inconsistency-list' ),
-    path('flow-inconsistencies/<int:pk>',FlowInconsistencyViewSet.as_view({'get': 'retrieve'}),name='flow-inconsistency-detail')
+    path('flow-inconsistencies/<int:pk>',FlowInconsistencyViewSet.as_view({'get': 'retrieve'}),name='flow-inconsistency-detail'),
+
+    # Anomalías detectadas en las series de caudal (detect_flow_anomalies)
+    path('flow-anomalies', FlowAnomalyViewSet.as_view({'get': 'list'}), name='flow-anomaly-list'),
+    path('flow-anomalies/<int:pk>', FlowAnomalyViewSet.as_view({'get': 'retrieve'}), name='flow-anomaly-detail'),
  
 ]
\ No newline at end of file
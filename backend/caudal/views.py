@@ -1,37 +1,79 @@
-from rest_framework import viewsets
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views import View
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework import viewsets, generics
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
-from .models import FlowMeasurement, FlowMeasurementPredio, FlowMeasurementLote,FlowInconsistency
-from .serializers import FlowMeasurementSerializer,FlowMeasurementLoteSerializer, FlowMeasurementPredioSerializer,FlowInconsistencySerializer
+from rest_framework import status
+from rest_framework.parsers import JSONParser
+from API.custom_auth import CustomTokenAuthentication
+from plots_lots.models import Plot, Lot
+from .models import FlowMeasurement, FlowMeasurementPredio, FlowMeasurementLote,FlowInconsistency,FlowAnomaly,ROLLUP_SCOPE_CHOICES,ROLLUP_BUCKET_CHOICES
+from .serializers import FlowMeasurementSerializer,FlowMeasurementLoteSerializer, FlowMeasurementPredioSerializer,FlowInconsistencySerializer,FlowRollupSerializer,FlowAnomalySerializer
+from .parsers import NDJSONParser, BinaryFlowParser
+from .ingestion import ingest_readings, clean_readings, get_bulk_max_readings
+from .buffer import get_buffer, get_ingest_mode, BufferFull, BufferUnavailable
+from .filters import parse_time_range, filter_time_range
+from .pagination import MeasurementCursorPagination
+from .downsampling import parse_downsample, downsample
+from .rollups import consultar_rollups
+from .latest import LATEST_SOURCES, consultar_ultimas, get_max_ids
+from .sequences import sequence_gaps
+from .volume import GAP_POLICIES, get_gap_policy, get_max_gap, lot_volumes, month_range
+from .live import get_hub, transmitir
+from .export import EXPORT_SOURCES, EXPORT_FORMATS, export_columns, export_queryset, stream_export
 
 
-class FlowMeasurementViewSet(viewsets.ModelViewSet):
+class DownsampleMixin:
+    """
+    Con `points=N` (y opcionalmente `method`, lttb o minmax), el listado responde la
+    serie filtrada en orden cronológico reducida a como máximo `N` puntos, sin paginar.
+    """
+    def list(self, request, *args, **kwargs):
+        if 'points' not in request.query_params:
+            return super().list(request, *args, **kwargs)
+        points, method = parse_downsample(request.query_params)
+        return Response(downsample(self.filter_queryset(self.get_queryset()), points, method))
+
+
+class FlowMeasurementViewSet(DownsampleMixin, viewsets.ModelViewSet):
     """
     API para gestionar las mediciones de caudal.
     """
     queryset = FlowMeasurement.objects.all()
     serializer_class = FlowMeasurementSerializer 
     permission_classes=[IsAuthenticated]
+    pagination_class = MeasurementCursorPagination
     def get_queryset(self):
         """
-        Permite filtrar por dispositivo si se pasa como parámetro en la URL.
+        Permite filtrar por dispositivo y por rango de fechas (`from`/`to`) desde la URL.
+        Con `points=N` el listado se reduce para gráficas.
         """
         queryset = super().get_queryset()
         device_id = self.request.query_params.get('device')
         if device_id:
             queryset = queryset.filter(device_id=device_id)
-        return queryset
+        return filter_time_range(queryset, self.request.query_params)
 
-class FlowMeasurementPredioViewSet(viewsets.ModelViewSet):
+class FlowMeasurementPredioViewSet(DownsampleMixin, viewsets.ModelViewSet):
     queryset = FlowMeasurementPredio.objects.all()
     serializer_class = FlowMeasurementPredioSerializer
     permission_classes=[IsAuthenticated]
+    pagination_class = MeasurementCursorPagination
+
+    def get_queryset(self):
+        return filter_time_range(super().get_queryset(), self.request.query_params)
 
-class FlowMeasurementLoteViewSet(viewsets.ModelViewSet):
+class FlowMeasurementLoteViewSet(DownsampleMixin, viewsets.ModelViewSet):
     queryset = FlowMeasurementLote.objects.all()
     serializer_class = FlowMeasurementLoteSerializer
     permission_classes=[IsAuthenticated]    
+    pagination_class = MeasurementCursorPagination
+
+    def get_queryset(self):
+        return filter_time_range(super().get_queryset(), self.request.query_params)
 
 
 class FlowInconsistencyViewSet(viewsets.ReadOnlyModelViewSet):
@@ -43,20 +85,306 @@ class FlowInconsistencyViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = FlowInconsistencySerializer
     permission_classes=[IsAuthenticated]
 
-class MedicionesPredioView(APIView):
-    """Lista todas las mediciones de caudal de un predio específico"""
+class FlowAnomalyViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Consulta las anomalías detectadas por el análisis de series de caudal.
+    Filtrable por `device`, `kind` y rango de fechas (`from`/`to`).
+    """
+    queryset = FlowAnomaly.objects.all()
+    serializer_class = FlowAnomalySerializer
+    permission_classes=[IsAuthenticated]
+    pagination_class = MeasurementCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        for param in ('device', 'kind'):
+            value = self.request.query_params.get(param)
+            if value:
+                queryset = queryset.filter(**{param: value})
+        return filter_time_range(queryset, self.request.query_params)
+
+class MedicionesPredioView(DownsampleMixin, generics.ListAPIView):
+    """
+    Lista las mediciones de caudal de un predio específico, de la más reciente a la más antigua.
+
+    Paginada por cursor (`cursor`, `page_size`) y filtrable con `from`/`to`. Con
+    `points=N` responde la serie reducida para gráficas.
+    """
     permission_classes =[IsAuthenticated]
-    
-    def get(self, request, predio_id):
-        mediciones = FlowMeasurementPredio.objects.filter(plot_id=predio_id).order_by('-timestamp')
-        serializer = FlowMeasurementPredioSerializer(mediciones, many=True)
-        return Response(serializer.data)
-
-class MedicionesLoteView(APIView):
-    """Lista todas las mediciones de caudal de un lote específico"""
-    
+    serializer_class = FlowMeasurementPredioSerializer
+    pagination_class = MeasurementCursorPagination
+
+    def get_queryset(self):
+        mediciones = FlowMeasurementPredio.objects.filter(plot_id=self.kwargs['predio_id'])
+        return filter_time_range(mediciones, self.request.query_params)
+
+class MedicionesLoteView(DownsampleMixin, generics.ListAPIView):
+    """
+    Lista las mediciones de caudal de un lote específico, de la más reciente a la más antigua.
+
+    Paginada por cursor (`cursor`, `page_size`) y filtrable con `from`/`to`. Con
+    `points=N` responde la serie reducida para gráficas.
+    """
     permission_classes =[IsAuthenticated]
-    def get(self, request, lote_id):
-        mediciones = FlowMeasurementLote.objects.filter(lot_id=lote_id).order_by('-timestamp')
-        serializer = FlowMeasurementLoteSerializer(mediciones, many=True)
-        return Response(serializer.data)    
+    serializer_class = FlowMeasurementLoteSerializer
+    pagination_class = MeasurementCursorPagination
+
+    def get_queryset(self):
+        mediciones = FlowMeasurementLote.objects.filter(lot_id=self.kwargs['lote_id'])
+        return filter_time_range(mediciones, self.request.query_params)
+
+
+class BulkFlowMeasurementView(APIView):
+    """
+    Ingesta masiva de mediciones de predio y lote.
+
+    Acepta un arreglo JSON (o `{"readings": [...]}`) o NDJSON. Cada lectura lleva
+    `lot` o `plot`, `flow_rate`, `timestamp` y opcionalmente `device` y `sequence`
+    (consecutivo del dispositivo; los reintentos con la misma secuencia y fecha se
+    descartan y se cuentan en `duplicates`). También acepta
+    lotes binarios (`application/vnd.aquasmart.flow`) cuyas lecturas se asignan al
+    lote o predio del dispositivo. Las lecturas válidas se guardan aunque otras del
+    mismo envío sean rechazadas.
+
+    Con `CAUDAL_INGEST_MODE = 'buffered'` las lecturas se encolan y se responde 202
+    antes de escribirlas; si el búfer está lleno se responde 429.
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = [JSONParser, NDJSONParser, BinaryFlowParser]
+
+    def post(self, request):
+        readings = request.data
+        if isinstance(readings, dict):
+            readings = readings.get('readings')
+        if not isinstance(readings, list):
+            return Response({"error": "Se esperaba una lista de lecturas."}, status=status.HTTP_400_BAD_REQUEST)
+
+        max_readings = get_bulk_max_readings()
+        if len(readings) > max_readings:
+            return Response(
+                {"error": f"El envío supera el máximo de {max_readings} lecturas."},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+
+        if get_ingest_mode() == 'buffered':
+            return self.encolar(readings)
+
+        result = ingest_readings(readings)
+        created = result['created']['predio'] + result['created']['lote']
+        if readings and not created and not result['duplicates']:
+            return Response(result, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result, status=status.HTTP_201_CREATED)
+
+    def encolar(self, readings):
+        """ Modo `buffered`: valida la forma, encola y responde sin esperar la escritura. """
+        cleaned, errors = clean_readings(readings)
+        if readings and not cleaned:
+            return Response({"queued": 0, "rejected": errors}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            get_buffer().put(cleaned)
+        except BufferFull:
+            response = Response(
+                {"error": "El búfer de ingesta está lleno, reintenta en unos segundos."},
+                status=status.HTTP_429_TOO_MANY_REQUESTS
+            )
+            response['Retry-After'] = '1'
+            return response
+        except BufferUnavailable:
+            return Response(
+                {"error": "La ingesta no está disponible en este momento."},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        return Response({"queued": len(cleaned), "rejected": errors}, status=status.HTTP_202_ACCEPTED)
+
+
+class FlowRollupView(APIView):
+    """
+    Consulta los agregados de caudal de un dispositivo, predio o lote en un rango de fechas.
+
+    Parámetros: `scope` (device, plot o lot), `id`, `from`, `to` y opcionalmente `bucket`
+    (minute, hour o day). Sin `bucket` se elige el intervalo más fino que mantiene la
+    respuesta acotada, de modo que un mes se grafica por horas y un año por días.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        scope = request.query_params.get('scope')
+        key = request.query_params.get('id')
+        bucket = request.query_params.get('bucket') or None
+        if scope not in dict(ROLLUP_SCOPE_CHOICES) or not key:
+            return Response(
+                {"error": "Los parámetros 'scope' (device, plot o lot) e 'id' son obligatorios."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if bucket and bucket not in dict(ROLLUP_BUCKET_CHOICES):
+            return Response({"error": "El intervalo debe ser minute, hour o day."}, status=status.HTTP_400_BAD_REQUEST)
+
+        inicio, fin = parse_time_range(request.query_params, required=True)
+        bucket, rollups = consultar_rollups(scope, key, inicio, fin, bucket)
+        return Response({
+            "scope": scope,
+            "id": key,
+            "bucket": bucket,
+            "results": FlowRollupSerializer(rollups, many=True).data,
+        })
+
+
+class FlowMeasurementExportView(APIView):
+    """
+    Exporta el historial de mediciones (`bocatoma`, `predio` o `lote`) en streaming.
+
+    Parámetros: `output` (csv o ndjson, por defecto csv), `id` del dispositivo, predio
+    o lote, `device`, `from` y `to`. Las filas se envían en orden cronológico a medida
+    que se leen de la base de datos, sin cargar la exportación completa en memoria.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, tipo):
+        if tipo not in EXPORT_SOURCES:
+            return Response({"error": "El tipo de medición debe ser bocatoma, predio o lote."}, status=status.HTTP_404_NOT_FOUND)
+        output = request.query_params.get('output', 'csv')
+        if output not in EXPORT_FORMATS:
+            return Response({"error": "El formato de salida debe ser csv o ndjson."}, status=status.HTTP_400_BAD_REQUEST)
+
+        inicio, fin = parse_time_range(request.query_params)
+        rows = export_queryset(
+            tipo,
+            entity_id=request.query_params.get('id'),
+            device_id=request.query_params.get('device'),
+            inicio=inicio,
+            fin=fin,
+        )
+        response = StreamingHttpResponse(
+            stream_export(output, export_columns(tipo), rows),
+            content_type=EXPORT_FORMATS[output]
+        )
+        response['Content-Disposition'] = f'attachment; filename="mediciones_{tipo}.{output}"'
+        return response
+
+
+class LatestFlowView(APIView):
+    """
+    Última lectura de caudal de varios dispositivos, predios y lotes en una sola consulta.
+
+    Parámetros `device`, `plot` y `lot` con ids separados por comas (al menos uno).
+    Responde, por cada ámbito pedido, `{id: {flow_rate, timestamp, device}}`, con `null`
+    para los ids sin lecturas. Los valores se leen de la caché de últimas lecturas.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        pedidos = {}
+        for scope in LATEST_SOURCES:
+            raw = request.query_params.get(scope)
+            if raw:
+                pedidos[scope] = list(dict.fromkeys(key.strip() for key in raw.split(',') if key.strip()))
+        if not pedidos:
+            return Response(
+                {"error": "Indica al menos uno de los parámetros 'device', 'plot' o 'lot'."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        max_ids = get_max_ids()
+        if sum(len(keys) for keys in pedidos.values()) > max_ids:
+            return Response({"error": f"Se permiten máximo {max_ids} ids por consulta."}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({scope: consultar_ultimas(scope, keys) for scope, keys in pedidos.items()})
+
+
+class LotVolumeView(APIView):
+    """
+    Volumen consumido (m³) por lote en un periodo, integrando el caudal de sus mediciones.
+
+    Parámetros: `month` (YYYY-MM) o `from`/`to`, opcionalmente `lot` (ids separados por
+    comas), `gap_policy` (interpolate, hold o zero) y `max_gap` (segundos). Sin `lot` se
+    calculan todos los lotes con lecturas en el periodo. `billable_quantity` es el valor
+    para `volumetric_rate_quantity` de la factura.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        month = request.query_params.get('month')
+        if month:
+            try:
+                year, month_number = (int(part) for part in month.split('-'))
+                inicio, fin = month_range(year, month_number)
+            except ValueError:
+                return Response({"error": "El mes debe tener el formato YYYY-MM."}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            inicio, fin = parse_time_range(request.query_params, required=True)
+
+        gap_policy = request.query_params.get('gap_policy') or get_gap_policy()
+        if gap_policy not in GAP_POLICIES:
+            return Response({"error": "La política de huecos debe ser interpolate, hold o zero."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            max_gap = float(request.query_params.get('max_gap') or get_max_gap())
+        except ValueError:
+            return Response({"error": "El parámetro 'max_gap' debe ser numérico (segundos)."}, status=status.HTTP_400_BAD_REQUEST)
+
+        lot_ids = [lot.strip() for lot in request.query_params.get('lot', '').split(',') if lot.strip()]
+        return Response({
+            "from": inicio,
+            "to": fin,
+            "gap_policy": gap_policy,
+            "max_gap_seconds": max_gap,
+            "results": lot_volumes(inicio, fin, lot_ids=lot_ids or None, gap_policy=gap_policy, max_gap=max_gap),
+        })
+
+
+class SequenceGapView(APIView):
+    """
+    Secuencias faltantes por dispositivo en un rango de fechas (pérdida de paquetes).
+
+    Parámetros: `from`, `to` y opcionalmente `device` (ids separados por comas). Solo
+    se consideran las lecturas enviadas con número de secuencia.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        inicio, fin = parse_time_range(request.query_params, required=True)
+        devices = [device.strip() for device in request.query_params.get('device', '').split(',') if device.strip()]
+        return Response({
+            "from": inicio,
+            "to": fin,
+            "results": sequence_gaps(inicio, fin, devices=devices or None),
+        })
+
+
+def _autenticar_stream(request):
+    authenticator = CustomTokenAuthentication()
+    key = request.GET.get('token')
+    try:
+        result = authenticator.authenticate_credentials(key) if key else authenticator.authenticate(request)
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+def _predios_y_lotes(user):
+    plots = list(Plot.objects.filter(owner=user).values_list('id_plot', flat=True))
+    lots = list(Lot.objects.filter(plot__owner=user).values_list('id_lot', flat=True))
+    return plots, lots
+
+
+class FlowStreamView(View):
+    """
+    Transmisión en vivo (Server-Sent Events) de las lecturas nuevas de los predios y lotes
+    del usuario y de las inconsistencias de sus predios.
+
+    Eventos `reading`, `inconsistency` y `lagged` (el visor perdió eventos y debe recargar
+    el estado actual). Requiere el servidor ASGI. Como `EventSource` no permite enviar
+    encabezados, el token puede indicarse en el parámetro `token` además de en
+    `Authorization`.
+    """
+
+    async def get(self, request):
+        user = await sync_to_async(_autenticar_stream)(request)
+        if user is None:
+            return JsonResponse({"detail": "Las credenciales de autenticación no se proveyeron o no son válidas."}, status=401)
+        plots, lots = await sync_to_async(_predios_y_lotes)(user)
+
+        subscription = get_hub().subscribe(plots, lots)
+        response = StreamingHttpResponse(transmitir(subscription), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
@@ -0,0 +1,136 @@
+"""
+Integración del caudal de los lotes en volumen (m³) por periodo.
+
+Las lecturas de todos los lotes del periodo se cargan en arreglos NumPy ordenados por
+lote y fecha, y el volumen se obtiene con la regla del trapecio sobre los intervalos
+entre lecturas consecutivas (que pueden ser irregulares), recortando los intervalos
+que cruzan los límites del periodo. Todo el cálculo es vectorizado: un único lote de
+operaciones sobre arreglos para todos los lotes a la vez.
+
+Los intervalos entre lecturas más largos que `max_gap` segundos se tratan según la
+política de huecos:
+
+- `interpolate`: trapecio entre las dos lecturas, como cualquier otro intervalo.
+- `hold`: se mantiene el caudal de la última lectura hasta la siguiente.
+- `zero`: se asume que no hubo flujo durante el hueco.
+
+`flow_rate` está en m³/s, por lo que el volumen queda en m³.
+"""
+from datetime import datetime, timedelta
+import numpy as np
+from django.conf import settings
+from .models import FlowMeasurementLote
+
+GAP_POLICIES = ('interpolate', 'hold', 'zero')
+DEFAULT_GAP_POLICY = 'hold'
+DEFAULT_MAX_GAP_SECONDS = 900
+
+
+def get_gap_policy():
+    return getattr(settings, 'CAUDAL_VOLUME_GAP_POLICY', DEFAULT_GAP_POLICY)
+
+
+def get_max_gap():
+    return getattr(settings, 'CAUDAL_VOLUME_MAX_GAP_SECONDS', DEFAULT_MAX_GAP_SECONDS)
+
+
+def month_range(year, month):
+    inicio = datetime(year, month, 1)
+    fin = datetime(year + month // 12, month % 12 + 1, 1)
+    return inicio, fin
+
+
+def integrate(series, seconds, flows, inicio, fin, gap_policy=None, max_gap=None):
+    """
+    Integra varias series ya ordenadas por `(serie, segundos)`.
+
+    `series` es el índice entero de la serie de cada lectura, `seconds` su fecha en
+    segundos y `flows` el caudal. `inicio` y `fin` delimitan el periodo en segundos.
+    Retorna `(volumen, segundos_en_hueco)`, arreglos con una posición por serie.
+    """
+    gap_policy = gap_policy or get_gap_policy()
+    max_gap = max_gap if max_gap is not None else get_max_gap()
+    if gap_policy not in GAP_POLICIES:
+        raise ValueError(f"Política de huecos inválida: {gap_policy}.")
+
+    size = int(series.max()) + 1 if series.size else 0
+    if series.size < 2:
+        return np.zeros(size), np.zeros(size)
+
+    # Intervalos entre lecturas consecutivas de la misma serie
+    same = series[1:] == series[:-1]
+    owner = series[:-1][same]
+    t0, t1 = seconds[:-1][same], seconds[1:][same]
+    f0, f1 = flows[:-1][same], flows[1:][same]
+    dt = t1 - t0
+    gap = dt > max_gap
+
+    if gap_policy == 'hold':
+        f1 = np.where(gap, f0, f1)
+    elif gap_policy == 'zero':
+        f0 = np.where(gap, 0.0, f0)
+        f1 = np.where(gap, 0.0, f1)
+
+    # Recorte al periodo con interpolación lineal en los bordes
+    a = np.clip(t0, inicio, fin)
+    b = np.clip(t1, inicio, fin)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = np.where(dt > 0, (f1 - f0) / dt, 0.0)
+    fa = f0 + slope * (a - t0)
+    fb = f0 + slope * (b - t0)
+    area = (fa + fb) / 2 * (b - a)
+
+    volume = np.bincount(owner, weights=area, minlength=size)
+    gap_seconds = np.bincount(owner, weights=np.where(gap, b - a, 0.0), minlength=size)
+    return volume, gap_seconds
+
+
+def load_lot_series(inicio, fin, lot_ids=None, margin=None, chunk_size=10000):
+    """
+    Carga las lecturas de lote de `[inicio - margin, fin + margin]` ordenadas por lote y fecha.
+
+    El margen trae la lectura anterior y la siguiente al periodo para integrar sus bordes.
+    Retorna `(lotes, series, segundos, caudales)`.
+    """
+    margin = timedelta(seconds=margin if margin is not None else get_max_gap())
+    queryset = FlowMeasurementLote.objects.filter(timestamp__gte=inicio - margin, timestamp__lte=fin + margin)
+    if lot_ids:
+        queryset = queryset.filter(lot_id__in=lot_ids)
+    rows = queryset.order_by('lot_id', 'timestamp').values_list('lot_id', 'timestamp', 'flow_rate')
+
+    lots, series, seconds, flows = [], [], [], []
+    for lot_id, timestamp, flow_rate in rows.iterator(chunk_size=chunk_size):
+        if not lots or lots[-1] != lot_id:
+            lots.append(lot_id)
+        series.append(len(lots) - 1)
+        seconds.append((timestamp - inicio).total_seconds())
+        flows.append(flow_rate)
+    return lots, np.array(series, dtype=np.int64), np.array(seconds), np.array(flows)
+
+
+def lot_volumes(inicio, fin, lot_ids=None, gap_policy=None, max_gap=None):
+    """
+    Volumen (m³) de cada lote con lecturas en `[inicio, fin)`, en un solo lote de cálculo.
+
+    Retorna una lista de diccionarios con `lot`, `volume_m3`, `readings` y `gap_seconds`;
+    `billable_quantity` es el volumen redondeado a m³ enteros, como lo guarda la factura
+    en `volumetric_rate_quantity`.
+    """
+    max_gap = max_gap if max_gap is not None else get_max_gap()
+    lots, series, seconds, flows = load_lot_series(inicio, fin, lot_ids, margin=max_gap)
+    volume, gap_seconds = integrate(
+        series, seconds, flows, 0.0, (fin - inicio).total_seconds(), gap_policy=gap_policy, max_gap=max_gap
+    )
+    in_period = (seconds >= 0) & (seconds < (fin - inicio).total_seconds())
+    readings = np.bincount(series[in_period], minlength=len(lots)) if lots else []
+    return [
+        {
+            'lot': lot_id,
+            'volume_m3': float(volume[index]),
+            'readings': int(readings[index]),
+            'gap_seconds': float(gap_seconds[index]),
+            'billable_quantity': max(int(round(volume[index])), 0),
+        }
+        for index, lot_id in enumerate(lots)
+        if readings[index] or volume[index]
+    ]
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import DeviceType, IoTDevice
+from .models import DeviceType, IoTDevice, DeviceEndpoint, ValveCommand, TelemetryMetric
 
 @admin.register(DeviceType)
 class DeviceTypeAdmin(admin.ModelAdmin):
@@ -8,10 +8,30 @@ class DeviceTypeAdmin(admin.ModelAdmin):
     ordering = ('device_id',)  # Ordenar por ID
     list_per_page = 20  # Paginación en el admin
 
+class DeviceEndpointInline(admin.StackedInline):
+    model = DeviceEndpoint
+    can_delete = True
+    extra = 0
+
 @admin.register(IoTDevice)
 class IoTDeviceAdmin(admin.ModelAdmin):
-    list_display = ('iot_id', 'name', 'device_type', 'is_active', 'id_plot', 'id_lot', 'actual_flow', 'registration_date')
+    inlines = [DeviceEndpointInline]
+    list_display = ('iot_id', 'name', 'device_type', 'is_active', 'online', 'last_seen', 'id_plot', 'id_lot', 'actual_flow', 'registration_date')
     search_fields = ('iot_id', 'name', 'device_type__name')
-    list_filter = ('is_active', 'device_type')  # Filtros en el admin
+    list_filter = ('is_active', 'online', 'device_type')  # Filtros en el admin
     ordering = ('iot_id',)
     list_per_page = 20
+
+
+@admin.register(ValveCommand)
+class ValveCommandAdmin(admin.ModelAdmin):
+    list_display = ('id', 'device', 'setpoint', 'status', 'attempts', 'next_attempt_at', 'sent_at', 'last_error')
+    search_fields = ('device__iot_id',)
+    list_filter = ('status',)
+    list_per_page = 20
+
+@admin.register(TelemetryMetric)
+class TelemetryMetricAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'unit')
+    search_fields = ('name',)
+    ordering = ('name',)
@@ -0,0 +1,104 @@
+"""
+Mapa en memoria de dispositivos: `iot_id` -> tipo, predio, lote, estado y clave de telemetría.
+
+La ingesta de caudal resuelve cada lectura contra este mapa en lugar de consultar
+`IoTDevice` por fila, y con él un dispositivo puede enviar lecturas indicando solo
+su id. El mapa se carga completo con una consulta y se invalida al guardar o eliminar
+un dispositivo (y al eliminar un predio o lote, que desasigna sus dispositivos):
+
+- En el mismo proceso la invalidación es inmediata.
+- Entre procesos, cada invalidación cambia una versión guardada en la caché de Django
+  (compartida con Redis); cada proceso la revisa como máximo cada
+  `IOT_DEVICE_MAP_CHECK_SECONDS` y recarga su mapa si cambió.
+- Sin caché compartida (memoria local en desarrollo), el mapa se recarga igualmente
+  cuando tiene más de `IOT_DEVICE_MAP_MAX_AGE` segundos.
+"""
+import threading
+import time
+import uuid
+from collections import namedtuple
+from django.conf import settings
+from django.core.cache import cache
+from .models import IoTDevice
+
+DeviceInfo = namedtuple('DeviceInfo', ['type', 'plot', 'lot', 'is_active', 'telemetry_key'], defaults=[None])
+
+VERSION_CACHE_KEY = 'iot:device_map:version'
+DEFAULT_CHECK_SECONDS = 1.0
+DEFAULT_MAX_AGE = 60
+
+
+class DeviceMap:
+    """Dispositivos registrados por `iot_id`, recargados cuando cambia su versión."""
+
+    def __init__(self, check_seconds=None, max_age=None):
+        self.check_seconds = check_seconds if check_seconds is not None else getattr(
+            settings, 'IOT_DEVICE_MAP_CHECK_SECONDS', DEFAULT_CHECK_SECONDS
+        )
+        self.max_age = max_age if max_age is not None else getattr(settings, 'IOT_DEVICE_MAP_MAX_AGE', DEFAULT_MAX_AGE)
+        self._devices = None
+        self._version = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, iot_id):
+        return iot_id in self.devices()
+
+    def __len__(self):
+        return len(self.devices())
+
+    def get(self, iot_id):
+        return self.devices().get(iot_id)
+
+    @staticmethod
+    def shared_version():
+        version = cache.get(VERSION_CACHE_KEY)
+        if version is None:
+            # `add` para que los procesos que arrancan a la vez acuerden una sola versión
+            cache.add(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+            version = cache.get(VERSION_CACHE_KEY)
+        return version
+
+    def load(self, version=None):
+        generation = self._generation
+        version = version or self.shared_version()
+        devices = {
+            iot_id: DeviceInfo(device_type, plot_id, lot_id, is_active, telemetry_key)
+            for iot_id, device_type, plot_id, lot_id, is_active, telemetry_key in IoTDevice.objects.values_list(
+                'iot_id', 'device_type_id', 'id_plot_id', 'id_lot_id', 'is_active', 'telemetry_key'
+            )
+        }
+        with self._lock:
+            # Si se invalidó mientras se consultaba, esta carga puede estar desactualizada
+            if generation == self._generation:
+                self._devices, self._version = devices, version
+                self._loaded_at = self._checked_at = time.monotonic()
+        return devices
+
+    def devices(self):
+        devices = self._devices
+        now = time.monotonic()
+        if devices is None or now - self._loaded_at > self.max_age:
+            return self.load()
+        if now - self._checked_at >= self.check_seconds:
+            self._checked_at = now
+            version = self.shared_version()
+            if version != self._version:
+                return self.load(version)
+        return devices
+
+    def invalidate(self):
+        """Descarta el mapa de este proceso y cambia la versión para que los demás lo recarguen."""
+        with self._lock:
+            self._devices = None
+            self._generation += 1
+        cache.set(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+
+
+_device_map = DeviceMap()
+
+
+def get_device_map():
+    return _device_map
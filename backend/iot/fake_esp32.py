@@ -0,0 +1,84 @@
+"""
+Controlador ESP32 simulado para probar el envío de consignas sin hardware.
+
+Atiende `GET /setangle?angle=N` como el firmware de las válvulas, con HTTP/1.1 y
+conexiones persistentes, y puede simular latencia (`latency` ± `jitter` segundos) y
+una proporción de respuestas fallidas (`failure_rate`, HTTP 503). Registra los
+ángulos recibidos y cuántas conexiones abrieron los clientes.
+"""
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeESP32Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.record_connection()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/setangle':
+            return self._reply(404, b'not found')
+        try:
+            angle = int(parse_qs(url.query)['angle'][0])
+        except (KeyError, ValueError):
+            return self._reply(400, b'angle requerido')
+
+        server = self.server
+        delay = max(server.latency + random.uniform(-server.jitter, server.jitter), 0)
+        if delay:
+            time.sleep(delay)
+        if random.random() < server.failure_rate:
+            server.record_request(None)
+            return self._reply(503, b'ocupado')
+        server.record_request(angle)
+        self._reply(200, b'ok')
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeESP32Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, failure_rate=0.0):
+        super().__init__((host, port), FakeESP32Handler)
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.angles = []
+        self.connections = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def record_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def record_request(self, angle):
+        with self._lock:
+            if angle is None:
+                self.failures += 1
+            else:
+                self.angles.append(angle)
+
+    def start(self):
+        """Atiende en un hilo en segundo plano. Retorna el servidor."""
+        threading.Thread(target=self.serve_forever, name='fake-esp32', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,204 @@
+"""
+Seguimiento de actividad de los dispositivos IoT y detección de dispositivos caídos.
+
+`is_active` es solo un estado administrativo; `last_seen` y `online` indican si el
+dispositivo está reportando:
+
+- Cada lectura recibida marca a su dispositivo con la hora de recepción en memoria
+  (`marcar_actividad`). Un hilo en segundo plano escribe cada
+  `IOT_HEARTBEAT_FLUSH_INTERVAL` segundos la última hora de cada dispositivo con un
+  solo `bulk_update`, en lugar de un UPDATE por lectura, y nunca retrocede un
+  `last_seen` escrito por otro proceso.
+- `OfflineScanner` mantiene un montículo con el plazo de cada dispositivo
+  (`last_seen` + `IOT_OFFLINE_MISSED_INTERVALS` intervalos de reporte). En cada
+  ronda solo trae de la base de datos los dispositivos que reportaron desde la
+  anterior (índice de `last_seen`) y saca del montículo los plazos vencidos, sin
+  recorrer toda la flota ni las tablas de mediciones (salvo una sincronización
+  completa cada `IOT_OFFLINE_FULL_SYNC_SECONDS`).
+"""
+import atexit
+import heapq
+import logging
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from .models import IoTDevice
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL = 5.0
+DEFAULT_HEARTBEAT_INTERVAL = 300
+DEFAULT_MISSED_INTERVALS = 3
+DEFAULT_FULL_SYNC_SECONDS = 3600
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class HeartbeatTracker:
+    """Última hora de actividad por dispositivo pendiente de escribir."""
+
+    def __init__(self, flush_interval=None):
+        self.flush_interval = flush_interval or _setting('IOT_HEARTBEAT_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def record(self, iot_ids, seen_at=None):
+        seen_at = seen_at or timezone.now()
+        with self._lock:
+            for iot_id in iot_ids:
+                if iot_id and (iot_id not in self._pending or self._pending[iot_id] < seen_at):
+                    self._pending[iot_id] = seen_at
+
+    def flush(self):
+        """Escribe la actividad pendiente. Retorna cuántos dispositivos se actualizaron."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            stored = dict(IoTDevice.objects.filter(iot_id__in=list(pending)).values_list('iot_id', 'last_seen'))
+            devices = [
+                IoTDevice(iot_id=iot_id, last_seen=seen_at, online=True)
+                for iot_id, seen_at in pending.items()
+                if iot_id in stored and (stored[iot_id] is None or stored[iot_id] < seen_at)
+            ]
+            IoTDevice.objects.bulk_update(devices, ['last_seen', 'online'], batch_size=500)
+        except Exception:
+            logger.exception("No se pudo registrar la actividad de %s dispositivos", len(pending))
+            return 0
+        return len(devices)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='iot-heartbeat-writer', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            self.flush()
+            close_old_connections()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_tracker():
+    """Registro de actividad del proceso, creado y arrancado en el primer uso."""
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = HeartbeatTracker().start()
+            atexit.register(_tracker.stop)
+        return _tracker
+
+
+def marcar_actividad(iot_ids):
+    """Marca la actividad de los dispositivos al confirmarse la transacción que guardó sus lecturas."""
+    iot_ids = {iot_id for iot_id in iot_ids if iot_id}
+    if iot_ids:
+        seen_at = timezone.now()
+        transaction.on_commit(lambda: get_tracker().record(iot_ids, seen_at))
+
+
+class OfflineScanner:
+    """Marca fuera de línea los dispositivos activos que dejaron de reportar, usando un montículo de plazos."""
+
+    def __init__(self, missed_intervals=None, default_interval=None):
+        self.missed_intervals = missed_intervals or _setting('IOT_OFFLINE_MISSED_INTERVALS', DEFAULT_MISSED_INTERVALS)
+        self.default_interval = default_interval or _setting('IOT_HEARTBEAT_INTERVAL', DEFAULT_HEARTBEAT_INTERVAL)
+        self.full_sync_seconds = _setting('IOT_OFFLINE_FULL_SYNC_SECONDS', DEFAULT_FULL_SYNC_SECONDS)
+        self._heap = []
+        self._deadlines = {}
+        self._synced_at = None
+        self._full_synced_at = None
+
+    def deadline(self, last_seen, heartbeat_interval):
+        return last_seen + timedelta(seconds=(heartbeat_interval or self.default_interval) * self.missed_intervals)
+
+    def sync(self, now):
+        """Agrega al montículo los plazos de los dispositivos que reportaron desde la ronda anterior."""
+        devices = IoTDevice.objects.filter(is_active=True, online=True, last_seen__isnull=False)
+        # Cada tanto se recorre la flota completa para tomar cambios de intervalo o reactivaciones
+        if self._full_synced_at is None or (now - self._full_synced_at).total_seconds() >= self.full_sync_seconds:
+            self._full_synced_at = now
+        else:
+            # `last_seen` es la hora de recepción, que se escribe hasta un intervalo de escritura después
+            margin = timedelta(seconds=2 * _setting('IOT_HEARTBEAT_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL))
+            devices = devices.filter(last_seen__gte=self._synced_at - margin)
+        for iot_id, last_seen, interval in devices.values_list('iot_id', 'last_seen', 'heartbeat_interval').iterator():
+            deadline = self.deadline(last_seen, interval)
+            if self._deadlines.get(iot_id) != deadline:
+                self._deadlines[iot_id] = deadline
+                heapq.heappush(self._heap, (deadline, iot_id))
+        self._synced_at = now
+
+    def scan(self, now=None):
+        """Marca fuera de línea los dispositivos con el plazo vencido. Retorna sus `iot_id`."""
+        now = now or timezone.now()
+        self.sync(now)
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, iot_id = heapq.heappop(self._heap)
+            # Las entradas reemplazadas por un plazo posterior se descartan al salir
+            if self._deadlines.get(iot_id) == deadline:
+                del self._deadlines[iot_id]
+                due.append(iot_id)
+        if not due:
+            return []
+
+        # Se confirma con la base de datos: el dispositivo pudo reportar o desactivarse después de la sincronización
+        offline = {
+            iot_id: last_seen for iot_id, last_seen, interval in IoTDevice.objects.filter(
+                iot_id__in=due, is_active=True, online=True
+            ).values_list('iot_id', 'last_seen', 'heartbeat_interval')
+            if self.deadline(last_seen, interval) <= now
+        }
+        if not offline:
+            return []
+        # Solo si `last_seen` no cambió desde la confirmación
+        unchanged = Q()
+        for iot_id, last_seen in offline.items():
+            unchanged |= Q(iot_id=iot_id, last_seen=last_seen)
+        IoTDevice.objects.filter(unchanged).update(online=False)
+        return list(offline)
+
+
+def fleet_health():
+    """Conteos de la flota por estado y por tipo, calculados sobre `IoTDevice` con una consulta por agrupación."""
+    # Los alias no pueden coincidir con campos del modelo (`online`), por eso el sufijo `_count`
+    counts = {
+        'total_count': Count('iot_id'),
+        'active_count': Count('iot_id', filter=Q(is_active=True)),
+        'online_count': Count('iot_id', filter=Q(is_active=True, online=True)),
+        'offline_count': Count('iot_id', filter=Q(is_active=True, online=False, last_seen__isnull=False)),
+        'never_seen_count': Count('iot_id', filter=Q(is_active=True, last_seen__isnull=True)),
+    }
+
+    def estados(row):
+        return {alias.removesuffix('_count'): row[alias] for alias in counts}
+
+    by_type = IoTDevice.objects.values('device_type_id', 'device_type__name').annotate(**counts).order_by('device_type_id')
+    return {
+        **estados(IoTDevice.objects.aggregate(**counts)),
+        'by_type': [
+            {'device_type': row['device_type_id'], 'name': row['device_type__name'], **estados(row)}
+            for row in by_type
+        ],
+    }
@@ -0,0 +1,39 @@
+import signal
+from django.core.management.base import BaseCommand, CommandError
+from iot.fake_esp32 import FakeESP32Server
+
+
+class Command(BaseCommand):
+    help = "Inicia un controlador ESP32 simulado (GET /setangle) con latencia y fallos configurables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8081)
+        parser.add_argument('--latency', type=float, default=0.05, help="Segundos de espera por petición.")
+        parser.add_argument('--jitter', type=float, default=0.0, help="Variación aleatoria de la latencia (± segundos).")
+        parser.add_argument('--failure-rate', type=float, default=0.0, help="Proporción de peticiones que responden 503.")
+
+    def handle(self, *args, **options):
+        if not 0 <= options['failure_rate'] <= 1:
+            raise CommandError("--failure-rate debe estar entre 0 y 1.")
+        server = FakeESP32Server(
+            options['host'], options['port'],
+            latency=options['latency'], jitter=options['jitter'], failure_rate=options['failure_rate'],
+        )
+
+        def terminate(signum, frame):
+            raise KeyboardInterrupt
+
+        signal.signal(signal.SIGTERM, terminate)
+        host, port = server.server_address[:2]
+        self.stdout.write(self.style.SUCCESS(f"ESP32 simulado escuchando en http://{host}:{port}/setangle"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(
+                f"ESP32 simulado detenido: {len(server.angles)} consignas aceptadas, {server.failures} fallidas, "
+                f"{server.connections} conexiones."
+            )
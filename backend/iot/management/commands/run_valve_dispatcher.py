@@ -0,0 +1,37 @@
+import signal
+import time
+from django.core.management.base import BaseCommand
+from iot.valves import ValveDispatcher
+
+
+class Command(BaseCommand):
+    help = "Envía a las válvulas las consignas pendientes de la bandeja de salida, con reintentos."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help="Hilos de envío (por defecto IOT_VALVE_WORKERS).")
+        parser.add_argument('--poll-interval', type=float, default=0.5, help="Segundos de espera cuando no hay consignas vencidas.")
+        parser.add_argument('--once', action='store_true', help="Procesa una sola ronda y termina.")
+
+    def handle(self, *args, **options):
+        def terminate(signum, frame):
+            raise KeyboardInterrupt
+
+        signal.signal(signal.SIGTERM, terminate)
+        with ValveDispatcher(workers=options['workers']) as dispatcher:
+            recovered = dispatcher.recover()
+            if recovered:
+                self.stdout.write(f"{recovered} consignas interrumpidas vuelven a quedar pendientes.")
+            self.stdout.write(self.style.SUCCESS(f"Despachador de válvulas iniciado con {dispatcher.workers} hilos."))
+            try:
+                while True:
+                    attempted = dispatcher.run_once()
+                    if options['once']:
+                        break
+                    if not attempted:
+                        time.sleep(options['poll_interval'])
+            except KeyboardInterrupt:
+                pass
+            self.stdout.write(
+                f"Despachador detenido: {dispatcher.sent} consignas enviadas, {dispatcher.retried} reintentos, "
+                f"{dispatcher.failed} fallidas."
+            )
@@ -0,0 +1,29 @@
+import signal
+import time
+from django.core.management.base import BaseCommand
+from iot.heartbeat import OfflineScanner
+
+
+class Command(BaseCommand):
+    help = "Marca fuera de línea los dispositivos activos que dejaron de reportar durante varios intervalos."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=30, help="Segundos entre revisiones.")
+        parser.add_argument('--once', action='store_true', help="Hace una sola revisión y termina.")
+
+    def handle(self, *args, **options):
+        def terminate(signum, frame):
+            raise KeyboardInterrupt
+
+        signal.signal(signal.SIGTERM, terminate)
+        scanner = OfflineScanner()
+        try:
+            while True:
+                offline = scanner.scan()
+                if offline:
+                    self.stdout.write(f"{len(offline)} dispositivos fuera de línea: {', '.join(sorted(offline))}")
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
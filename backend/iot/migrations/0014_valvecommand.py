@@ -0,0 +1,34 @@
+# Generated by Django 5.1.6 on 2026-10-16 21:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iot', '0013_alter_iotdevice_registration_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ValveCommand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('setpoint', models.FloatField(verbose_name='Caudal solicitado (L/s)')),
+                ('status', models.CharField(choices=[('pending', 'Pendiente'), ('sending', 'Enviando'), ('sent', 'Enviada'), ('failed', 'Fallida'), ('superseded', 'Reemplazada')], default='pending', max_length=10, verbose_name='Estado')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Intentos')),
+                ('next_attempt_at', models.DateTimeField(verbose_name='Próximo intento')),
+                ('last_error', models.CharField(blank=True, default='', max_length=300, verbose_name='Último error')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de creación')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Fecha de envío')),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='valve_commands', to='iot.iotdevice', verbose_name='Válvula')),
+            ],
+            options={
+                'verbose_name': 'Comando de válvula',
+                'verbose_name_plural': 'Comandos de válvulas',
+                'ordering': ['-id'],
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='valve_command_due_idx')],
+            },
+        ),
+    ]
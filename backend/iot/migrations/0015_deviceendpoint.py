@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-16 21:45
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iot', '0014_valvecommand'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceEndpoint',
+            fields=[
+                ('device', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='endpoint', serialize=False, to='iot.iotdevice', verbose_name='Dispositivo')),
+                ('host', models.CharField(max_length=255, verbose_name='Host del controlador')),
+                ('port', models.PositiveIntegerField(default=80, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(65535)], verbose_name='Puerto')),
+                ('max_concurrency', models.PositiveSmallIntegerField(default=1, help_text='Máximo de peticiones en curso al controlador; los ESP32 suelen atender una a la vez.', validators=[django.core.validators.MinValueValidator(1)], verbose_name='Peticiones simultáneas')),
+            ],
+            options={
+                'verbose_name': 'Dirección de controlador',
+                'verbose_name_plural': 'Direcciones de controladores',
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-16 22:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iot', '0015_deviceendpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='iotdevice',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True, verbose_name='Último reporte'),
+        ),
+        migrations.AddField(
+            model_name='iotdevice',
+            name='online',
+            field=models.BooleanField(db_index=True, default=False, editable=False, verbose_name='En línea'),
+        ),
+        migrations.AddField(
+            model_name='iotdevice',
+            name='heartbeat_interval',
+            field=models.PositiveIntegerField(blank=True, help_text='Segundos esperados entre reportes; vacío usa IOT_HEARTBEAT_INTERVAL.', null=True, verbose_name='Intervalo de reporte (s)'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.1.6 on 2026-10-16 22:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iot', '0016_iotdevice_heartbeat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TelemetryMetric',
+            fields=[
+                ('id', models.SmallAutoField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=64, unique=True, verbose_name='Nombre')),
+                ('unit', models.CharField(blank=True, default='', max_length=16, verbose_name='Unidad')),
+            ],
+            options={
+                'verbose_name': 'Variable de telemetría',
+                'verbose_name_plural': 'Variables de telemetría',
+            },
+        ),
+        migrations.CreateModel(
+            name='TelemetryReading',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(verbose_name='Fecha')),
+                ('value', models.FloatField(verbose_name='Valor')),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='telemetry', to='iot.iotdevice', verbose_name='Dispositivo')),
+                ('metric', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='readings', to='iot.telemetrymetric', verbose_name='Variable')),
+            ],
+            options={
+                'verbose_name': 'Lectura de telemetría',
+                'verbose_name_plural': 'Lecturas de telemetría',
+                'indexes': [models.Index(fields=['device', 'metric', 'timestamp'], name='telemetry_series_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TelemetryRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.CharField(choices=[('minute', 'Minuto'), ('hour', 'Hora'), ('day', 'Día')], max_length=6, verbose_name='Intervalo')),
+                ('bucket_start', models.DateTimeField(verbose_name='Inicio del intervalo')),
+                ('count', models.PositiveIntegerField(verbose_name='Cantidad de lecturas')),
+                ('min_value', models.FloatField(verbose_name='Valor mínimo')),
+                ('max_value', models.FloatField(verbose_name='Valor máximo')),
+                ('sum_value', models.FloatField(verbose_name='Suma de valores')),
+                ('last_value', models.FloatField(verbose_name='Último valor')),
+                ('last_timestamp', models.DateTimeField(verbose_name='Fecha de la última lectura')),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='telemetry_rollups', to='iot.iotdevice', verbose_name='Dispositivo')),
+                ('metric', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='rollups', to='iot.telemetrymetric', verbose_name='Variable')),
+            ],
+            options={
+                'verbose_name': 'Agregado de telemetría',
+                'verbose_name_plural': 'Agregados de telemetría',
+                'constraints': [models.UniqueConstraint(fields=('device', 'metric', 'bucket', 'bucket_start'), name='unique_telemetry_rollup_bucket')],
+            },
+        ),
+    ]
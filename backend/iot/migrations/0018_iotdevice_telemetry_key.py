@@ -0,0 +1,33 @@
+# Generated by Django 5.1.6 on 2026-10-16 23:40
+
+import iot.models
+from django.db import migrations, models
+
+
+def assign_telemetry_keys(apps, schema_editor):
+    # Una clave distinta por dispositivo: el valor por defecto de AddField se evalúa una sola vez
+    IoTDevice = apps.get_model('iot', 'IoTDevice')
+    for device in IoTDevice.objects.only('iot_id'):
+        IoTDevice.objects.filter(pk=device.pk).update(telemetry_key=iot.models.generate_telemetry_key())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iot', '0017_telemetry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='iotdevice',
+            name='telemetry_key',
+            field=models.CharField(default='', max_length=64, verbose_name='Clave de telemetría'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(assign_telemetry_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='iotdevice',
+            name='telemetry_key',
+            field=models.CharField(default=iot.models.generate_telemetry_key, help_text='Clave con la que el dispositivo firma los datagramas que envía a la pasarela UDP.', max_length=64, verbose_name='Clave de telemetría'),
+        ),
+    ]
@@ -1,9 +1,16 @@
-from django.db import models
+from django.db import models, transaction
+from auditlog.registry import auditlog
 from plots_lots.models import Plot,Lot
 import random
+import secrets
 from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
 
+def generate_telemetry_key():
+    """Clave aleatoria con la que el dispositivo firma sus datagramas de telemetría (HMAC-SHA256)."""
+    return secrets.token_hex(32)
+
+
 class DeviceType(models.Model):
     device_id = models.CharField(max_length=2, primary_key=True, editable=False)
     name = models.CharField(max_length=50, blank=False, null=False)
@@ -30,6 +37,15 @@ class DeviceType(models.Model):
 VALVE_48_ID = '05' # ID para válvula de 48"
 VALVE_4_ID = '06' # ID para válvula de 4"
 
+# Medidores de caudal: sus lecturas van a las tablas de caudal, no a la telemetría genérica
+FLOW_METER_TYPE_IDS = ('03', '04')
+
+TELEMETRY_BUCKET_CHOICES = [
+    ('minute', 'Minuto'),
+    ('hour', 'Hora'),
+    ('day', 'Día'),
+]
+
 class IoTDevice(models.Model):
     iot_id = models.CharField(max_length=7, primary_key=True, editable=False)  # Formato XX-YYYY
     id_plot = models.ForeignKey(
@@ -58,6 +74,16 @@ class IoTDevice(models.Model):
         validators=[MinValueValidator(0), MaxValueValidator(180)]
     )
     registration_date = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de registro")
+    last_seen = models.DateTimeField(null=True, blank=True, db_index=True, editable=False, verbose_name="Último reporte")
+    online = models.BooleanField(default=False, db_index=True, editable=False, verbose_name="En línea")
+    heartbeat_interval = models.PositiveIntegerField(
+        null=True, blank=True, verbose_name="Intervalo de reporte (s)",
+        help_text="Segundos esperados entre reportes; vacío usa IOT_HEARTBEAT_INTERVAL."
+    )
+    telemetry_key = models.CharField(
+        max_length=64, default=generate_telemetry_key, verbose_name="Clave de telemetría",
+        help_text="Clave con la que el dispositivo firma los datagramas que envía a la pasarela UDP."
+    )
 
     def clean(self):
         """Validaciones personalizadas"""
@@ -137,6 +163,13 @@ class IoTDevice(models.Model):
         verbose_name = "Dispositivo IoT"
         verbose_name_plural = "Dispositivos IoT"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Caudal guardado, para enviar a la válvula solo los cambios de consigna
+        instance._stored_actual_flow = instance.__dict__.get('actual_flow')
+        return instance
+
     def save(self, *args, **kwargs):
         if not self.iot_id:
             random_suffix = f"{random.randint(0, 9999):04d}"  # Números aleatorios de 4 dígitos
@@ -148,10 +181,158 @@ class IoTDevice(models.Model):
             self.owner_name = "Sin dueño"  # ✅ Valor predeterminado si está vacío    
         
         self.full_clean()  # Ejecutar todas las validaciones
-        super().save(*args, **kwargs)
+        setpoint_changed = (
+            self.device_type_id in [VALVE_48_ID, VALVE_4_ID]
+            and self.actual_flow is not None
+            and self.actual_flow != getattr(self, '_stored_actual_flow', None)
+        )
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if setpoint_changed:
+                # La consigna se envía a la válvula fuera de la petición (iot.valves)
+                from .valves import enqueue_setpoint
+                enqueue_setpoint(self)
+        self._stored_actual_flow = self.actual_flow
 
     def __str__(self):
         base_str = f"{self.name} ({self.device_type.name})"
         if self.device_type_id in [VALVE_48_ID, VALVE_4_ID]:
             return f"{base_str} - {self.actual_flow} L/s"
         return base_str
+
+
+class DeviceEndpoint(models.Model):
+    """
+    Dirección HTTP del controlador (ESP32) que atiende un dispositivo.
+
+    Varios dispositivos pueden compartir controlador (mismo host y puerto): el
+    despachador mantiene una sesión con conexiones persistentes por controlador y
+    limita a `max_concurrency` las peticiones simultáneas a cada uno.
+    """
+    device = models.OneToOneField(IoTDevice, on_delete=models.CASCADE, primary_key=True, related_name="endpoint", verbose_name="Dispositivo")
+    host = models.CharField(max_length=255, verbose_name="Host del controlador")
+    port = models.PositiveIntegerField(default=80, validators=[MinValueValidator(1), MaxValueValidator(65535)], verbose_name="Puerto")
+    max_concurrency = models.PositiveSmallIntegerField(
+        default=1, validators=[MinValueValidator(1)], verbose_name="Peticiones simultáneas",
+        help_text="Máximo de peticiones en curso al controlador; los ESP32 suelen atender una a la vez."
+    )
+
+    class Meta:
+        verbose_name = "Dirección de controlador"
+        verbose_name_plural = "Direcciones de controladores"
+
+    @property
+    def controller(self):
+        return (self.host, self.port)
+
+    def __str__(self):
+        return f"{self.device_id} → {self.host}:{self.port}"
+
+
+class ValveCommand(models.Model):
+    """
+    Consigna pendiente de enviar a una válvula (bandeja de salida).
+
+    Se crea en la misma transacción que el cambio de `actual_flow` y la envía después
+    el despachador (`iot.valves`). Al encolar una consigna nueva, las pendientes de la
+    misma válvula se marcan como reemplazadas: solo se envía la más reciente.
+    """
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    SUPERSEDED = 'superseded'
+    STATUS_CHOICES = [
+        (PENDING, 'Pendiente'),
+        (SENDING, 'Enviando'),
+        (SENT, 'Enviada'),
+        (FAILED, 'Fallida'),
+        (SUPERSEDED, 'Reemplazada'),
+    ]
+
+    device = models.ForeignKey(IoTDevice, on_delete=models.CASCADE, related_name="valve_commands", verbose_name="Válvula")
+    setpoint = models.FloatField(verbose_name="Caudal solicitado (L/s)")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, verbose_name="Estado")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Intentos")
+    next_attempt_at = models.DateTimeField(verbose_name="Próximo intento")
+    last_error = models.CharField(max_length=300, blank=True, default="", verbose_name="Último error")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de creación")
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name="Fecha de envío")
+
+    class Meta:
+        verbose_name = "Comando de válvula"
+        verbose_name_plural = "Comandos de válvulas"
+        ordering = ['-id']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='valve_command_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.device_id} → {self.setpoint} L/s ({self.get_status_display()})"
+
+
+class TelemetryMetric(models.Model):
+    """
+    Variable medida por los dispositivos que no son de caudal (voltaje de batería,
+    potencia solar, etc.). Cada nombre se guarda una sola vez y las lecturas lo
+    referencian por su id de dos bytes.
+    """
+    id = models.SmallAutoField(primary_key=True)
+    name = models.CharField(max_length=64, unique=True, verbose_name="Nombre")
+    unit = models.CharField(max_length=16, blank=True, default="", verbose_name="Unidad")
+
+    class Meta:
+        verbose_name = "Variable de telemetría"
+        verbose_name_plural = "Variables de telemetría"
+
+    def __str__(self):
+        return f"{self.name} ({self.unit})" if self.unit else self.name
+
+
+class TelemetryReading(models.Model):
+    """Lectura de una variable de un dispositivo: una fila angosta (dispositivo, variable, fecha, valor)."""
+    device = models.ForeignKey(IoTDevice, on_delete=models.CASCADE, related_name="telemetry", verbose_name="Dispositivo")
+    metric = models.ForeignKey(TelemetryMetric, on_delete=models.PROTECT, related_name="readings", verbose_name="Variable")
+    timestamp = models.DateTimeField(verbose_name="Fecha")
+    value = models.FloatField(verbose_name="Valor")
+
+    class Meta:
+        verbose_name = "Lectura de telemetría"
+        verbose_name_plural = "Lecturas de telemetría"
+        indexes = [
+            models.Index(fields=['device', 'metric', 'timestamp'], name='telemetry_series_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.device_id} {self.metric_id} {self.timestamp}: {self.value}"
+
+
+class TelemetryRollup(models.Model):
+    """Agregado de una variable de un dispositivo por minuto, hora o día."""
+    device = models.ForeignKey(IoTDevice, on_delete=models.CASCADE, related_name="telemetry_rollups", verbose_name="Dispositivo")
+    metric = models.ForeignKey(TelemetryMetric, on_delete=models.PROTECT, related_name="rollups", verbose_name="Variable")
+    bucket = models.CharField(max_length=6, choices=TELEMETRY_BUCKET_CHOICES, verbose_name="Intervalo")
+    bucket_start = models.DateTimeField(verbose_name="Inicio del intervalo")
+    count = models.PositiveIntegerField(verbose_name="Cantidad de lecturas")
+    min_value = models.FloatField(verbose_name="Valor mínimo")
+    max_value = models.FloatField(verbose_name="Valor máximo")
+    sum_value = models.FloatField(verbose_name="Suma de valores")
+    last_value = models.FloatField(verbose_name="Último valor")
+    last_timestamp = models.DateTimeField(verbose_name="Fecha de la última lectura")
+
+    class Meta:
+        verbose_name = "Agregado de telemetría"
+        verbose_name_plural = "Agregados de telemetría"
+        constraints = [
+            models.UniqueConstraint(fields=['device', 'metric', 'bucket', 'bucket_start'], name='unique_telemetry_rollup_bucket'),
+        ]
+
+    @property
+    def mean_value(self):
+        return self.sum_value / self.count if self.count else None
+
+    def __str__(self):
+        return f"{self.device_id} {self.metric_id} - {self.bucket} {self.bucket_start}"
+
+
+auditlog.register(IoTDevice, exclude_fields=['telemetry_key'])
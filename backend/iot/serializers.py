@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import IoTDevice, DeviceType, VALVE_48_ID, VALVE_4_ID
+from .models import IoTDevice, DeviceType, TelemetryRollup, VALVE_48_ID, VALVE_4_ID
 from plots_lots.models import Plot, Lot
 from django.core.validators import MaxValueValidator, MinValueValidator
 
@@ -17,7 +17,8 @@ class IoTDeviceSerializer(serializers.ModelSerializer):
         model = IoTDevice
         fields = ['iot_id', 'id_plot', 'id_lot', 'name', 'device_type',
         'is_active', 'characteristics', 'owner_name',
-        'device_type_name', 'actual_flow', 'registration_date']
+        'device_type_name', 'actual_flow', 'registration_date',
+        'heartbeat_interval', 'last_seen', 'online']
 
     def validate(self, data):
         """ Validación personalizada """
@@ -164,4 +165,12 @@ class UpdateValveFlowSerializer(serializers.ModelSerializer):
         if actual_flow is not None and device.actual_flow == actual_flow:
             raise serializers.ValidationError("Ya tienes un caudal activo con ese valor. Debes solicitar un valor diferente.")
 
-        return data
\ No newline at end of file
+        return data
+
+# 🔹 Agregados de telemetría por intervalo
+class TelemetryRollupSerializer(serializers.ModelSerializer):
+    mean_value = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = TelemetryRollup
+        fields = ['bucket_start', 'count', 'min_value', 'max_value', 'mean_value', 'sum_value', 'last_value', 'last_timestamp']
@@ -1,19 +1,22 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import IoTDevice, VALVE_48_ID, VALVE_4_ID,DeviceType
-import requests
+from plots_lots.models import Plot, Lot
+from .models import IoTDevice, DeviceType
+from .device_map import get_device_map
 from django.db import transaction
+
+
 @receiver(post_save, sender=IoTDevice)
-def send_flow_to_esp(sender, instance, **kwargs):
-    # Verificar si es una válvula y actual_flow ha cambiado
-    if instance.device_type_id in [VALVE_48_ID, VALVE_4_ID]:
-        try:
-            esp_ip = "172.20.10.2"  # Reemplazar con IP real del ESP32
-            angle = int(instance.actual_flow)  # Conversión directa temporal
-            requests.get(f"http://{esp_ip}/setangle?angle={angle}", timeout=3)
-        except Exception as e:
-            print(f"Error enviando a ESP32: {str(e)}")
-            
+@receiver(post_delete, sender=IoTDevice)
+@receiver(post_delete, sender=Plot)
+@receiver(post_delete, sender=Lot)
+def invalidar_mapa_dispositivos(sender, **kwargs):
+    """ Un dispositivo cambió o quedó sin predio/lote: se recarga el mapa de dispositivos. """
+    device_map = get_device_map()
+    device_map.invalidate()
+    # Otra vez al confirmar, para que otros procesos no se queden con una carga previa al commit
+    transaction.on_commit(device_map.invalidate)
+
 def create_default_divice_types(sender, **kwargs):  
    
     try:
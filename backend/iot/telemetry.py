@@ -0,0 +1,186 @@
+"""
+Telemetría genérica de los dispositivos que no son de caudal.
+
+Paneles solares, baterías, controladores de carga y convertidores (tipos 07, 10, 11
+y 12) reportan variables distintas; en lugar de un modelo por tipo, cada lectura es
+una fila angosta `(dispositivo, variable, fecha, valor)` en `TelemetryReading`:
+
+- Los nombres de variable se internan en `TelemetryMetric` y se resuelven con un
+  mapa en memoria; las variables nuevas se crean en una sola inserción por envío.
+- Los dispositivos se validan contra el mapa de `iot.device_map`, sin consultas.
+  Los medidores de caudal se rechazan: sus lecturas van a la ingesta de `caudal`.
+- Las lecturas se insertan con `bulk_create` y se suman a los agregados por minuto,
+  hora y día (`TelemetryRollup`) con el mismo UPSERT de los agregados de caudal
+  (`caudal.rollups.guardar_agregados`).
+"""
+import math
+import re
+import threading
+from datetime import datetime
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from caudal.rollups import BUCKET_SECONDS, truncar, elegir_intervalo, guardar_agregados
+from .device_map import get_device_map
+from .heartbeat import marcar_actividad
+from .models import TelemetryMetric, TelemetryReading, TelemetryRollup, FLOW_METER_TYPE_IDS
+
+DEFAULT_MAX_READINGS = 10000
+DEFAULT_BATCH_SIZE = 1000
+METRIC_NAME = re.compile(r'^[a-z][a-z0-9_]{0,63}$')
+
+
+def get_max_readings():
+    return getattr(settings, 'IOT_TELEMETRY_MAX_READINGS', DEFAULT_MAX_READINGS)
+
+
+class MetricRegistry:
+    """Ids de las variables de telemetría por nombre, cargados una vez por proceso."""
+
+    def __init__(self):
+        self._ids = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        self._ids = dict(TelemetryMetric.objects.values_list('name', 'id'))
+
+    def resolve(self, names):
+        """Retorna `{nombre: id}`; crea las variables que aún no existen."""
+        with self._lock:
+            if self._ids is None:
+                self._load()
+            missing = set(names) - set(self._ids)
+            if missing:
+                # `ignore_conflicts`: otro proceso pudo crearlas a la vez
+                TelemetryMetric.objects.bulk_create(
+                    [TelemetryMetric(name=name) for name in sorted(missing)], ignore_conflicts=True
+                )
+                self._ids.update(TelemetryMetric.objects.filter(name__in=missing).values_list('name', 'id'))
+            return {name: self._ids[name] for name in names}
+
+    def invalidate(self):
+        with self._lock:
+            self._ids = None
+
+
+_registry = MetricRegistry()
+
+
+def get_metric_registry():
+    return _registry
+
+
+def _parse_timestamp(value):
+    parsed = value if isinstance(value, datetime) else parse_datetime(value) if isinstance(value, str) else None
+    if parsed is None:
+        raise ValueError("La fecha debe estar en formato ISO 8601.")
+    if timezone.is_aware(parsed) and not settings.USE_TZ:
+        parsed = timezone.make_naive(parsed)
+    return parsed
+
+
+def _parse_value(metric, value):
+    if not isinstance(metric, str) or not METRIC_NAME.match(metric):
+        raise ValueError("El nombre de la variable debe usar minúsculas, números y '_' (máximo 64 caracteres).")
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f"El valor de '{metric}' debe ser un número finito.")
+    return float(value)
+
+
+def _clean_reading(raw, device_map):
+    """
+    Expande una lectura en `(dispositivo, variable, fecha, valor)`.
+
+    Acepta `{'device', 'timestamp', 'metric', 'value'}` o varias variables a la vez
+    con `{'device', 'timestamp', 'values': {variable: valor}}`.
+    """
+    if not isinstance(raw, dict):
+        raise ValueError("Cada lectura debe ser un objeto JSON.")
+    device = raw.get('device')
+    info = device_map.get(device) if isinstance(device, str) else None
+    if info is None:
+        raise ValueError(f"El dispositivo {device} no existe en la base de datos.")
+    if info.type in FLOW_METER_TYPE_IDS:
+        raise ValueError("Las lecturas de los medidores de caudal se registran en la ingesta de caudal.")
+    timestamp = _parse_timestamp(raw.get('timestamp'))
+
+    if 'values' in raw:
+        values = raw['values']
+        if not isinstance(values, dict) or not values:
+            raise ValueError("El campo 'values' debe ser un objeto con al menos una variable.")
+    else:
+        values = {raw.get('metric'): raw.get('value')}
+    return [(device, metric, timestamp, _parse_value(metric, value)) for metric, value in values.items()]
+
+
+def agregar_lecturas(lecturas):
+    """Combina lecturas en memoria por (dispositivo, variable, intervalo, inicio)."""
+    agregados = {}
+    for lectura in lecturas:
+        value, timestamp = lectura.value, lectura.timestamp
+        for bucket in BUCKET_SECONDS:
+            bucket_key = (lectura.device_id, lectura.metric_id, bucket, truncar(timestamp, bucket))
+            agregado = agregados.get(bucket_key)
+            if agregado is None:
+                agregados[bucket_key] = [1, value, value, value, value, timestamp]
+                continue
+            agregado[0] += 1
+            agregado[1] = min(agregado[1], value)
+            agregado[2] = max(agregado[2], value)
+            agregado[3] += value
+            if timestamp >= agregado[5]:
+                agregado[4], agregado[5] = value, timestamp
+    return agregados
+
+
+def actualizar_rollups(lecturas):
+    """Suma un conjunto de lecturas de telemetría a sus agregados."""
+    return guardar_agregados(
+        TelemetryRollup,
+        ('device_id', 'metric_id', 'bucket', 'bucket_start'),
+        ('count', 'min_value', 'max_value', 'sum_value', 'last_value', 'last_timestamp'),
+        agregar_lecturas(lecturas),
+    )
+
+
+def ingest_telemetry(raw_readings):
+    """
+    Valida y guarda un lote de lecturas de telemetría. Las válidas se guardan aunque
+    otras del envío sean rechazadas. Retorna `{'created', 'metrics', 'rejected'}`.
+    """
+    device_map = get_device_map()
+    rows, errors = [], []
+    for index, raw in enumerate(raw_readings):
+        try:
+            rows.extend(_clean_reading(raw, device_map))
+        except ValueError as exc:
+            errors.append({'index': index, 'error': str(exc)})
+    if not rows:
+        return {'created': 0, 'metrics': [], 'rejected': errors}
+
+    metric_ids = get_metric_registry().resolve({metric for _, metric, _, _ in rows})
+    lecturas = [
+        TelemetryReading(device_id=device, metric_id=metric_ids[metric], timestamp=timestamp, value=value)
+        for device, metric, timestamp, value in rows
+    ]
+    with transaction.atomic():
+        TelemetryReading.objects.bulk_create(
+            lecturas, batch_size=getattr(settings, 'IOT_TELEMETRY_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+        )
+        actualizar_rollups(lecturas)
+        marcar_actividad(lectura.device_id for lectura in lecturas)
+    return {'created': len(lecturas), 'metrics': sorted(metric_ids), 'rejected': errors}
+
+
+def consultar_rollups(device_id, metric_id, inicio, fin, bucket=None):
+    """Retorna `(intervalo, filas)` para el rango pedido, eligiendo el intervalo si no se indica."""
+    bucket = bucket or elegir_intervalo(inicio, fin)
+    rows = TelemetryRollup.objects.filter(
+        device_id=device_id,
+        metric_id=metric_id,
+        bucket=bucket,
+        bucket_start__gte=truncar(inicio, bucket),
+        bucket_start__lte=fin,
+    ).order_by('bucket_start')
+    return bucket, rows
@@ -1,3 +1,350 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from unittest import mock
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+from auditlog.models import LogEntry
+from django.utils import timezone
+from users.models import CustomUser
+from plots_lots.models import Plot, Lot, CropType, SoilType
+from .models import IoTDevice, DeviceEndpoint, ValveCommand, TelemetryMetric, TelemetryReading, TelemetryRollup, VALVE_48_ID, VALVE_4_ID
+from .valves import ValveDispatcher, apply_setpoints
+from .fake_esp32 import FakeESP32Server
+from .heartbeat import HeartbeatTracker, OfflineScanner, fleet_health
+from .telemetry import ingest_telemetry, get_metric_registry
 
-# Create your tests here.
+
+class ValveCommandOutboxTest(TestCase):
+    def setUp(self):
+        self.valve = IoTDevice.objects.create(name='Válvula principal', device_type_id=VALVE_48_ID, actual_flow=10)
+
+    def test_save_enqueues_latest_setpoint_without_calling_the_device(self):
+        """ Guardar la válvula encola la consigna sin llamar al ESP32; solo la más reciente queda pendiente. """
+        with mock.patch('requests.get') as get:
+            valve = IoTDevice.objects.get(iot_id=self.valve.iot_id)
+            valve.actual_flow = 20
+            valve.save()
+            valve.is_active = False
+            valve.save()  # Sin cambio de consigna
+        get.assert_not_called()
+
+        commands = ValveCommand.objects.filter(device=self.valve).order_by('id')
+        self.assertEqual([(c.setpoint, c.status) for c in commands], [
+            (10, ValveCommand.SUPERSEDED), (20, ValveCommand.PENDING),
+        ])
+
+    def test_dispatcher_retries_with_backoff_and_sends_latest(self):
+        """ Un fallo reprograma la consigna con espera; una consigna nueva reemplaza a la que se reintentaba. """
+        sent = []
+
+        def sender(command):
+            if not sent:
+                sent.append(None)
+                raise ConnectionError("sin respuesta")
+            sent.append(command.setpoint)
+
+        dispatcher = ValveDispatcher(sender=sender, max_attempts=3)
+        self.assertEqual(dispatcher.run_once(), 1)
+        command = ValveCommand.objects.get(device=self.valve)
+        self.assertEqual((command.status, command.attempts), (ValveCommand.PENDING, 1))
+        self.assertGreater(command.next_attempt_at, timezone.now())
+        self.assertEqual(dispatcher.run_once(), 0)  # Aún en espera
+
+        self.valve.actual_flow = 30
+        self.valve.save()
+        ValveCommand.objects.filter(status=ValveCommand.PENDING).update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(dispatcher.run_once(), 1)
+        self.assertEqual(sent, [None, 30])
+        self.assertEqual(
+            list(ValveCommand.objects.order_by('id').values_list('status', flat=True)),
+            [ValveCommand.SUPERSEDED, ValveCommand.SENT],
+        )
+
+
+class ValveDispatcherQueuesTest(TransactionTestCase):
+    # Los trabajadores corren en otros hilos: necesitan ver los datos ya confirmados
+    serialized_rollback = True
+
+    def test_slow_valve_does_not_delay_the_others(self):
+        """ Cada válvula tiene su cola: la siguiente consigna de una sale apenas termina la anterior, aunque otra siga bloqueada. """
+        slow = IoTDevice.objects.create(name='Válvula lenta', device_type_id=VALVE_48_ID, actual_flow=10)
+        owner = CustomUser.objects.create_user(
+            document='123456789', first_name='Test', last_name='User',
+            email='test@example.com', phone='1234567890', password='testpass123',
+        )
+        plot = Plot.objects.create(owner=owner, plot_name='Predio', latitud=1, longitud=1, plot_extension=10)
+        fast = IoTDevice.objects.create(name='Válvula rápida', device_type_id=VALVE_4_ID, id_plot=plot, actual_flow=20)
+        release_slow, release_fast, fast_started = threading.Event(), threading.Event(), threading.Event()
+        sent = []
+        fast_done = threading.Event()
+
+        def sender(command):
+            if command.device_id == slow.iot_id:
+                release_slow.wait(5)
+            elif not sent:
+                fast_started.set()
+                release_fast.wait(5)
+            sent.append(command.setpoint)
+            if command.device_id == fast.iot_id and command.setpoint == 25:
+                fast_done.set()
+
+        with ValveDispatcher(sender=sender, workers=4) as dispatcher:
+            self.assertEqual(dispatcher.run_once(), 2)
+            self.assertTrue(fast_started.wait(5))
+            # Nueva consigna mientras la anterior de la misma válvula se envía: la toma su trabajador
+            fast.actual_flow = 25
+            fast.save()
+            self.assertEqual(dispatcher.run_once(), 0)
+            release_fast.set()
+            self.assertTrue(fast_done.wait(5))
+            self.assertEqual(sent, [20, 25])  # La válvula lenta sigue bloqueada
+            release_slow.set()
+
+        self.assertEqual(sorted(sent), [10, 20, 25])
+        self.assertEqual((dispatcher.sent, dispatcher.retried, dispatcher.failed), (3, 0, 0))
+        self.assertEqual(ValveCommand.objects.filter(status=ValveCommand.SENT).count(), 3)
+
+
+class ControllerSessionsTest(TestCase):
+    def test_valves_sharing_a_controller_reuse_one_connection(self):
+        """ Las válvulas registradas en el mismo controlador se envían por una sola conexión persistente. """
+        server = FakeESP32Server().start()
+        self.addCleanup(server.stop)
+        host, port = server.server_address[:2]
+
+        owner = CustomUser.objects.create_user(
+            document='123456789', first_name='Test', last_name='User',
+            email='test@example.com', phone='1234567890', password='testpass123',
+        )
+        plot = Plot.objects.create(owner=owner, plot_name='Predio', latitud=1, longitud=1, plot_extension=10)
+        crop_type, soil_type = CropType.objects.get(name='Agricultura'), SoilType.objects.get(name='Franco')
+        for flow in (15, 25, 35):
+            lot = Lot.objects.create(plot=plot, crop_type=crop_type, soil_type=soil_type)
+            valve = IoTDevice.objects.create(name='Válvula lote', device_type_id=VALVE_4_ID, id_plot=plot, id_lot=lot, actual_flow=flow)
+            DeviceEndpoint.objects.create(device=valve, host=host, port=port)
+
+        dispatcher = ValveDispatcher()
+        self.addCleanup(dispatcher.sessions.close)
+        self.assertEqual(dispatcher.run_once(), 3)
+        self.assertEqual(sorted(server.angles), [15, 25, 35])
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(ValveCommand.objects.filter(status=ValveCommand.SENT).count(), 3)
+
+    def test_controller_errors_are_retried(self):
+        """ Un controlador que responde con error deja la consigna pendiente para reintentarla. """
+        server = FakeESP32Server(failure_rate=1).start()
+        self.addCleanup(server.stop)
+        valve = IoTDevice.objects.create(name='Válvula principal', device_type_id=VALVE_48_ID, actual_flow=10)
+        DeviceEndpoint.objects.create(device=valve, host=server.server_address[0], port=server.server_address[1])
+
+        dispatcher = ValveDispatcher()
+        self.addCleanup(dispatcher.sessions.close)
+        dispatcher.run_once()
+        command = ValveCommand.objects.get(device=valve)
+        self.assertEqual((command.status, command.attempts, server.failures), (ValveCommand.PENDING, 1, 1))
+        self.assertIn('503', command.last_error)
+
+
+class BatchValveFlowTest(TestCase):
+    def setUp(self):
+        self.admin = CustomUser.objects.create_user(
+            document='123456789', first_name='Test', last_name='Admin',
+            email='test@example.com', phone='1234567890', password='testpass123', is_staff=True,
+        )
+        plot = Plot.objects.create(owner=self.admin, plot_name='Predio', latitud=1, longitud=1, plot_extension=10)
+        crop_type, soil_type = CropType.objects.get(name='Agricultura'), SoilType.objects.get(name='Franco')
+        self.valves = [
+            IoTDevice.objects.create(
+                name='Válvula lote', device_type_id=VALVE_4_ID, id_plot=plot, actual_flow=5,
+                id_lot=Lot.objects.create(plot=plot, crop_type=crop_type, soil_type=soil_type),
+            )
+            for _ in range(3)
+        ]
+        self.meter = IoTDevice.objects.create(name='Medidor', device_type_id='04', id_plot=plot)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_batch_applies_valid_setpoints_and_reports_each_valve(self):
+        """ Las consignas válidas se aplican, auditan y encolan juntas; las inválidas se reportan por válvula. """
+        # Crear las válvulas ya encoló su consigna inicial
+        initial = set(ValveCommand.objects.values_list('id', flat=True))
+        self.assertEqual(len(initial), 3)
+        setpoints = [
+            {'iot_id': self.valves[0].iot_id, 'actual_flow': 20},
+            {'iot_id': self.valves[1].iot_id, 'actual_flow': 5},  # Sin cambio
+            {'iot_id': self.meter.iot_id, 'actual_flow': 3},
+            {'iot_id': self.valves[2].iot_id, 'actual_flow': 30},
+            {'iot_id': self.valves[2].iot_id, 'actual_flow': 40},
+            {'iot_id': self.valves[0].iot_id},
+        ]
+        with mock.patch('iot.valves.ControllerSessions.send') as send:
+            response = self.client.post(reverse('batch_update_valve_flow'), {'setpoints': setpoints}, format='json')
+        send.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['applied'], response.data['rejected']), (2, 4))
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['queued', 'rejected', 'rejected', 'queued', 'rejected', 'rejected'],
+        )
+        self.assertEqual(
+            list(IoTDevice.objects.filter(iot_id__in=[v.iot_id for v in self.valves]).order_by('iot_id').values_list('iot_id', 'actual_flow')),
+            sorted([(self.valves[0].iot_id, 20), (self.valves[1].iot_id, 5), (self.valves[2].iot_id, 30)]),
+        )
+
+        queued = [result['command'] for result in response.data['results'] if result['status'] == 'queued']
+        self.assertEqual(
+            list(ValveCommand.objects.filter(id__in=queued).order_by('setpoint').values_list('device_id', 'setpoint', 'status')),
+            [(self.valves[0].iot_id, 20, ValveCommand.PENDING), (self.valves[2].iot_id, 30, ValveCommand.PENDING)],
+        )
+        # Las consignas iniciales de las válvulas modificadas quedan reemplazadas; la otra sigue pendiente
+        self.assertEqual(
+            dict(ValveCommand.objects.filter(id__in=initial).values_list('device_id', 'status')),
+            {self.valves[0].iot_id: ValveCommand.SUPERSEDED, self.valves[1].iot_id: ValveCommand.PENDING, self.valves[2].iot_id: ValveCommand.SUPERSEDED},
+        )
+
+        # Una entrada de auditoría por válvula modificada, como la de `save()`
+        for valve, flow in ((self.valves[0], '20.0'), (self.valves[2], '30.0')):
+            entry = LogEntry.objects.get_for_object(valve).get(action=LogEntry.Action.UPDATE)
+            self.assertEqual(entry.changes_dict, {'actual_flow': ['5.0', flow]})
+            self.assertEqual(entry.actor, self.admin)
+        self.assertFalse(LogEntry.objects.get_for_object(self.valves[1]).filter(action=LogEntry.Action.UPDATE).exists())
+
+    def test_validation_queries_do_not_grow_with_the_batch(self):
+        """ Validar y aplicar el lote usa un número fijo de consultas, sin importar cuántas válvulas incluya. """
+        with CaptureQueriesContext(connection) as single:
+            apply_setpoints([{'iot_id': self.valves[0].iot_id, 'actual_flow': 40}])
+        with CaptureQueriesContext(connection) as batch:
+            commands, errors = apply_setpoints([{'iot_id': valve.iot_id, 'actual_flow': 50} for valve in self.valves])
+        self.assertEqual((len(commands), errors), (3, []))
+        self.assertEqual(len(batch), len(single))
+
+    def test_queued_setpoints_are_delivered_by_the_dispatcher(self):
+        """ La petición solo encola; el despachador entrega la consigna al controlador después. """
+        server = FakeESP32Server().start()
+        self.addCleanup(server.stop)
+        DeviceEndpoint.objects.create(device=self.valves[0], host=server.server_address[0], port=server.server_address[1])
+        # Solo se despacha la válvula con controlador simulado
+        ValveCommand.objects.exclude(device=self.valves[0]).update(status=ValveCommand.SUPERSEDED)
+
+        response = self.client.post(reverse('batch_update_valve_flow'), [{'iot_id': self.valves[0].iot_id, 'actual_flow': 12}], format='json')
+        result = response.data['results'][0]
+        self.assertEqual(result['status'], 'queued')
+        self.assertEqual(server.angles, [])
+
+        dispatcher = ValveDispatcher()
+        self.addCleanup(dispatcher.sessions.close)
+        self.assertEqual(dispatcher.run_once(), 1)
+        self.assertEqual(server.angles, [12])
+        self.assertEqual(ValveCommand.objects.get(id=result['command']).status, ValveCommand.SENT)
+
+class HeartbeatTest(TestCase):
+    def setUp(self):
+        self.devices = [IoTDevice.objects.create(name=f'Antena {n}', device_type_id='01') for n in range(3)]
+        self.now = timezone.now()
+
+    def test_activity_is_coalesced_and_never_moves_back(self):
+        """ Muchas lecturas se escriben como una actualización por dispositivo; una hora anterior no pisa una posterior. """
+        tracker = HeartbeatTracker()
+        for second in range(100):
+            tracker.record([device.iot_id for device in self.devices], self.now + timedelta(seconds=second))
+        self.assertEqual(len(tracker), 3)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(tracker.flush(), 3)
+        self.assertEqual(len(queries), 2)
+
+        tracker.record([self.devices[0].iot_id], self.now)
+        self.assertEqual(tracker.flush(), 0)
+        device = IoTDevice.objects.get(iot_id=self.devices[0].iot_id)
+        self.assertEqual((device.online, device.last_seen), (True, self.now + timedelta(seconds=99)))
+
+    def test_scanner_flags_devices_missing_intervals_and_health_counts_them(self):
+        """ Se marcan fuera de línea solo los dispositivos sin reportes durante los intervalos configurados. """
+        tracker = HeartbeatTracker()
+        tracker.record([self.devices[0].iot_id], self.now - timedelta(minutes=20))
+        tracker.record([self.devices[1].iot_id], self.now - timedelta(minutes=5))
+        tracker.flush()
+
+        scanner = OfflineScanner(missed_intervals=3, default_interval=300)
+        self.assertEqual(scanner.scan(self.now), [self.devices[0].iot_id])
+        self.assertEqual(scanner.scan(self.now), [])
+        # El dispositivo que reportó hace 5 minutos vence a los 15
+        self.assertEqual(scanner.scan(self.now + timedelta(minutes=11)), [self.devices[1].iot_id])
+
+        tracker.record([self.devices[0].iot_id], self.now)
+        tracker.flush()
+        health = fleet_health()
+        counts = {'total': 3, 'active': 3, 'online': 1, 'offline': 1, 'never_seen': 1}
+        self.assertEqual({key: health[key] for key in counts}, counts)
+        self.assertEqual(health['by_type'], [{'device_type': '01', 'name': self.devices[0].device_type.name, **counts}])
+
+        client = APIClient()
+        client.force_authenticate(CustomUser.objects.create_user(
+            document='123456789', first_name='Test', last_name='User',
+            email='test@example.com', phone='1234567890', password='testpass123',
+        ))
+        response = client.get(reverse('iot_fleet_health'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, health)
+
+
+class TelemetryTest(TestCase):
+    def setUp(self):
+        # Las variables creadas en otras pruebas se revierten con su transacción
+        get_metric_registry().invalidate()
+        self.battery = IoTDevice.objects.create(name='Batería', device_type_id='11')
+        self.panel = IoTDevice.objects.create(name='Panel solar', device_type_id='07')
+        self.meter = IoTDevice.objects.create(name='Medidor', device_type_id='04')
+        self.start = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=2)
+
+    def test_batch_ingestion_interns_metrics_and_rolls_up(self):
+        """ Las variables se registran una vez, las lecturas se guardan en bloque y se agregan por intervalo. """
+        readings = [
+            {'device': self.battery.iot_id, 'timestamp': (self.start + timedelta(seconds=30 * i)).isoformat(),
+             'values': {'battery_voltage': 12 + i / 100, 'battery_current': 1.5}}
+            for i in range(120)
+        ] + [
+            {'device': self.panel.iot_id, 'timestamp': self.start.isoformat(), 'metric': 'solar_power', 'value': 250},
+            {'device': self.meter.iot_id, 'timestamp': self.start.isoformat(), 'metric': 'flow', 'value': 1},
+            {'device': self.panel.iot_id, 'timestamp': self.start.isoformat(), 'metric': 'Solar Power', 'value': 1},
+        ]
+        result = ingest_telemetry(readings)
+        self.assertEqual(result['created'], 241)
+        self.assertEqual(result['metrics'], ['battery_current', 'battery_voltage', 'solar_power'])
+        self.assertEqual([error['index'] for error in result['rejected']], [121, 122])
+        self.assertEqual(TelemetryMetric.objects.count(), 3)
+
+        voltage = TelemetryMetric.objects.get(name='battery_voltage')
+        hour = TelemetryRollup.objects.get(device=self.battery, metric=voltage, bucket='hour', bucket_start=self.start)
+        self.assertEqual(hour.count, 120)
+        self.assertAlmostEqual(hour.min_value, 12)
+        self.assertAlmostEqual(hour.last_value, 13.19)
+
+        # Un segundo envío reutiliza las variables y se suma a los agregados existentes
+        ingest_telemetry([{'device': self.battery.iot_id, 'timestamp': self.start.isoformat(), 'metric': 'battery_voltage', 'value': 11}])
+        hour.refresh_from_db()
+        self.assertEqual((hour.count, hour.min_value), (121, 11))
+        self.assertAlmostEqual(hour.last_value, 13.19)
+        self.assertEqual(TelemetryReading.objects.filter(metric=voltage).count(), 121)
+
+    def test_rollup_endpoint(self):
+        """ La consulta de agregados elige el intervalo y devuelve las estadísticas de la variable. """
+        ingest_telemetry([
+            {'device': self.panel.iot_id, 'timestamp': (self.start + timedelta(minutes=m)).isoformat(), 'metric': 'solar_power', 'value': m}
+            for m in range(0, 120, 10)
+        ])
+        user = CustomUser.objects.create_user(
+            document='123456789', first_name='Test', last_name='User',
+            email='test@example.com', phone='1234567890', password='testpass123',
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get(reverse('telemetry_rollups'), {
+            'device': self.panel.iot_id, 'metric': 'solar_power', 'bucket': 'hour',
+            'from': self.start.isoformat(), 'to': (self.start + timedelta(hours=2)).isoformat(),
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['count'] for row in response.data['results']], [6, 6])
+        self.assertEqual([row['mean_value'] for row in response.data['results']], [25, 85])
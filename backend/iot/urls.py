@@ -4,7 +4,9 @@ from .views import (
     DeactivateIoTDevice,DeviceTypeListCreateView, 
     DeviceTypeDetailView,DeviceTypeUpdateView, 
     DeviceTypeDeleteView,IoTDeviceListView,
-    IoTDeviceDetailView, IoTDeviceUpdateView, UpdateValveFlowView)
+    IoTDeviceDetailView, IoTDeviceUpdateView, UpdateValveFlowView,
+    BatchValveFlowView, FleetHealthView,
+    TelemetryBulkView, TelemetryRollupView)
 
 urlpatterns = [
     #endpoint dispositivo iot
@@ -12,6 +14,7 @@ urlpatterns = [
     path('iot-devices/<str:iot_id>/activate', ActivateIoTDevice.as_view(), name='activate_iot_device'),# PATCH
     path('iot-devices/<str:iot_id>/desactivate', DeactivateIoTDevice.as_view(), name='deactivate_iot_device'),# PATCH
     path('iot-devices', IoTDeviceListView.as_view(), name='list_iot_devices'),  # 🔹 Ver todos GET
+    path('iot-devices/health', FleetHealthView.as_view(), name='iot_fleet_health'),  # 🔹 Estado de la flota GET (antes de iot-devices/<iot_id>)
     path('iot-devices/<str:iot_id>', IoTDeviceDetailView.as_view(), name='get_iot_device'),  # 🔹 Ver uno GET
     path('iot-devices/<str:iot_id>/update', IoTDeviceUpdateView.as_view(), name='update_iot_device'),  # 🔹 Actualizar PUT tods los datos , PATCH parcial
     #endpints tipo de dispositivos
@@ -19,6 +22,11 @@ urlpatterns = [
     path('device-types/<str:device_id>', DeviceTypeDetailView.as_view(), name='get_device_type'),  # 🔹 Ver uno GET
     path('device-types/<str:device_id>/update', DeviceTypeUpdateView.as_view(), name='update_device_type'),  # 🔹 Actualizar PUT
     path('device-types/<str:device_id>/delete', DeviceTypeDeleteView.as_view(), name='delete_device_type'),  # 🔹 Eliminar DELETE
+    # Endpoint para actualizar el caudal de varias válvulas (antes de update-flow/<iot_id>)
+    path('update-flow/batch', BatchValveFlowView.as_view(), name='batch_update_valve_flow'),  # 🔹 Actualizar caudales POST
     # Endpoint para actualizar el caudal de una válvula
-    path('update-flow/<str:iot_id>', UpdateValveFlowView.as_view(), name='update_valve_flow')  # 🔹 Actualizar caudal PUT
+    path('update-flow/<str:iot_id>', UpdateValveFlowView.as_view(), name='update_valve_flow'),  # 🔹 Actualizar caudal PUT
+    # Telemetría de dispositivos que no son de caudal
+    path('telemetry/bulk', TelemetryBulkView.as_view(), name='telemetry_bulk_create'),  # 🔹 Registrar lecturas POST
+    path('telemetry/rollups', TelemetryRollupView.as_view(), name='telemetry_rollups'),  # 🔹 Agregados GET
 ]
\ No newline at end of file
@@ -0,0 +1,363 @@
+"""
+Envío asíncrono de consignas de caudal a las válvulas.
+
+Guardar una válvula ya no llama al ESP32 dentro de la petición: el cambio de
+`actual_flow` encola un `ValveCommand` en la misma transacción (bandeja de salida) y
+el despachador (`run_valve_dispatcher`) lo envía después:
+
+- Coalescencia: al encolar se reemplazan las consignas pendientes de la misma
+  válvula, y al despachar se toma solo la más reciente de cada válvula.
+- Colas por dispositivo: cada válvula tiene a lo sumo un trabajador del despachador
+  que le envía una consigna a la vez y reclama la siguiente en cuanto termina, de
+  modo que una válvula nunca recibe dos comandos a la vez ni fuera de orden, y una
+  válvula lenta o caída no retrasa a las demás.
+- Reintentos con espera exponencial (`IOT_VALVE_RETRY_BASE_SECONDS`, duplicada por
+  intento hasta `IOT_VALVE_RETRY_MAX_SECONDS`); tras `IOT_VALVE_MAX_ATTEMPTS` la
+  consigna queda como fallida.
+- Cada válvula se envía al controlador de su `DeviceEndpoint`, con una sesión HTTP
+  persistente por controlador y un límite de peticiones simultáneas a cada uno.
+- Cada consigna se reclama con una actualización condicional, por lo que pueden
+  correr varios despachadores a la vez sin enviar dos veces la misma.
+
+`apply_setpoints` cambia el caudal de muchas válvulas a la vez (p. ej. un turno de
+riego completo) con consultas por conjunto en lugar de un `save()` por válvula, y
+escribe en una sola inserción la entrada de auditlog que `save()` escribiría por
+cada válvula modificada.
+"""
+import copy
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import requests
+from requests.adapters import HTTPAdapter
+from auditlog.cid import get_cid
+from auditlog.context import auditlog_disabled, auditlog_value
+from auditlog.diff import model_instance_diff
+from auditlog.models import LogEntry
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from .models import IoTDevice, DeviceEndpoint, ValveCommand, VALVE_48_ID, VALVE_4_ID
+
+logger = logging.getLogger(__name__)
+
+VALVE_TYPES = (VALVE_48_ID, VALVE_4_ID)
+MAX_SETPOINT = 180  # L/s, como el validador de `IoTDevice.actual_flow`
+DEFAULT_ESP32_HOST = '172.20.10.2'
+DEFAULT_ESP32_PORT = 80
+DEFAULT_MAX_CONCURRENCY = 1
+DEFAULT_TIMEOUT = 3.0
+DEFAULT_WORKERS = 8
+DEFAULT_MAX_ATTEMPTS = 8
+DEFAULT_RETRY_BASE_SECONDS = 2.0
+DEFAULT_RETRY_MAX_SECONDS = 300.0
+DEFAULT_SENDING_TIMEOUT = 60.0
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def enqueue_setpoints(devices):
+    """Encola la consigna actual de cada válvula y reemplaza sus pendientes anteriores. Retorna los comandos."""
+    now = timezone.now()
+    with transaction.atomic():
+        ValveCommand.objects.filter(
+            device_id__in=[device.iot_id for device in devices], status=ValveCommand.PENDING
+        ).update(status=ValveCommand.SUPERSEDED)
+        return ValveCommand.objects.bulk_create([
+            ValveCommand(device=device, setpoint=device.actual_flow, next_attempt_at=now) for device in devices
+        ])
+
+
+def enqueue_setpoint(device):
+    """Encola la consigna actual de la válvula y reemplaza las pendientes anteriores."""
+    return enqueue_setpoints([device])[0]
+
+
+def _parse_setpoint(raw):
+    if not isinstance(raw, dict):
+        raise ValueError("Cada consigna debe ser un objeto JSON.")
+    iot_id = raw.get('iot_id')
+    if not iot_id or not isinstance(iot_id, str):
+        raise ValueError("El campo 'iot_id' es obligatorio.")
+    flow = raw.get('actual_flow')
+    if isinstance(flow, bool) or not isinstance(flow, (int, float)):
+        raise ValueError("El campo 'actual_flow' debe ser numérico.")
+    if not 0 <= flow <= MAX_SETPOINT:
+        raise ValueError(f"El caudal debe estar entre 0 y {MAX_SETPOINT} L/s.")
+    return iot_id, float(flow)
+
+
+def _auditar_consignas(cambios, actor=None):
+    """Entradas de auditlog de las válvulas modificadas `[(anterior, actual)]`, como las de `save()`, en una inserción."""
+    if auditlog_disabled.get():
+        return
+    content_type = ContentType.objects.get_for_model(IoTDevice)
+    cid, remote_addr = get_cid(), auditlog_value.get({}).get('remote_addr')
+    actor = actor if getattr(actor, 'is_authenticated', False) else None
+    LogEntry.objects.bulk_create([
+        LogEntry(
+            content_type=content_type,
+            object_pk=device.pk,
+            object_repr=str(device),
+            action=LogEntry.Action.UPDATE,
+            changes=model_instance_diff(previous, device),
+            actor=actor,
+            cid=cid,
+            remote_addr=remote_addr,
+        )
+        for previous, device in cambios
+    ])
+
+
+def apply_setpoints(raw_setpoints, actor=None):
+    """
+    Valida y aplica un lote de consignas `{'iot_id', 'actual_flow'}`.
+
+    La validación usa una sola consulta para todas las válvulas: cambiar el caudal no
+    modifica la asignación a predios o lotes, por lo que no se repiten las
+    verificaciones de unicidad de `IoTDevice.full_clean()`. Las válidas se guardan con
+    `bulk_update`, se auditan a nombre de `actor` y se encolan en la misma transacción
+    para el despachador. Retorna `(comandos, errores)`:
+    el comando creado por índice de la consigna y los errores `{'index', 'iot_id', 'error'}`.
+    """
+    parsed, errors, seen = {}, [], set()
+    for index, raw in enumerate(raw_setpoints):
+        try:
+            iot_id, flow = _parse_setpoint(raw)
+        except ValueError as exc:
+            errors.append({'index': index, 'iot_id': raw.get('iot_id') if isinstance(raw, dict) else None, 'error': str(exc)})
+            continue
+        if iot_id in seen:
+            errors.append({'index': index, 'iot_id': iot_id, 'error': "La válvula aparece más de una vez en el envío."})
+            continue
+        seen.add(iot_id)
+        parsed[index] = (iot_id, flow)
+
+    commands = {}
+    with transaction.atomic():
+        devices = IoTDevice.objects.select_for_update(of=('self',)).select_related('device_type').in_bulk(
+            [iot_id for iot_id, _ in parsed.values()]
+        )
+        updated, previous = {}, {}
+        for index, (iot_id, flow) in parsed.items():
+            device = devices.get(iot_id)
+            if device is None:
+                errors.append({'index': index, 'iot_id': iot_id, 'error': "Dispositivo no encontrado."})
+            elif device.device_type_id not in VALVE_TYPES:
+                errors.append({'index': index, 'iot_id': iot_id, 'error': "Solo se puede actualizar el caudal para válvulas."})
+            elif device.actual_flow == flow:
+                errors.append({'index': index, 'iot_id': iot_id, 'error': "Ya tienes un caudal activo con ese valor. Debes solicitar un valor diferente."})
+            else:
+                previous[index] = copy.copy(device)
+                device.actual_flow = flow
+                updated[index] = device
+        if updated:
+            IoTDevice.objects.bulk_update(list(updated.values()), ['actual_flow'])
+            _auditar_consignas([(previous[index], device) for index, device in updated.items()], actor)
+            commands = dict(zip(updated, enqueue_setpoints(list(updated.values()))))
+
+    errors.sort(key=lambda error: error['index'])
+    return commands, errors
+
+
+class ControllerSessions:
+    """
+    Sesiones HTTP con conexiones persistentes y límite de peticiones simultáneas por controlador.
+
+    El controlador de cada válvula sale de su `DeviceEndpoint`; las válvulas sin
+    dirección registrada usan `IOT_ESP32_HOST`/`IOT_ESP32_PORT`. La sesión y el límite
+    de un controlador se crean en su primer envío.
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout or _setting('IOT_VALVE_TIMEOUT', DEFAULT_TIMEOUT)
+        self._controllers = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def resolve(device):
+        """Retorna `((host, puerto), peticiones simultáneas)` del controlador del dispositivo."""
+        try:
+            endpoint = device.endpoint
+        except DeviceEndpoint.DoesNotExist:
+            return (
+                (_setting('IOT_ESP32_HOST', DEFAULT_ESP32_HOST), _setting('IOT_ESP32_PORT', DEFAULT_ESP32_PORT)),
+                _setting('IOT_ESP32_MAX_CONCURRENCY', DEFAULT_MAX_CONCURRENCY),
+            )
+        return endpoint.controller, endpoint.max_concurrency
+
+    def _controller(self, controller, max_concurrency):
+        with self._lock:
+            if controller not in self._controllers:
+                session = requests.Session()
+                session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency))
+                self._controllers[controller] = (session, threading.BoundedSemaphore(max_concurrency))
+            return self._controllers[controller]
+
+    def send(self, command):
+        """Envía la consigna al controlador de la válvula. Lanza una excepción si no responde correctamente."""
+        controller, max_concurrency = self.resolve(command.device)
+        session, slots = self._controller(controller, max_concurrency)
+        host, port = controller
+        angle = int(command.setpoint)  # Conversión directa temporal
+        with slots:
+            response = session.get(f"http://{host}:{port}/setangle", params={'angle': angle}, timeout=self.timeout)
+        response.raise_for_status()
+
+    def close(self):
+        with self._lock:
+            for session, _ in self._controllers.values():
+                session.close()
+            self._controllers.clear()
+
+
+def retry_delay(attempts):
+    base = _setting('IOT_VALVE_RETRY_BASE_SECONDS', DEFAULT_RETRY_BASE_SECONDS)
+    return min(base * 2 ** (attempts - 1), _setting('IOT_VALVE_RETRY_MAX_SECONDS', DEFAULT_RETRY_MAX_SECONDS))
+
+
+class ValveDispatcher:
+    """
+    Despacha las consignas pendientes con un grupo de hilos y una cola por válvula.
+
+    Cada válvula con consignas vencidas recibe un trabajador propio que le envía una
+    consigna a la vez y, al terminar, reclama enseguida la siguiente de esa misma
+    válvula; una válvula lenta o caída solo retrasa su propia cola, no la ronda.
+    """
+
+    def __init__(self, workers=None, sender=None, max_attempts=None):
+        self.workers = workers or _setting('IOT_VALVE_WORKERS', DEFAULT_WORKERS)
+        self.sessions = None if sender else ControllerSessions()
+        self.sender = sender or self.sessions.send
+        self.max_attempts = max_attempts or _setting('IOT_VALVE_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self._executor = None
+        self._busy = set()  # Válvulas con un trabajador en curso
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='iot-valve')
+        return self
+
+    def __exit__(self, *exc_info):
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        if self.sessions is not None:
+            self.sessions.close()
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def recover(self):
+        """Devuelve a pendientes las consignas que quedaron enviándose (p. ej. tras un corte del proceso)."""
+        stale = timezone.now() - timedelta(seconds=_setting('IOT_VALVE_SENDING_TIMEOUT', DEFAULT_SENDING_TIMEOUT))
+        return ValveCommand.objects.filter(status=ValveCommand.SENDING, next_attempt_at__lt=stale).update(
+            status=ValveCommand.PENDING
+        )
+
+    def claim(self, device_id=None, exclude=()):
+        """
+        Reclama la consigna vencida más reciente de cada válvula y reemplaza las anteriores.
+
+        Con `device_id` reclama solo la de esa válvula; `exclude` omite las válvulas que
+        ya tienen una consigna en curso en este despachador.
+        """
+        now = timezone.now()
+        due = ValveCommand.objects.filter(status=ValveCommand.PENDING, next_attempt_at__lte=now)
+        if device_id is not None:
+            due = due.filter(device_id=device_id)
+        if exclude:
+            due = due.exclude(device_id__in=list(exclude))
+        latest = {}
+        for command in due.select_related('device__endpoint').order_by('device_id', '-id'):
+            latest.setdefault(command.device_id, command)
+        if not latest:
+            return []
+        ValveCommand.objects.filter(
+            device_id__in=list(latest), status=ValveCommand.PENDING
+        ).exclude(id__in=[command.id for command in latest.values()]).update(status=ValveCommand.SUPERSEDED)
+
+        claimed = []
+        for command in latest.values():
+            # Condicional: otro despachador pudo haberla tomado o una consigna nueva reemplazarla
+            if ValveCommand.objects.filter(id=command.id, status=ValveCommand.PENDING).update(
+                status=ValveCommand.SENDING, next_attempt_at=now
+            ):
+                claimed.append(command)
+        return claimed
+
+    def deliver(self, command):
+        try:
+            self.sender(command)
+        except Exception as exc:
+            self._record_failure(command, exc)
+        else:
+            ValveCommand.objects.filter(id=command.id).update(
+                status=ValveCommand.SENT, attempts=command.attempts + 1, sent_at=timezone.now(), last_error=""
+            )
+            self._count('sent')
+        finally:
+            close_old_connections()
+
+    def _drain(self, command):
+        """Trabajador de una válvula: envía su consigna y las siguientes que venzan mientras tanto."""
+        device_id = command.device_id
+        try:
+            while command is not None:
+                self.deliver(command)
+                next_commands = self.claim(device_id=device_id)
+                command = next_commands[0] if next_commands else None
+        finally:
+            with self._lock:
+                self._busy.discard(device_id)
+            close_old_connections()
+
+    def _record_failure(self, command, exc):
+        attempts = command.attempts + 1
+        error = str(exc)[:300]
+        if attempts >= self.max_attempts:
+            ValveCommand.objects.filter(id=command.id).update(
+                status=ValveCommand.FAILED, attempts=attempts, last_error=error
+            )
+            self._count('failed')
+            logger.error("La válvula %s no recibió la consigna %s tras %s intentos: %s", command.device_id, command.id, attempts, error)
+            return
+        ValveCommand.objects.filter(id=command.id).update(
+            status=ValveCommand.PENDING, attempts=attempts, last_error=error,
+            next_attempt_at=timezone.now() + timedelta(seconds=retry_delay(attempts)),
+        )
+        # Si mientras tanto se encoló una consigna más reciente, esta ya no debe reintentarse
+        if ValveCommand.objects.filter(device_id=command.device_id, id__gt=command.id).exists():
+            ValveCommand.objects.filter(id=command.id, status=ValveCommand.PENDING).update(status=ValveCommand.SUPERSEDED)
+        self._count('retried')
+        logger.warning("Error enviando la consigna %s a la válvula %s (intento %s): %s", command.id, command.device_id, attempts, error)
+
+    def run_once(self):
+        """
+        Reclama las consignas vencidas de las válvulas sin envío en curso. Retorna cuántas reclamó.
+
+        Dentro del contexto (`with ValveDispatcher() as dispatcher`) cada consigna pasa al
+        trabajador de su válvula y la ronda no espera a que terminen; fuera de él se
+        envían en este hilo, una tras otra.
+        """
+        if self._executor is None:
+            commands = self.claim()
+            for command in commands:
+                self.deliver(command)
+            return len(commands)
+
+        with self._lock:
+            busy = set(self._busy)
+        commands = self.claim(exclude=busy)
+        with self._lock:
+            self._busy.update(command.device_id for command in commands)
+        for command in commands:
+            self._executor.submit(self._drain, command)
+        return len(commands)
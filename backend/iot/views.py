@@ -3,8 +3,13 @@ from rest_framework.views import APIView
 from rest_framework import generics, viewsets
 from rest_framework.response import Response
 from rest_framework import status
-from .serializers import IoTDeviceSerializer, DeviceTypeSerializer, UpdateValveFlowSerializer
-from .models import IoTDevice, DeviceType
+from .serializers import IoTDeviceSerializer, DeviceTypeSerializer, UpdateValveFlowSerializer, TelemetryRollupSerializer
+from .models import IoTDevice, DeviceType, TelemetryMetric, TELEMETRY_BUCKET_CHOICES
+from .valves import apply_setpoints
+from .heartbeat import fleet_health
+from .telemetry import ingest_telemetry, consultar_rollups, get_max_readings
+from caudal.filters import parse_time_range
+from django.conf import settings
 from django.shortcuts import get_object_or_404
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 
@@ -58,6 +63,18 @@ class IoTDeviceListView(generics.ListAPIView):
     queryset = IoTDevice.objects.all()
     serializer_class = IoTDeviceSerializer
 
+# 🔹 Estado de la flota: dispositivos en línea, fuera de línea y sin reportes
+class FleetHealthView(APIView):
+    """
+    Conteos de dispositivos totales, activos, en línea, fuera de línea y sin reportes,
+    en total y por tipo. Se calculan sobre `IoTDevice` (`online`, `last_seen`), sin
+    consultar las tablas de mediciones.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response(fleet_health(), status=status.HTTP_200_OK)
+
 # 🔹 Ver un dispositivo específico por iot_id
 class IoTDeviceDetailView(generics.RetrieveAPIView):
     queryset = IoTDevice.objects.all()
@@ -93,6 +110,44 @@ class UpdateValveFlowView(generics.UpdateAPIView):
         serializer.save()
         return Response({"message": "Caudal actualizado exitosamente."}, status=status.HTTP_200_OK)
 
+# 🔹 Actualizar el caudal de varias válvulas a la vez
+class BatchValveFlowView(APIView):
+    """
+    Aplica un lote de consignas `[{"iot_id", "actual_flow"}, ...]` (o `{"setpoints": [...]}`).
+
+    Las consignas válidas se guardan aunque otras del envío sean rechazadas y quedan
+    `queued` en la bandeja de salida: el despachador (`run_valve_dispatcher`) las envía
+    a los controladores fuera de la petición. Cada resultado trae el id del comando
+    encolado (`command`) para seguir su estado.
+    """
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def post(self, request):
+        setpoints = request.data
+        if isinstance(setpoints, dict):
+            setpoints = setpoints.get('setpoints')
+        if not isinstance(setpoints, list) or not setpoints:
+            return Response({"error": "Se esperaba una lista de consignas."}, status=status.HTTP_400_BAD_REQUEST)
+
+        max_setpoints = getattr(settings, 'IOT_VALVE_BATCH_MAX', 1000)
+        if len(setpoints) > max_setpoints:
+            return Response(
+                {"error": f"El envío supera el máximo de {max_setpoints} consignas."},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+
+        commands, errors = apply_setpoints(setpoints, actor=request.user)
+        results = {
+            index: {"iot_id": command.device_id, "actual_flow": command.setpoint, "status": "queued", "command": command.id}
+            for index, command in commands.items()
+        }
+        for error in errors:
+            results[error['index']] = {"iot_id": error['iot_id'], "status": "rejected", "error": error['error']}
+        return Response(
+            {"applied": len(commands), "rejected": len(errors), "results": [results[index] for index in sorted(results)]},
+            status=status.HTTP_200_OK if commands else status.HTTP_400_BAD_REQUEST
+        )
+
 # 🔹 Listar todos los tipos de dispositivos y crear uno nuevo
 class DeviceTypeListCreateView(generics.ListCreateAPIView):
     queryset = DeviceType.objects.all()
@@ -119,4 +174,64 @@ class DeviceTypeDeleteView(generics.DestroyAPIView):
     def delete(self, request, *args, **kwargs):
         instance = self.get_object()
         self.perform_destroy(instance)
-        return Response({"message": "Tipo de dispositivo eliminado exitosamente."}, status=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+        return Response({"message": "Tipo de dispositivo eliminado exitosamente."}, status=status.HTTP_204_NO_CONTENT)
+
+# 🔹 Registrar lecturas de telemetría (baterías, paneles solares, controladores, convertidores)
+class TelemetryBulkView(APIView):
+    """
+    Ingesta masiva de telemetría de dispositivos que no son de caudal.
+
+    Acepta un arreglo JSON (o `{"readings": [...]}`) de lecturas
+    `{"device", "timestamp", "metric", "value"}` o `{"device", "timestamp", "values": {...}}`
+    con varias variables a la vez. Las variables nuevas se registran al recibirlas.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        readings = request.data
+        if isinstance(readings, dict):
+            readings = readings.get('readings')
+        if not isinstance(readings, list):
+            return Response({"error": "Se esperaba una lista de lecturas."}, status=status.HTTP_400_BAD_REQUEST)
+
+        max_readings = get_max_readings()
+        if len(readings) > max_readings:
+            return Response(
+                {"error": f"El envío supera el máximo de {max_readings} lecturas."},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+
+        result = ingest_telemetry(readings)
+        if readings and not result['created']:
+            return Response(result, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result, status=status.HTTP_201_CREATED)
+
+# 🔹 Consultar agregados de telemetría de un dispositivo
+class TelemetryRollupView(APIView):
+    """
+    Agregados de una variable de un dispositivo en un rango de fechas.
+
+    Parámetros: `device`, `metric` (nombre), `from`, `to` y opcionalmente `bucket`
+    (minute, hour o day); sin `bucket` se elige como en los agregados de caudal.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        device = request.query_params.get('device')
+        metric = request.query_params.get('metric')
+        bucket = request.query_params.get('bucket') or None
+        if not device or not metric:
+            return Response({"error": "Los parámetros 'device' y 'metric' son obligatorios."}, status=status.HTTP_400_BAD_REQUEST)
+        if bucket and bucket not in dict(TELEMETRY_BUCKET_CHOICES):
+            return Response({"error": "El intervalo debe ser minute, hour o day."}, status=status.HTTP_400_BAD_REQUEST)
+        metric_obj = get_object_or_404(TelemetryMetric, name=metric)
+
+        inicio, fin = parse_time_range(request.query_params, required=True)
+        bucket, rollups = consultar_rollups(device, metric_obj.id, inicio, fin, bucket)
+        return Response({
+            "device": device,
+            "metric": metric_obj.name,
+            "unit": metric_obj.unit,
+            "bucket": bucket,
+            "results": TelemetryRollupSerializer(rollups, many=True).data,
+        })